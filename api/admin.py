@@ -1,5 +1,39 @@
+from django import forms
 from django.contrib import admin
-from .models import Amenities, Appointment, Message, Services, OperationHours, Comments, Barbershop, Profile
+from django.db import transaction
+from .booking import SlotTaken, claim_slots, reschedule_appointment, slots_taken
+from .models import Amenities, Appointment, Message, Services, OperationHours, Comments, Barbershop, AppointmentSlot, Favorite, LeaderboardEntry, MapCluster, MediaUpload, Profile, Tombstone
+
+
+class AppointmentAdminForm(forms.ModelForm):
+    class Meta:
+        model = Appointment
+        fields = "__all__"
+
+    def clean(self):
+        data = super().clean()
+        barbershop, date, time = data.get("barbershop"), data.get("date"), data.get("time")
+        changed = self.instance._state.adding or {"barbershop", "date", "time"} & set(self.changed_data)
+        if barbershop and date and time and changed and slots_taken(barbershop.pk, date, time, self.instance.pk):
+            raise forms.ValidationError(SlotTaken.default_detail)
+        return data
+
+
+class AppointmentAdmin(admin.ModelAdmin):
+    """
+    Claims and moves the slot rows of appointments edited here the way the
+    API does, see api.booking.
+    """
+    form = AppointmentAdminForm
+
+    def save_model(self, request, obj, form, change):
+        with transaction.atomic():
+            super().save_model(request, obj, form, change)
+            if not change and obj.barbershop_id is not None:
+                claim_slots(obj.barbershop_id, obj)
+            elif change and {"barbershop", "date", "time"} & set(form.changed_data):
+                reschedule_appointment(obj)
+
 
 # Register your models here.
 admin.site.register(Amenities)
@@ -9,4 +43,10 @@ admin.site.register(Comments)
 admin.site.register(Barbershop)
 admin.site.register(Profile)
 admin.site.register(Message)
-admin.site.register(Appointment)
\ No newline at end of file
+admin.site.register(Appointment, AppointmentAdmin)
+admin.site.register(MapCluster)
+admin.site.register(LeaderboardEntry)
+admin.site.register(AppointmentSlot)
+admin.site.register(Favorite)
+admin.site.register(Tombstone)
+admin.site.register(MediaUpload)
@@ -0,0 +1,120 @@
+import threading
+import time
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import DEFAULT_DB_ALIAS
+from django.utils.translation import gettext_lazy as _
+from drf_spectacular.contrib.rest_framework_simplejwt import SimpleJWTScheme
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+# Claims MyTokenObtainPairSerializer adds to the tokens it issues; access
+# tokens minted on refresh copy them from the refresh token.
+ACCOUNT_TYPE_CLAIM = "account_type"
+IS_ACTIVE_CLAIM = "is_active"
+# When the claims were read from the database, as a Unix timestamp with
+# the same sub-second resolution as the change times they are checked against
+CLAIMS_AT_CLAIM = "claims_at"
+
+_users = {}
+_changed = {}
+_pruned_at = 0
+_lock = threading.Lock()
+
+
+def token_claims(user):
+    profile = getattr(user, "profile", None)
+    return {
+        ACCOUNT_TYPE_CLAIM: profile.account_type if profile is not None else None,
+        IS_ACTIVE_CLAIM: user.is_active,
+        CLAIMS_AT_CLAIM: time.time(),
+    }
+
+
+def forget_user(user_id):
+    """
+    Drops the cached state of a user and stops trusting the claims of tokens
+    issued before now, see api.signals.
+    """
+    now = time.time()
+    with _lock:
+        _users.pop(user_id, None)
+        _changed[user_id] = now
+        _prune(now)
+
+
+def _prune(now):
+    """
+    Drops expired users and change times older than AUTH_USER_CACHE_TTL,
+    at most once per TTL. Claims that old are reloaded whatever the change
+    time, so it no longer matters. Call with the lock held.
+    """
+    global _pruned_at
+    ttl = settings.AUTH_USER_CACHE_TTL
+    if now - _pruned_at < ttl:
+        return
+    _pruned_at = now
+    for user_id in [user_id for user_id, changed in _changed.items() if changed <= now - ttl]:
+        del _changed[user_id]
+    for user_id in [user_id for user_id, cached in _users.items() if cached[0] <= now]:
+        del _users[user_id]
+
+
+def build_user(user_id, is_active, account_type):
+    # Everything but the id and active flag is deferred and loaded only if
+    # a handler reads it
+    user = User.from_db(DEFAULT_DB_ALIAS, ["id", "is_active"], [user_id, is_active])
+    user.account_type = account_type
+    return user
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication without the User query per request.
+
+    The user is built from the token's claims while they are younger than
+    AUTH_USER_CACHE_TTL, otherwise from a single query whose result is kept
+    in process for that long. A user or profile saved in this process is
+    reloaded on its next request; other processes see the change within
+    the TTL. Tokens issued before the claims existed are looked up as usual.
+
+    ``request.user`` is a User with only ``id`` and ``is_active`` loaded and
+    the profile's ``account_type`` set as an attribute.
+    """
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+        if CLAIMS_AT_CLAIM not in validated_token:
+            return super().get_user(validated_token)
+
+        now = time.time()
+        ttl = settings.AUTH_USER_CACHE_TTL
+        cached = _users.get(user_id)
+        if cached is not None and cached[0] > now:
+            is_active, account_type = cached[1:]
+        else:
+            claims_at = validated_token[CLAIMS_AT_CLAIM]
+            if claims_at > now - ttl and claims_at > _changed.get(user_id, 0):
+                is_active, account_type = validated_token[IS_ACTIVE_CLAIM], validated_token[ACCOUNT_TYPE_CLAIM]
+            else:
+                row = User.objects.filter(pk=user_id).values_list("is_active", "profile__account_type").first()
+                if row is None:
+                    raise AuthenticationFailed(_("User not found"), code="user_not_found")
+                is_active, account_type = row
+            with _lock:
+                # Unless forgotten meanwhile
+                if _changed.get(user_id, 0) < now:
+                    _users[user_id] = (now + ttl, is_active, account_type)
+                _prune(now)
+
+        if not is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+        return build_user(user_id, is_active, account_type)
+
+
+class CachedJWTScheme(SimpleJWTScheme):
+    # Documents the same bearer scheme as JWTAuthentication
+    target_class = "api.authentication.CachedJWTAuthentication"
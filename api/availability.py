@@ -0,0 +1,98 @@
+import datetime
+from django.core.cache import cache
+from django.utils import timezone
+from .routers import primary_reads
+
+# Appointments last an hour; AppointmentsSerializer.validate rejects any
+# booking that starts less than this long before or after another one.
+APPOINTMENT_DURATION = datetime.timedelta(minutes=60)
+AVAILABILITY_MAX_DAYS = 31
+AVAILABILITY_CACHE_TIMEOUT = 60
+
+
+def _generation_key(barbershop_id):
+    return "availability-generation:{}".format(barbershop_id)
+
+
+def invalidate_availability(barbershop_id):
+    """
+    Drops the cached availability of a shop by moving it to a new cache
+    generation, so every cached date range is invalidated at once.
+    """
+    try:
+        cache.incr(_generation_key(barbershop_id))
+    except ValueError:
+        cache.set(_generation_key(barbershop_id), 1, None)
+
+
+def _matches_day(day, date):
+    day = day.strip().lower()
+    name = date.strftime("%A").lower()
+    return day == name or day == name[:3]
+
+
+def _opening_slots(hours, date):
+    slots = set()
+    for hour in hours:
+        if not _matches_day(hour.day, date):
+            continue
+        start = datetime.datetime.combine(date, hour.opening_time)
+        closing = datetime.datetime.combine(date, hour.closing_time)
+        while start + APPOINTMENT_DURATION <= closing:
+            slots.add(start)
+            start += APPOINTMENT_DURATION
+    return sorted(slots)
+
+
+def compute_free_slots(hours, booked, start, end):
+    """
+    Returns ``[(date, [datetime, ...]), ...]`` of the slots between ``start``
+    and ``end`` (inclusive) that do not overlap a booked appointment.
+
+    ``booked`` must be the ``(date, time)`` pairs of the appointments in the
+    range ordered by date and time. Slots are generated in the same order, so
+    a single forward pointer over ``booked`` finds every conflict.
+    """
+    booked = [datetime.datetime.combine(date, time) for date, time in booked]
+    index = 0
+    days = []
+    date = start
+    while date <= end:
+        free = []
+        for slot in _opening_slots(hours, date):
+            while index < len(booked) and booked[index] <= slot - APPOINTMENT_DURATION:
+                index += 1
+            if index < len(booked) and booked[index] < slot + APPOINTMENT_DURATION:
+                continue
+            free.append(slot)
+        days.append((date, free))
+        date += datetime.timedelta(days=1)
+    return days
+
+
+def free_slots(barbershop, start, end):
+    """
+    The free slots of a shop between two dates, from the cache when possible.
+
+    Computing them costs two queries, the shop's hours and its appointments
+    in the range, and the result is cached until the next booking,
+    cancellation or change of hours. Slots that have already started are
+    dropped on every read.
+    """
+    generation = cache.get(_generation_key(barbershop.pk), 0)
+    key = "availability:{}:{}:{}:{}".format(barbershop.pk, generation, start.isoformat(), end.isoformat())
+    days = cache.get(key)
+    if days is None:
+        # From the primary, a replica behind the generation would cache
+        # bookings it has not seen yet
+        with primary_reads():
+            hours = list(barbershop.hours.all())
+            booked = barbershop.appointments.filter(date__range=(start, end)).order_by("date", "time").values_list("date", "time")
+            days = compute_free_slots(hours, booked, start, end)
+        cache.set(key, days, AVAILABILITY_CACHE_TIMEOUT)
+
+    now = timezone.localtime().replace(tzinfo=None)
+    return [
+        {"date": date, "slots": [slot.time() for slot in slots if slot >= now]}
+        for date, slots in days
+    ]
@@ -0,0 +1,24 @@
+import contextvars
+from contextlib import contextmanager
+
+# Shops whose relations are being written together
+_batched = contextvars.ContextVar("batched_barbershops", default=frozenset())
+
+
+@contextmanager
+def batched_relations(barbershop):
+    """
+    Holds back the search reindex, version bump and leaderboard refresh each
+    change to a relation of ``barbershop`` triggers, see api.signals. The
+    caller must save() the shop before the block ends: that save reindexes,
+    bumps and re-ranks it once for all of them.
+    """
+    token = _batched.set(_batched.get() | {barbershop.pk})
+    try:
+        yield
+    finally:
+        _batched.reset(token)
+
+
+def is_batched(barbershop_id):
+    return barbershop_id in _batched.get()
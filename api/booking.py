@@ -0,0 +1,76 @@
+import math
+from django.db import IntegrityError, transaction
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from .availability import APPOINTMENT_DURATION
+from .models import AppointmentSlot
+
+# Appointments claim every SLOT_MINUTES bucket their hour overlaps; bookings
+# on the quarter hour conflict exactly when they overlap.
+SLOT_MINUTES = 15
+
+
+class SlotTaken(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = "Time already booked"
+    default_code = "slot_taken"
+
+
+def slot_range(time):
+    minutes = time.hour * 60 + time.minute + time.second / 60
+    duration = APPOINTMENT_DURATION.total_seconds() / 60
+    return range(int(minutes // SLOT_MINUTES), math.ceil((minutes + duration) / SLOT_MINUTES))
+
+
+def appointment_slots(barbershop_id, appointment):
+    return [
+        AppointmentSlot(barbershop_id=barbershop_id, appointment=appointment, date=appointment.date, slot=slot)
+        for slot in slot_range(appointment.time)
+    ]
+
+
+def slots_taken(barbershop_id, date, time, appointment_id=None):
+    """
+    Whether an appointment other than ``appointment_id`` holds a slot a
+    booking at ``date`` and ``time`` would claim.
+    """
+    return AppointmentSlot.objects.filter(
+        barbershop_id=barbershop_id, date=date, slot__in=slot_range(time)
+    ).exclude(appointment_id=appointment_id).exists()
+
+
+def claim_slots(barbershop_id, appointment):
+    """
+    Inserts the slot rows of an appointment, raising SlotTaken when another
+    appointment holds any of them. Must run inside ``transaction.atomic()``
+    so a conflict rolls the whole booking back.
+    """
+    try:
+        with transaction.atomic():
+            AppointmentSlot.objects.bulk_create(appointment_slots(barbershop_id, appointment))
+    except IntegrityError:
+        raise SlotTaken()
+
+
+def book_appointment(barbershop, serializer, user):
+    """
+    Saves a validated AppointmentsSerializer for ``barbershop``.
+
+    The serializer's overlap check gives a friendly error in the common case;
+    the slot rows are what keeps two concurrent requests for the same time
+    from both succeeding, without locking the table.
+    """
+    with transaction.atomic():
+        appointment = serializer.save(user=user, barbershop=barbershop)
+        claim_slots(barbershop.pk, appointment)
+    return appointment
+
+
+def reschedule_appointment(appointment):
+    """
+    Moves the slot rows of a saved appointment to its current date and time.
+    """
+    appointment.slots.all().delete()
+    if appointment.barbershop_id is not None:
+        claim_slots(appointment.barbershop_id, appointment)
+
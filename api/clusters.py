@@ -0,0 +1,101 @@
+from functools import reduce
+from operator import or_
+from django.db import transaction
+from django.db.models import F, Q
+from .geo import grid_column, grid_row
+from .models import MapCluster
+
+# Zoom levels follow web map tiles (zoom z splits the world into 2^z tiles
+# across); each tile is split into CLUSTER_CELLS_PER_TILE cells per side.
+CLUSTER_MAX_ZOOM = 16
+CLUSTER_CELLS_PER_TILE = 4
+
+
+def cell_size(zoom):
+    return 360 / (2 ** zoom) / CLUSTER_CELLS_PER_TILE
+
+
+def cluster_cells(latitude, longitude):
+    for zoom in range(CLUSTER_MAX_ZOOM + 1):
+        size = cell_size(zoom)
+        yield zoom, grid_row(latitude, size), grid_column(longitude, size)
+
+
+def _add(latitude, longitude, count, rating):
+    cells = list(cluster_cells(latitude, longitude))
+    clusters = MapCluster.objects.filter(
+        reduce(or_, (Q(zoom=zoom, row=row, column=column) for zoom, row, column in cells))
+    )
+    if clusters.count() < len(cells):
+        MapCluster.objects.bulk_create(
+            [MapCluster(zoom=zoom, row=row, column=column) for zoom, row, column in cells],
+            ignore_conflicts=True
+        )
+    clusters.update(
+        count=F("count") + count,
+        latitude_sum=F("latitude_sum") + latitude * count,
+        longitude_sum=F("longitude_sum") + longitude * count,
+        rating_sum=F("rating_sum") + rating
+    )
+
+
+def update_clusters(previous, current):
+    """
+    Moves a shop's contribution from the ``previous`` to the ``current``
+    cluster state, as returned by ``Barbershop.get_cluster_state``.
+    """
+    if previous == current:
+        return
+    with transaction.atomic():
+        if previous and current and previous[:2] == current[:2]:
+            _add(current[0], current[1], 0, current[2] - previous[2])
+            return
+        if previous:
+            _add(previous[0], previous[1], -1, -previous[2])
+        if current:
+            _add(current[0], current[1], 1, current[2])
+
+
+def build_clusters(points):
+    """
+    Aggregates ``(latitude, longitude, rating)`` points into
+    ``{(zoom, row, column): [count, latitude_sum, longitude_sum, rating_sum]}``.
+    """
+    totals = {}
+    for latitude, longitude, rating in points:
+        for cell in cluster_cells(latitude, longitude):
+            total = totals.setdefault(cell, [0, 0.0, 0.0, 0.0])
+            total[0] += 1
+            total[1] += latitude
+            total[2] += longitude
+            total[3] += rating
+    return totals
+
+
+def rebuild_clusters(barbershop_model, cluster_model):
+    """
+    Recomputes every cluster from the verified shops.
+    """
+    points = barbershop_model.objects.filter(verified=True).values_list("latitude", "longitude", "rating")
+    totals = build_clusters(points.iterator())
+    with transaction.atomic():
+        cluster_model.objects.all().delete()
+        cluster_model.objects.bulk_create([
+            cluster_model(
+                zoom=zoom, row=row, column=column,
+                count=count, latitude_sum=latitude_sum, longitude_sum=longitude_sum, rating_sum=rating_sum
+            )
+            for (zoom, row, column), (count, latitude_sum, longitude_sum, rating_sum) in totals.items()
+        ], batch_size=500)
+    return len(totals)
+
+
+def clusters_in_box(south, west, north, east, zoom):
+    zoom = min(zoom, CLUSTER_MAX_ZOOM)
+    size = cell_size(zoom)
+    return MapCluster.objects.filter(
+        zoom=zoom,
+        row__range=(grid_row(south, size), grid_row(north, size)),
+        column__range=(grid_column(west, size), grid_column(east, size)),
+        count__gt=0
+    )
@@ -0,0 +1,88 @@
+import math
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+# Barbershop.grid_cell buckets shops into GRID_CELL_DEGREES squares so a
+# proximity search can narrow candidates with an indexed IN lookup before the
+# latitude/longitude range and the exact distance are checked.
+GRID_CELL_DEGREES = 0.1
+# One extra column so longitude 180 gets a cell of its own.
+GRID_COLUMNS = int(round(360 / GRID_CELL_DEGREES)) + 1
+GRID_MAX_CELLS = 400
+
+
+def grid_row(latitude, size=GRID_CELL_DEGREES):
+    return int(math.floor((min(max(latitude, -90.0), 90.0) + 90) / size))
+
+
+def grid_column(longitude, size=GRID_CELL_DEGREES):
+    return int(math.floor((min(max(longitude, -180.0), 180.0) + 180) / size))
+
+
+def grid_cell(latitude, longitude):
+    return grid_row(latitude) * GRID_COLUMNS + grid_column(longitude)
+
+
+def bounding_box(latitude, longitude, radius):
+    """
+    Returns ``(south, west, north, east)`` enclosing every point within
+    ``radius`` km of the given coordinates. The box is clamped to valid
+    coordinates rather than wrapped around the poles or the antimeridian.
+    """
+    lat_delta = radius / KM_PER_DEGREE
+    cos_lat = math.cos(math.radians(latitude))
+    if cos_lat < 1e-6:
+        lng_delta = 180.0
+    else:
+        lng_delta = min(lat_delta / cos_lat, 180.0)
+    return (
+        max(latitude - lat_delta, -90.0),
+        max(longitude - lng_delta, -180.0),
+        min(latitude + lat_delta, 90.0),
+        min(longitude + lng_delta, 180.0),
+    )
+
+
+def grid_cells(south, west, north, east):
+    """
+    Returns the grid cells covering the box, or ``None`` when there are more
+    than GRID_MAX_CELLS of them and a plain range scan is cheaper.
+    """
+    rows = range(grid_row(south), grid_row(north) + 1)
+    columns = range(grid_column(west), grid_column(east) + 1)
+    if len(rows) * len(columns) > GRID_MAX_CELLS:
+        return None
+    return [row * GRID_COLUMNS + column for row in rows for column in columns]
+
+
+def haversine(lat1, lng1, lat2, lng2):
+    """
+    Great-circle distance in km between two coordinates.
+    """
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def nearby(queryset, latitude, longitude, radius, limit):
+    """
+    Returns up to ``limit`` ``(distance, pk)`` pairs for the rows of
+    ``queryset`` within ``radius`` km, nearest first.
+
+    The grid cell and bounding box filters run in SQL; the exact distance is
+    only computed for the rows that pass them.
+    """
+    south, west, north, east = bounding_box(latitude, longitude, radius)
+    queryset = queryset.filter(latitude__range=(south, north), longitude__range=(west, east))
+    cells = grid_cells(south, west, north, east)
+    if cells is not None:
+        queryset = queryset.filter(grid_cell__in=cells)
+
+    results = []
+    for pk, lat, lng in queryset.values_list("pk", "latitude", "longitude"):
+        distance = haversine(latitude, longitude, lat, lng)
+        if distance <= radius:
+            results.append((distance, pk))
+    results.sort()
+    return results[:limit]
@@ -0,0 +1,54 @@
+import asyncio
+import re
+from asgiref.sync import ThreadSensitiveContext
+from django.conf import settings
+from django.contrib.auth import hashers
+
+# Requests that hash a password: login, signup and profile edits, which may
+# change it. Token refreshes and profile reads do not.
+CREDENTIAL_REQUESTS = [
+    ("POST", re.compile(r"^/api/token/$")),
+    ("POST", re.compile(r"^/api/profile/$")),
+    ("PATCH", re.compile(r"^/api/profile/[^/]+/$")),
+]
+
+_semaphore = None
+
+
+class PBKDF2PasswordHasher(hashers.PBKDF2PasswordHasher):
+    """
+    PBKDF2 with PASSWORD_HASH_ITERATIONS rounds. Same algorithm name as
+    Django's, so stored hashes verify and are rehashed at their owner's
+    next login when the setting changes.
+    """
+    @property
+    def iterations(self):
+        return settings.PASSWORD_HASH_ITERATIONS
+
+
+def is_credential_request(scope):
+    return scope["type"] == "http" and any(
+        scope["method"] == method and path.match(scope["path"]) for method, path in CREDENTIAL_REQUESTS
+    )
+
+
+def offload_credentials(application):
+    """
+    Wraps Django's ASGI application so CREDENTIAL_REQUESTS run on a thread
+    of their own, at most PASSWORD_HASH_WORKERS at once.
+
+    Django 3.2 runs every synchronous view of an ASGI deployment, such as
+    the uvicorn workers of the Procfile, on one shared thread, where a
+    password hash holds up all other requests for its duration.
+    """
+    async def credentials_application(scope, receive, send):
+        global _semaphore
+        if not is_credential_request(scope):
+            return await application(scope, receive, send)
+        if _semaphore is None:
+            _semaphore = asyncio.Semaphore(settings.PASSWORD_HASH_WORKERS)
+        async with _semaphore:
+            async with ThreadSensitiveContext():
+                return await application(scope, receive, send)
+
+    return credentials_application
@@ -0,0 +1,163 @@
+import hashlib
+import io
+import logging
+import os
+import re
+import tempfile
+import threading
+from django.conf import settings
+from django.http import FileResponse, Http404
+from PIL import Image, ImageOps
+from .storage import media_storage
+
+logger = logging.getLogger(__name__)
+
+# Sizes generated for every uploaded photo, as (width, height, crop). Cropped
+# variants fill the box, the others fit inside it; images are never scaled
+# up past their original size.
+IMAGE_VARIANTS = {
+    "thumbnail": (160, 160, True),
+    "list": (480, 480, False),
+    "detail": (1280, 1280, False),
+}
+VARIANT_FORMAT = "WEBP"
+VARIANT_EXTENSION = ".webp"
+VARIANT_QUALITY = 80
+# Variants are named by the SHA-256 of their bytes, so identical images are
+# stored once and a URL never changes what it points at.
+VARIANT_PREFIX = "variants/"
+VARIANT_NAME = re.compile(r"^[0-9a-f]{64}\.webp$")
+VARIANT_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+def render_variant(image, width, height, crop):
+    if crop:
+        size = min(width, image.width), min(height, image.height)
+        variant = ImageOps.fit(image, size, Image.LANCZOS)
+    else:
+        variant = image.copy()
+        variant.thumbnail((width, height), Image.LANCZOS)
+    output = io.BytesIO()
+    variant.save(output, VARIANT_FORMAT, quality=VARIANT_QUALITY, method=4)
+    return output.getvalue(), variant.size
+
+
+def create_variants(storage, source):
+    """
+    Renders the IMAGE_VARIANTS of an image file, saves the ones ``storage``
+    does not have yet and returns their names and sizes, or an empty dict
+    when ``source`` is not a readable image.
+    """
+    try:
+        image = ImageOps.exif_transpose(Image.open(source))
+        image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+    except (OSError, ValueError, Image.DecompressionBombError) as error:
+        logger.warning("Cannot create variants of %s: %s", getattr(source, "name", source), error)
+        return {}
+
+    variants = {}
+    for variant, (width, height, crop) in IMAGE_VARIANTS.items():
+        content, (actual_width, actual_height) = render_variant(image, width, height, crop)
+        name = hashlib.sha256(content).hexdigest() + VARIANT_EXTENSION
+        if not storage.exists(VARIANT_PREFIX + name):
+            storage.save(VARIANT_PREFIX + name, io.BytesIO(content))
+        variant_cache.put(name, content)
+        variants[variant] = {"name": name, "width": actual_width, "height": actual_height}
+    return variants
+
+
+class VariantCache:
+    """
+    Variants kept on local disk so serving them does not hit the remote
+    storage. Reads refresh a file's modification time and the least
+    recently used files are evicted once the cache outgrows
+    MEDIA_CACHE_MAX_BYTES.
+    """
+    def __init__(self):
+        self._size = None
+        self._lock = threading.Lock()
+
+    @property
+    def root(self):
+        return str(settings.MEDIA_CACHE_ROOT)
+
+    def path(self, name):
+        return os.path.join(self.root, name[:2], name)
+
+    def get(self, name):
+        path = self.path(name)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def put(self, name, content):
+        path = self.path(name)
+        if os.path.exists(path):
+            return path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        descriptor, temporary = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(descriptor, "wb") as file:
+            file.write(content)
+        os.replace(temporary, path)
+        with self._lock:
+            if self._size is None:
+                self._size = sum(size for _, size, _ in self._entries())
+            else:
+                self._size += len(content)
+            if self._size > settings.MEDIA_CACHE_MAX_BYTES:
+                self._evict()
+        return path
+
+    def _entries(self):
+        for directory, _, files in os.walk(self.root):
+            for file in files:
+                path = os.path.join(directory, file)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield path, stat.st_size, stat.st_mtime
+
+    def _evict(self):
+        # Down to 90% so a full cache does not rescan on every write
+        target = settings.MEDIA_CACHE_MAX_BYTES * 0.9
+        for path, size, _ in sorted(self._entries(), key=lambda entry: entry[2]):
+            if self._size <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            self._size -= size
+
+
+variant_cache = VariantCache()
+
+
+def variant_media(request, name):
+    """
+    Serves a variant from the local cache, fetching it from the remote
+    storage on a miss.
+    """
+    if not VARIANT_NAME.match(name):
+        raise Http404
+    path = variant_cache.get(name)
+    try:
+        file = open(path, "rb") if path else None
+    except FileNotFoundError:
+        # Evicted since
+        file = None
+    if file is None:
+        try:
+            with media_storage.remote.open(VARIANT_PREFIX + name) as remote:
+                content = remote.read()
+        except (OSError, ValueError):
+            raise Http404
+        variant_cache.put(name, content)
+        file = io.BytesIO(content)
+    response = FileResponse(file, content_type="image/webp")
+    response["Cache-Control"] = VARIANT_CACHE_CONTROL
+    response["ETag"] = '"{}"'.format(name[:-len(VARIANT_EXTENSION)])
+    return response
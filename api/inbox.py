@@ -0,0 +1,38 @@
+from django.db.models import Count, Max, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Concat
+from django.utils import timezone
+from . import versions
+from .models import Message
+
+
+def inbox_threads(barbershop_id, origin):
+    """
+    One row per customer who messaged the shop: their last message and how
+    many messages not sent from ``origin`` they have left unread.
+
+    This is a single query grouped by user; the last message is a correlated
+    subquery served by the (barbershop, user, created) index.
+    """
+    last = Message.objects.filter(barbershop_id=barbershop_id, user=OuterRef("user")).order_by("-created", "-id")
+    return Message.objects.filter(barbershop_id=barbershop_id).values("user", "user__username").annotate(
+        name=Concat("user__first_name", Value(" "), "user__last_name"),
+        last_created=Max("created"),
+        last_origin=Subquery(last.values("origin")[:1]),
+        last_message=Subquery(last.values("text")[:1]),
+        unread=Count("id", filter=Q(read_at__isnull=True) & ~Q(origin=origin)),
+    )
+
+
+def mark_thread_read(barbershop_id, user_id, origin):
+    """
+    Marks the messages of a thread not sent from ``origin`` as read and
+    returns how many were updated.
+    """
+    now = timezone.now()
+    read = Message.objects.filter(
+        barbershop_id=barbershop_id, user_id=user_id, read_at__isnull=True
+    ).exclude(origin=origin).update(read_at=now, updated_at=now)
+    if read:
+        # The update skips post_save, and shop details embed the messages
+        versions.bump_versions([barbershop_id])
+    return read
@@ -0,0 +1,103 @@
+import hashlib
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from .models import Barbershop, LeaderboardEntry
+from .routers import primary_reads
+
+LEADERBOARD_SIZE = 10
+LEADERBOARD_CACHE_TIMEOUT = 300
+
+
+def current_period():
+    return timezone.now().strftime("%Y-%m")
+
+
+def cache_key(period, city):
+    # City names have spaces and any other character, which cache backends
+    # like memcached do not accept in keys
+    return "leaderboard:{}:{}".format(period, hashlib.sha1(city.encode("utf-8")).hexdigest()[:16])
+
+
+def rank_barbershops(city=""):
+    barbershops = Barbershop.objects.filter(verified=True)
+    if city:
+        barbershops = barbershops.filter(city=city)
+    return list(barbershops.order_by("-rating", "-id").values_list("pk", "rating")[:LEADERBOARD_SIZE])
+
+
+def refresh_leaderboard(city="", period=None):
+    """
+    Re-ranks the top LEADERBOARD_SIZE shops of a board and drops its cached
+    responses in this process; other processes pick it up after the TTL.
+
+    Concurrent refreshes of a board wait for each other on its rows, and
+    rank after the wait so they see what the previous one saw. A board
+    without rows cannot be locked; of two refreshes creating it the second
+    one fails on the rank constraint and keeps the first one's ranking.
+    """
+    period = period or current_period()
+    with transaction.atomic():
+        entries = LeaderboardEntry.objects.filter(period=period, city=city)
+        list(entries.select_for_update().values_list("pk", flat=True))
+        ranking = rank_barbershops(city)
+        try:
+            with transaction.atomic():
+                entries.delete()
+                LeaderboardEntry.objects.bulk_create([
+                    LeaderboardEntry(period=period, city=city, rank=rank, barbershop_id=pk, rating=rating)
+                    for rank, (pk, rating) in enumerate(ranking, start=1)
+                ])
+        except IntegrityError:
+            pass
+    cache.delete(cache_key(period, city))
+    return [pk for pk, _ in ranking]
+
+
+def barbershop_changed(barbershop, previous_city=None):
+    """
+    Refreshes the overall and city boards of the current period when a
+    change to ``barbershop`` can move it into, out of or within them.
+    ``previous_city`` is the city it moved from, whose board it may leave.
+    """
+    period = current_period()
+    for city in {"", barbershop.city, previous_city or ""}:
+        board = list(LeaderboardEntry.objects.filter(period=period, city=city).values_list("barbershop_id", "rating"))
+        listed = any(pk == barbershop.pk for pk, _ in board)
+        qualifies = barbershop.verified and city in ("", barbershop.city) and (
+            len(board) < LEADERBOARD_SIZE or barbershop.rating >= min(rating for _, rating in board)
+        )
+        if listed or qualifies:
+            refresh_leaderboard(city, period)
+
+
+def get_leaderboard(city=""):
+    """
+    The ranked shop ids of a board, creating it on the first hit of a period.
+    """
+    period = current_period()
+    ranking = list(
+        LeaderboardEntry.objects.filter(period=period, city=city).order_by("rank").values_list("barbershop_id", flat=True)
+    )
+    if not ranking:
+        ranking = refresh_leaderboard(city, period)
+    return ranking
+
+
+def cached_response(city, variant, render):
+    """
+    Serves a rendered board response from the in-process cache.
+
+    Responses for every ``variant`` of a board (e.g. its fields/expand
+    selection and the host its absolute URLs point to) share one cache
+    entry, so refreshing the board evicts them all at once.
+    """
+    key = cache_key(current_period(), city)
+    responses = cache.get(key) or {}
+    if variant not in responses:
+        # From the primary: the response is cached and a missing board is
+        # ranked and stored, neither may come from a lagging replica
+        with primary_reads():
+            responses[variant] = render(get_leaderboard(city))
+        cache.set(key, responses, LEADERBOARD_CACHE_TIMEOUT)
+    return responses[variant]
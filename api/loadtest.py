@@ -0,0 +1,280 @@
+import asyncio
+import datetime
+import json
+import math
+import random
+import time
+from urllib.parse import urlencode, urlparse
+
+# Load generator for a running deployment. Virtual users log in with seeded
+# accounts (see api.seed) and loop over weighted scenarios mirroring the
+# app's flows; every request is timed end to end over a keep-alive
+# connection of its own, like one phone talking to the API.
+SCENARIOS = {
+    "login": 1,
+    "list": 10,
+    "detail": 10,
+    "add_appointment": 2,
+    "add_message": 3,
+}
+PERCENTILES = (50, 95, 99)
+CONNECT_TIMEOUT = 10
+REQUEST_TIMEOUT = 30
+
+
+class HTTPError(Exception):
+    pass
+
+
+class Connection:
+    """
+    A minimal HTTP/1.1 client connection with keep-alive, enough to drive
+    the API without a third-party client.
+    """
+    def __init__(self, url):
+        url = urlparse(url)
+        self.host = url.hostname
+        self.ssl = url.scheme == "https"
+        self.port = url.port or (443 if self.ssl else 80)
+        self.netloc = url.netloc
+        self.reader = self.writer = None
+
+    async def request(self, method, path, headers=None, body=None):
+        for attempt in range(2):
+            reused = self.writer is not None
+            try:
+                if not reused:
+                    self.reader, self.writer = await asyncio.wait_for(
+                        asyncio.open_connection(self.host, self.port, ssl=self.ssl or None), CONNECT_TIMEOUT
+                    )
+                return await asyncio.wait_for(self._exchange(method, path, headers or {}, body), REQUEST_TIMEOUT)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                self.close()
+                # A reused connection may have been closed by the server
+                if not reused or attempt:
+                    raise
+            except BaseException:
+                self.close()
+                raise
+
+    async def _exchange(self, method, path, headers, body):
+        lines = ["{} {} HTTP/1.1".format(method, path), "Host: {}".format(self.netloc)]
+        headers = dict(headers, **{"Content-Length": str(len(body or b""))})
+        lines.extend("{}: {}".format(name, value) for name, value in headers.items())
+        self.writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + (body or b""))
+        await self.writer.drain()
+
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionError("Connection closed by server")
+        parts = status_line.decode("latin-1").split(" ", 2)
+        if len(parts) < 2 or not parts[1].isdigit():
+            raise HTTPError("Malformed status line {!r}".format(status_line))
+        response_headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            response_headers[name.strip().lower()] = value.strip()
+
+        if response_headers.get("transfer-encoding", "").lower() == "chunked":
+            content = b""
+            while True:
+                size = int((await self.reader.readline()).split(b";")[0], 16)
+                chunk = await self.reader.readexactly(size + 2)
+                if not size:
+                    break
+                content += chunk[:-2]
+        elif "content-length" in response_headers:
+            content = await self.reader.readexactly(int(response_headers["content-length"]))
+        else:
+            content = await self.reader.read()
+            response_headers["connection"] = "close"
+        if response_headers.get("connection", "").lower() == "close":
+            self.close()
+        return int(parts[1]), response_headers, content
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+
+    def record(self, scenario, latency, ok):
+        self.latencies.setdefault(scenario, []).append(latency)
+        self.errors.setdefault(scenario, 0)
+        if not ok:
+            self.errors[scenario] += 1
+
+
+class Session:
+    """
+    One virtual user: a connection, an access token and the shops it picks
+    from.
+    """
+    def __init__(self, url, recorder, username, password, barbershops, rng):
+        self.connection = Connection(url)
+        self.base_path = urlparse(url).path.rstrip("/")
+        self.recorder = recorder
+        self.username = username
+        self.password = password
+        self.barbershops = barbershops
+        self.rng = rng
+        self.token = None
+        self.user_id = None
+
+    async def call(self, scenario, method, path, data=None, expected=(200,)):
+        headers = {"Accept": "application/json"}
+        if self.token:
+            headers["Authorization"] = "Bearer {}".format(self.token)
+        body = None
+        if data is not None:
+            headers["Content-Type"] = "application/json"
+            body = json.dumps(data).encode("utf-8")
+        start = time.perf_counter()
+        try:
+            status, _, content = await self.connection.request(method, self.base_path + path, headers, body)
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, HTTPError):
+            self.recorder.record(scenario, time.perf_counter() - start, False)
+            return None, None
+        self.recorder.record(scenario, time.perf_counter() - start, status in expected)
+        return status, content
+
+    async def login(self):
+        status, content = await self.call(
+            "login", "POST", "/api/token/", {"username": self.username, "password": self.password}
+        )
+        if status == 200:
+            data = json.loads(content)
+            self.token, self.user_id = data["access"], data["id"]
+        return status == 200
+
+    async def list(self):
+        await self.call("list", "GET", "/api/barbershop/?" + urlencode({"page_size": 20}))
+
+    async def detail(self):
+        await self.call("detail", "GET", "/api/barbershop/{}/".format(self.rng.choice(self.barbershops)))
+
+    async def add_appointment(self):
+        # Random times collide with existing bookings now and then, a
+        # rejected booking is an expected outcome
+        date = datetime.date.today() + datetime.timedelta(days=self.rng.randint(1, 30))
+        await self.call(
+            "add_appointment", "POST", "/api/barbershop/{}/add_appointment/".format(self.rng.choice(self.barbershops)),
+            {"date": date.isoformat(), "time": "{:02d}:00".format(self.rng.randint(8, 19))},
+            expected=(200, 400, 409)
+        )
+
+    async def add_message(self):
+        await self.call(
+            "add_message", "POST", "/api/barbershop/{}/add_message/".format(self.rng.choice(self.barbershops)),
+            {"user": self.user_id, "origin": "user", "text": "Is there a slot later today?"}
+        )
+
+
+async def fetch_barbershops(url, limit=100):
+    connection = Connection(url)
+    path = urlparse(url).path.rstrip("/") + "/api/barbershop/?" + urlencode({"page_size": limit, "fields": "id"})
+    try:
+        status, _, content = await connection.request("GET", path, {"Accept": "application/json"})
+    finally:
+        connection.close()
+    if status != 200:
+        raise HTTPError("Listing barbershops returned {}".format(status))
+    return [row["id"] for row in json.loads(content)["results"]]
+
+
+async def virtual_user(session, scenarios, deadline):
+    names, weights = list(scenarios), list(scenarios.values())
+    try:
+        if not await session.login():
+            return
+        while time.monotonic() < deadline:
+            name = session.rng.choices(names, weights)[0]
+            if name == "login":
+                await session.login()
+            else:
+                await getattr(session, name)()
+    finally:
+        session.connection.close()
+
+
+async def run(url, users, duration, usernames, password, scenarios=None, random_seed=0):
+    """
+    Runs ``users`` concurrent virtual users for ``duration`` seconds and
+    returns the report, see ``summarize``.
+    """
+    scenarios = scenarios or SCENARIOS
+    barbershops = await fetch_barbershops(url)
+    if not barbershops:
+        raise HTTPError("No verified barbershops to load test, seed the database first")
+    recorder = Recorder()
+    rng = random.Random(random_seed)
+    sessions = [
+        Session(url, recorder, usernames[index % len(usernames)], password, barbershops, random.Random(rng.random()))
+        for index in range(users)
+    ]
+    start = time.monotonic()
+    await asyncio.gather(*[virtual_user(session, scenarios, start + duration) for session in sessions])
+    elapsed = time.monotonic() - start
+    report = summarize(recorder, elapsed)
+    report["config"] = {"url": url, "users": users, "duration": duration, "scenarios": scenarios}
+    return report
+
+
+def percentile(ordered, rank):
+    # Nearest-rank percentile of a sorted list
+    return ordered[max(0, math.ceil(rank / 100 * len(ordered)) - 1)]
+
+
+def summarize(recorder, elapsed):
+    scenarios = {}
+    for name, latencies in sorted(recorder.latencies.items()):
+        ordered = sorted(latencies)
+        scenarios[name] = dict(
+            requests=len(ordered),
+            errors=recorder.errors[name],
+            rps=len(ordered) / elapsed,
+            mean=sum(ordered) / len(ordered) * 1000,
+            **{"p{}".format(rank): percentile(ordered, rank) * 1000 for rank in PERCENTILES}
+        )
+    total = sum(row["requests"] for row in scenarios.values())
+    return {"elapsed": elapsed, "requests": total, "rps": total / elapsed if elapsed else 0, "scenarios": scenarios}
+
+
+def format_report(report):
+    columns = ["requests", "errors", "rps", "mean"] + ["p{}".format(rank) for rank in PERCENTILES]
+    lines = ["{:<16}".format("scenario") + "".join("{:>10}".format(column) for column in columns)]
+    for name, row in report["scenarios"].items():
+        lines.append("{:<16}".format(name) + "".join(
+            "{:>10}".format(row[column]) if isinstance(row[column], int) else "{:>10.1f}".format(row[column])
+            for column in columns
+        ))
+    lines.append("{} requests in {:.1f}s, {:.1f} requests/s (latencies in ms)".format(
+        report["requests"], report["elapsed"], report["rps"]
+    ))
+    return "\n".join(lines)
+
+
+def format_comparison(baseline, current):
+    """
+    Per scenario throughput and latency of ``current`` against ``baseline``;
+    negative latency and positive rps changes are improvements.
+    """
+    columns = ["rps", "mean"] + ["p{}".format(rank) for rank in PERCENTILES]
+    lines = ["{:<16}{:>8}".format("scenario", "metric") + "{:>12}{:>12}{:>10}".format("baseline", "current", "change")]
+    for name in sorted(set(baseline["scenarios"]) | set(current["scenarios"])):
+        before, after = baseline["scenarios"].get(name), current["scenarios"].get(name)
+        if before is None or after is None:
+            lines.append("{:<16}{:>8}  only in {}".format(name, "-", "current" if before is None else "baseline"))
+            continue
+        for column in columns:
+            change = (after[column] - before[column]) / before[column] * 100 if before[column] else 0
+            lines.append("{:<16}{:>8}{:>12.1f}{:>12.1f}{:>+9.1f}%".format(name, column, before[column], after[column], change))
+    return "\n".join(lines)
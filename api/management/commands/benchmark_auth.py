@@ -0,0 +1,75 @@
+import statistics
+import time
+import uuid
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test import Client, override_settings
+from api.models import Profile
+
+PASSWORD = "benchmark-password"
+
+
+class Command(BaseCommand):
+    help = "Time password hashing, login and signup in process and report their throughput; nothing is kept"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rounds", type=int, default=20, help="Logins and signups timed per hasher cost")
+        parser.add_argument(
+            "--iterations", type=int, nargs="+",
+            help="PBKDF2 iterations to compare, defaults to PASSWORD_HASH_ITERATIONS"
+        )
+
+    def handle(self, *args, **options):
+        if options["rounds"] < 1:
+            raise CommandError("--rounds must be at least 1")
+        rows = []
+        with transaction.atomic():
+            for iterations in options["iterations"] or [settings.PASSWORD_HASH_ITERATIONS]:
+                with override_settings(PASSWORD_HASH_ITERATIONS=iterations):
+                    rows.append((iterations,) + self.measure(options["rounds"]))
+            transaction.set_rollback(True)
+
+        self.stdout.write("{:>10} {:>10} {:>10} {:>10} {:>10} {:>10}".format(
+            "iterations", "hash ms", "login ms", "login/s", "signup ms", "signup/s"
+        ))
+        for iterations, hashing, login, signup in rows:
+            self.stdout.write("{:>10} {:>10.1f} {:>10.1f} {:>10.1f} {:>10.1f} {:>10.1f}".format(
+                iterations, hashing * 1000, login * 1000, 1 / login, signup * 1000, 1 / signup
+            ))
+
+    def measure(self, rounds):
+        """
+        Median seconds of a hash, a login and a signup.
+        """
+        client = Client(SERVER_NAME="localhost")
+        prefix = uuid.uuid4().hex[:8]
+        user = User.objects.create_user("{}-login".format(prefix), password=PASSWORD)
+        Profile.objects.create(user=user, account_type="user")
+
+        hashing, login, signup = [], [], []
+        for index in range(rounds):
+            start = time.perf_counter()
+            make_password(PASSWORD)
+            hashing.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            response = client.post("/api/token/", {"username": user.username, "password": PASSWORD})
+            login.append(time.perf_counter() - start)
+            if response.status_code != 200:
+                raise CommandError("Login returned {}".format(response.status_code))
+
+            start = time.perf_counter()
+            response = client.post("/api/profile/", {
+                "user": {
+                    "username": "{}-{}".format(prefix, index), "first_name": "Bench", "last_name": "Mark",
+                    "email": "bench@example.com", "password": PASSWORD,
+                },
+                "account_type": "user",
+            }, content_type="application/json")
+            signup.append(time.perf_counter() - start)
+            if response.status_code != 201:
+                raise CommandError("Signup returned {}: {}".format(response.status_code, response.content[:200]))
+        return statistics.median(hashing), statistics.median(login), statistics.median(signup)
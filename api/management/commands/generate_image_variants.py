@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from api import images, versions
+from api.models import Barbershop, Profile
+from api.storage import PENDING_PREFIX
+
+
+class Command(BaseCommand):
+    help = "Create the resized variants of photos uploaded before variants existed"
+
+    def handle(self, *args, **options):
+        count = 0
+        for model in (Barbershop, Profile):
+            rows = model.objects.filter(photo_variants={}).exclude(photo="").exclude(photo__isnull=True).exclude(
+                photo__startswith=PENDING_PREFIX
+            )
+            for pk, name in rows.values_list("pk", "photo").iterator():
+                storage = model._meta.get_field("photo").storage
+                try:
+                    with storage.open(name) as photo:
+                        variants = images.create_variants(storage.remote, photo)
+                except Exception as error:
+                    self.stderr.write("Cannot read {} {}: {}".format(model._meta.label, pk, error))
+                    continue
+                if variants and model.objects.filter(pk=pk, photo=name).update(photo_variants=variants):
+                    count += 1
+                    if model is Barbershop:
+                        versions.bump_versions([pk])
+        self.stdout.write(self.style.SUCCESS("Created variants of {} photos".format(count)))
@@ -0,0 +1,99 @@
+import asyncio
+import json
+import shlex
+import socket
+import subprocess
+import time
+from urllib.parse import urlparse
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from api import loadtest
+from api.seed import SEED_PASSWORD, SEED_SIZES
+
+SERVER_COMMAND = "gunicorn ptown.wsgi --bind {host}:{port} --workers {workers}"
+SERVER_START_TIMEOUT = 30
+
+
+class Command(BaseCommand):
+    help = "Load test a running deployment with concurrent users and report latency percentiles and throughput"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--url", default="http://127.0.0.1:8000", help="Base URL of the deployment")
+        parser.add_argument("--users", type=int, default=20, help="Concurrent virtual users")
+        parser.add_argument("--duration", type=float, default=30, help="Seconds to run for")
+        parser.add_argument(
+            "--scenario", action="append", choices=sorted(loadtest.SCENARIOS),
+            help="Scenario to run, repeatable; defaults to the weighted mix of all of them"
+        )
+        parser.add_argument("--accounts", type=int, default=100, help="Seeded accounts the users log in as")
+        parser.add_argument(
+            "--first-account", type=int, default=SEED_SIZES["users"] // 10,
+            help="Number of the first seeded account, past the shop owners"
+        )
+        parser.add_argument("--password", default=SEED_PASSWORD, help="Password of the seeded accounts")
+        parser.add_argument("--seed", type=int, default=0, help="Random seed")
+        parser.add_argument("--launch", action="store_true", help="Start a local server at --url for the run")
+        parser.add_argument("--workers", type=int, default=2, help="Workers of the launched server")
+        parser.add_argument("--server-command", default=SERVER_COMMAND, help="Command used by --launch")
+        parser.add_argument("--output", help="Write the report to this JSON file")
+        parser.add_argument("--baseline", help="Compare the run with a report written by --output")
+        parser.add_argument(
+            "--compare", nargs=2, metavar=("BASELINE", "CURRENT"), help="Compare two saved reports without running"
+        )
+
+    def handle(self, *args, **options):
+        if options["compare"]:
+            baseline, current = [self.load(path) for path in options["compare"]]
+            self.stdout.write(loadtest.format_comparison(baseline, current))
+            return
+
+        scenarios = loadtest.SCENARIOS
+        if options["scenario"]:
+            scenarios = {name: loadtest.SCENARIOS[name] for name in options["scenario"]}
+        first = options["first_account"]
+        usernames = ["seed{}".format(index) for index in range(first, first + options["accounts"])]
+
+        server = self.launch(options) if options["launch"] else None
+        try:
+            report = asyncio.run(loadtest.run(
+                options["url"], options["users"], options["duration"], usernames, options["password"],
+                scenarios, options["seed"]
+            ))
+        except (OSError, loadtest.HTTPError) as error:
+            raise CommandError("Load test failed: {}".format(error))
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait()
+
+        self.stdout.write(loadtest.format_report(report))
+        if options["output"]:
+            with open(options["output"], "w") as file:
+                json.dump(report, file, indent=2)
+        if options["baseline"]:
+            self.stdout.write("")
+            self.stdout.write(loadtest.format_comparison(self.load(options["baseline"]), report))
+
+    def load(self, path):
+        try:
+            with open(path) as file:
+                return json.load(file)
+        except (OSError, ValueError) as error:
+            raise CommandError("Cannot read report {}: {}".format(path, error))
+
+    def launch(self, options):
+        url = urlparse(options["url"])
+        host, port = url.hostname, url.port or 80
+        command = options["server_command"].format(host=host, port=port, workers=options["workers"])
+        server = subprocess.Popen(shlex.split(command), cwd=str(settings.BASE_DIR))
+        deadline = time.monotonic() + SERVER_START_TIMEOUT
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                raise CommandError("Server exited with status {}".format(server.returncode))
+            try:
+                socket.create_connection((host, port), timeout=1).close()
+                return server
+            except OSError:
+                time.sleep(0.2)
+        server.terminate()
+        raise CommandError("Server did not start listening on {}:{}".format(host, port))
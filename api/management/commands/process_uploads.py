@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from api.uploads import pending_uploads, process_upload
+
+
+class Command(BaseCommand):
+    help = "Copy staged uploads that are pending, failed or abandoned to their remote storage"
+
+    def handle(self, *args, **options):
+        uploaded = failed = 0
+        for upload_id in list(pending_uploads()):
+            try:
+                uploaded += process_upload(upload_id)
+            except Exception as error:
+                failed += 1
+                self.stderr.write("Upload {} failed: {}".format(upload_id, error))
+        self.stdout.write(self.style.SUCCESS("Uploaded {} files, {} failed".format(uploaded, failed)))
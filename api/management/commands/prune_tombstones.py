@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from api.sync import prune_tombstones
+
+
+class Command(BaseCommand):
+    help = "Delete sync tombstones older than the retention period"
+
+    def handle(self, *args, **options):
+        count = prune_tombstones()
+        self.stdout.write(self.style.SUCCESS("Deleted {} tombstones".format(count)))
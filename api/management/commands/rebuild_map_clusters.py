@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+from api.clusters import rebuild_clusters
+from api.models import Barbershop, MapCluster
+
+
+class Command(BaseCommand):
+    help = "Recompute the map clusters from the verified barbershops"
+
+    def handle(self, *args, **options):
+        count = rebuild_clusters(Barbershop, MapCluster)
+        self.stdout.write(self.style.SUCCESS("Rebuilt {} map clusters".format(count)))
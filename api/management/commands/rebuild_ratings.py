@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from api.clusters import rebuild_clusters
+from api.models import Barbershop, MapCluster
+from api.ratings import rebuild_ratings
+
+
+class Command(BaseCommand):
+    help = "Recompute every barbershop's rating aggregate from its reviews"
+
+    def handle(self, *args, **options):
+        count = rebuild_ratings(Barbershop)
+        rebuild_clusters(Barbershop, MapCluster)
+        self.stdout.write(self.style.SUCCESS("Rebuilt ratings of {} barbershops".format(count)))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from api import search
+from api.models import Barbershop
+
+
+class Command(BaseCommand):
+    help = "Reindex every barbershop in the full-text search index"
+
+    def handle(self, *args, **options):
+        count = 0
+        for barbershop in Barbershop.objects.iterator():
+            search.index_barbershop(barbershop)
+            count += 1
+        self.stdout.write(self.style.SUCCESS("Indexed {} barbershops".format(count)))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from api.seed import SEED_PASSWORD, SEED_SIZES, seed
+
+
+class Command(BaseCommand):
+    help = "Fill the database with synthetic shops, users, appointments, messages and reviews"
+
+    def add_arguments(self, parser):
+        for name, default in SEED_SIZES.items():
+            parser.add_argument("--{}".format(name), type=int, default=default, help="Number of {}".format(name))
+        parser.add_argument("--seed", type=int, default=0, help="Random seed")
+
+    def handle(self, *args, **options):
+        counts = seed(random_seed=options["seed"], **{name: options[name] for name in SEED_SIZES})
+        summary = ", ".join("{} {}".format(count, name) for name, count in counts.items())
+        self.stdout.write(self.style.SUCCESS("Created {}; seeded users log in with password {}".format(summary, SEED_PASSWORD)))
@@ -0,0 +1,210 @@
+import bisect
+import contextlib
+import contextvars
+import threading
+import time
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.http import Http404, HttpResponse
+
+# Per-process request metrics. Each worker keeps its own registry, so with
+# several gunicorn workers a scrape of /metrics reports the worker that
+# served it; Prometheus sums the series of every target it scrapes.
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_current = contextvars.ContextVar("request_metrics", default=None)
+
+
+def metrics_enabled():
+    return getattr(settings, "METRICS_ENABLED", False) is True
+
+
+class Histogram:
+    """
+    A Prometheus histogram: cumulative bucket counts, sum and count for
+    each combination of label values.
+    """
+    def __init__(self, name, documentation, labels, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def collect(self):
+        lines = [
+            "# HELP {} {}".format(self.name, self.documentation),
+            "# TYPE {} histogram".format(self.name),
+        ]
+        with self._lock:
+            series = [(labels, list(counts), total, count) for labels, (counts, total, count) in self._series.items()]
+        for labels, counts, total, count in sorted(series):
+            label_text = ",".join('{}="{}"'.format(name, escape(value)) for name, value in zip(self.labels, labels))
+            prefix = label_text + "," if label_text else ""
+            cumulative = 0
+            for bound, bucket in zip(self.buckets + ("+Inf",), counts):
+                cumulative += bucket
+                lines.append('{}_bucket{{{}le="{}"}} {}'.format(self.name, prefix, bound, cumulative))
+            lines.append("{}_sum{{{}}} {}".format(self.name, label_text, total))
+            lines.append("{}_count{{{}}} {}".format(self.name, label_text, count))
+        return lines
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+REQUEST_DURATION = Histogram(
+    "ptown_request_duration_seconds", "Time spent handling a request.", ("view", "method", "status"), DURATION_BUCKETS
+)
+REQUEST_QUERIES = Histogram(
+    "ptown_request_queries", "SQL queries run while handling a request.", ("view", "method"), QUERY_BUCKETS
+)
+REQUEST_SQL_DURATION = Histogram(
+    "ptown_request_sql_seconds", "Time spent in SQL queries per request.", ("view", "method"), DURATION_BUCKETS
+)
+REQUEST_SERIALIZATION_DURATION = Histogram(
+    "ptown_request_serialization_seconds", "Time spent serializing and rendering the response.",
+    ("view", "method"), DURATION_BUCKETS
+)
+RESPONSE_SIZE = Histogram(
+    "ptown_response_size_bytes", "Size of the response body.", ("view", "method"), SIZE_BUCKETS
+)
+HISTOGRAMS = [REQUEST_DURATION, REQUEST_QUERIES, REQUEST_SQL_DURATION, REQUEST_SERIALIZATION_DURATION, RESPONSE_SIZE]
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.queries = 0
+        self.sql_time = 0.0
+        self.serialization_time = 0.0
+        self._serializing = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        # Installed with connection.execute_wrapper()
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_time += time.perf_counter() - start
+            self.queries += 1
+
+    @contextlib.contextmanager
+    def serializing(self):
+        # Nested serializers run inside their parent's timing
+        if self._serializing:
+            yield
+            return
+        self._serializing += 1
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.serialization_time += time.perf_counter() - start
+            self._serializing -= 1
+
+
+def serialization_timer():
+    """
+    Times the enclosed serialization against the current request, if its
+    metrics are being recorded. Queries the serializer triggers, such as
+    lazily loaded relations, are also counted in the SQL time.
+    """
+    metrics = _current.get()
+    if metrics is None:
+        return contextlib.nullcontext()
+    return metrics.serializing()
+
+
+def view_label(request):
+    match = getattr(request, "resolver_match", None)
+    if match is None:
+        return "<unresolved>"
+    return match.view_name or match._func_path
+
+
+class MetricsMiddleware:
+    """
+    Records the query count, SQL time, serialization time and response size
+    of every request, reports them in a ``Server-Timing`` header and feeds
+    the histograms served by ``metrics_view``.
+
+    Only installed when ``METRICS_ENABLED`` is set, otherwise Django drops
+    it from the middleware chain at startup.
+    """
+    def __init__(self, get_response):
+        if not metrics_enabled():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        start = time.perf_counter()
+        try:
+            with contextlib.ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(metrics))
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        duration = time.perf_counter() - start
+
+        view, method = view_label(request), request.method
+        REQUEST_DURATION.observe(duration, view, method, str(response.status_code))
+        REQUEST_QUERIES.observe(metrics.queries, view, method)
+        REQUEST_SQL_DURATION.observe(metrics.sql_time, view, method)
+        REQUEST_SERIALIZATION_DURATION.observe(metrics.serialization_time, view, method)
+        if not response.streaming:
+            RESPONSE_SIZE.observe(len(response.content), view, method)
+
+        response["Server-Timing"] = ", ".join([
+            'db;dur={:.2f};desc="{} queries"'.format(metrics.sql_time * 1000, metrics.queries),
+            "serialize;dur={:.2f}".format(metrics.serialization_time * 1000),
+            "total;dur={:.2f}".format(duration * 1000),
+        ])
+        return response
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered to JSON after the view has returned
+        metrics = _current.get()
+        if metrics is not None:
+            start = time.perf_counter()
+
+            def rendered(response):
+                metrics.serialization_time += time.perf_counter() - start
+
+            response.add_post_render_callback(rendered)
+        return response
+
+
+def metrics_view(request):
+    """
+    Prometheus text exposition of the request histograms. Requires
+    ``Authorization: Bearer <METRICS_TOKEN>`` and is not found without a
+    configured token.
+    """
+    token = getattr(settings, "METRICS_TOKEN", None)
+    if not metrics_enabled() or not token:
+        raise Http404
+    if request.META.get("HTTP_AUTHORIZATION") != "Bearer {}".format(token):
+        return HttpResponse(status=401)
+    lines = []
+    for histogram in HISTOGRAMS:
+        lines.extend(histogram.collect())
+    return HttpResponse("\n".join(lines) + "\n", content_type=METRICS_CONTENT_TYPE)
@@ -1,10 +1,10 @@
 # Generated by Django 3.2.8 on 2021-10-05 16:51
 
 import api.models
+import api.storage
 from django.conf import settings
 from django.db import migrations, models
 import django.db.models.deletion
-import gdstorage.storage
 
 
 class Migration(migrations.Migration):
@@ -35,7 +35,7 @@ class Migration(migrations.Migration):
                 ('description', models.TextField(blank=True, null=True)),
                 ('address', models.CharField(max_length=255)),
                 ('contact_number', models.CharField(blank=True, max_length=11, null=True)),
-                ('photo', models.ImageField(blank=True, null=True, storage=gdstorage.storage.GoogleDriveStorage(), upload_to='banners', validators=[api.models.validate_file_extension])),
+                ('photo', models.ImageField(blank=True, null=True, storage=api.storage.get_media_storage, upload_to='banners', validators=[api.models.validate_file_extension])),
                 ('rating', models.FloatField(default=0)),
                 ('latitude', models.FloatField()),
                 ('longitude', models.FloatField()),
@@ -86,7 +86,7 @@ class Migration(migrations.Migration):
             fields=[
                 ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
                 ('contact_number', models.CharField(blank=True, max_length=11, null=True)),
-                ('photo', models.ImageField(blank=True, null=True, storage=gdstorage.storage.GoogleDriveStorage(), upload_to='profiles', validators=[api.models.validate_file_extension])),
+                ('photo', models.ImageField(blank=True, null=True, storage=api.storage.get_media_storage, upload_to='profiles', validators=[api.models.validate_file_extension])),
                 ('address', models.CharField(blank=True, max_length=255, null=True)),
                 ('account_type', models.CharField(max_length=5)),
                 ('barbershop', models.ManyToManyField(related_name='shops', to='api.Barbershop')),
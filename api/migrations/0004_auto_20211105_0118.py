@@ -1,8 +1,8 @@
 # Generated by Django 3.2.8 on 2021-11-04 17:18
 
 import api.models
+import api.storage
 from django.db import migrations, models
-import gdstorage.storage
 
 
 class Migration(migrations.Migration):
@@ -20,6 +20,6 @@ class Migration(migrations.Migration):
         migrations.AddField(
             model_name='barbershop',
             name='document',
-            field=models.ImageField(blank=True, null=True, storage=gdstorage.storage.GoogleDriveStorage(), upload_to='documents', validators=[api.models.validate_file_extension]),
+            field=models.ImageField(blank=True, null=True, storage=api.storage.get_media_storage, upload_to='documents', validators=[api.models.validate_file_extension]),
         ),
     ]
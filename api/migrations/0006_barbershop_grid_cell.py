@@ -0,0 +1,40 @@
+# Generated by Django 3.2.8 on 2026-10-18 16:31
+
+import math
+
+from django.db import migrations, models
+
+# api.geo as of this migration: 0.1 degree cells, one extra column for
+# longitude 180
+GRID_CELL_DEGREES = 0.1
+GRID_COLUMNS = int(round(360 / GRID_CELL_DEGREES)) + 1
+
+
+def grid_cell(latitude, longitude):
+    row = int(math.floor((min(max(latitude, -90.0), 90.0) + 90) / GRID_CELL_DEGREES))
+    column = int(math.floor((min(max(longitude, -180.0), 180.0) + 180) / GRID_CELL_DEGREES))
+    return row * GRID_COLUMNS + column
+
+
+def populate_grid_cell(apps, schema_editor):
+    Barbershop = apps.get_model('api', 'Barbershop')
+    barbershops = list(Barbershop.objects.only('id', 'latitude', 'longitude'))
+    for barbershop in barbershops:
+        barbershop.grid_cell = grid_cell(barbershop.latitude, barbershop.longitude)
+    Barbershop.objects.bulk_update(barbershops, ['grid_cell'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_auto_20211110_1835'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='barbershop',
+            name='grid_cell',
+            field=models.IntegerField(db_index=True, default=0, editable=False),
+        ),
+        migrations.RunPython(populate_grid_cell, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,73 @@
+# Generated by Django 3.2.8 on 2026-10-18 16:33
+
+import math
+
+from django.db import migrations, models
+
+# api.clusters as of this migration
+CLUSTER_MAX_ZOOM = 16
+CLUSTER_CELLS_PER_TILE = 4
+
+
+def cluster_cells(latitude, longitude):
+    for zoom in range(CLUSTER_MAX_ZOOM + 1):
+        size = 360 / (2 ** zoom) / CLUSTER_CELLS_PER_TILE
+        row = int(math.floor((min(max(latitude, -90.0), 90.0) + 90) / size))
+        column = int(math.floor((min(max(longitude, -180.0), 180.0) + 180) / size))
+        yield zoom, row, column
+
+
+def rebuild_clusters(Barbershop, MapCluster):
+    totals = {}
+    points = Barbershop.objects.filter(verified=True).values_list('latitude', 'longitude', 'rating')
+    for latitude, longitude, rating in points.iterator():
+        for cell in cluster_cells(latitude, longitude):
+            total = totals.setdefault(cell, [0, 0.0, 0.0, 0.0])
+            total[0] += 1
+            total[1] += latitude
+            total[2] += longitude
+            total[3] += rating
+    MapCluster.objects.all().delete()
+    MapCluster.objects.bulk_create([
+        MapCluster(
+            zoom=zoom, row=row, column=column,
+            count=count, latitude_sum=latitude_sum, longitude_sum=longitude_sum, rating_sum=rating_sum
+        )
+        for (zoom, row, column), (count, latitude_sum, longitude_sum, rating_sum) in totals.items()
+    ], batch_size=500)
+
+
+def populate_map_clusters(apps, schema_editor):
+    rebuild_clusters(apps.get_model('api', 'Barbershop'), apps.get_model('api', 'MapCluster'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_barbershop_grid_cell'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MapCluster',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('zoom', models.PositiveSmallIntegerField()),
+                ('row', models.IntegerField()),
+                ('column', models.IntegerField()),
+                ('count', models.IntegerField(default=0)),
+                ('latitude_sum', models.FloatField(default=0)),
+                ('longitude_sum', models.FloatField(default=0)),
+                ('rating_sum', models.FloatField(default=0)),
+            ],
+            options={
+                'verbose_name': 'MapCluster',
+                'verbose_name_plural': 'MapClusters',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='mapcluster',
+            constraint=models.UniqueConstraint(fields=('zoom', 'row', 'column'), name='unique_map_cluster_cell'),
+        ),
+        migrations.RunPython(populate_map_clusters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,61 @@
+from django.db import migrations
+
+# api.search as of this migration
+SEARCH_TABLE = 'api_barbershop_search'
+SEARCH_COLUMNS = ['name', 'description', 'address', 'amenities', 'services']
+POSTGRES_LABELS = ['A', 'C', 'B', 'B', 'B']
+
+
+def search_document(barbershop):
+    address = [barbershop.address, barbershop.street, barbershop.barangay, barbershop.city, barbershop.postal_code]
+    return [
+        barbershop.name,
+        barbershop.description or '',
+        ' '.join(part for part in address if part),
+        ' '.join(barbershop.amenities.values_list('name', flat=True)),
+        ' '.join(barbershop.services.values_list('name', flat=True)),
+    ]
+
+
+def create_barbershop_search(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE {} USING fts5({}, tokenize='unicode61 remove_diacritics 2', prefix='2 3')".format(
+                SEARCH_TABLE, ', '.join(SEARCH_COLUMNS)
+            )
+        )
+        insert = 'INSERT INTO {} (rowid, {}) VALUES (%s, {})'.format(
+            SEARCH_TABLE, ', '.join(SEARCH_COLUMNS), ', '.join(['%s'] * len(SEARCH_COLUMNS))
+        )
+    elif vendor == 'postgresql':
+        schema_editor.execute(
+            'CREATE TABLE {} (barbershop_id bigint PRIMARY KEY REFERENCES api_barbershop (id) '
+            'ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, document tsvector NOT NULL)'.format(SEARCH_TABLE)
+        )
+        schema_editor.execute('CREATE INDEX {0}_document ON {0} USING GIN (document)'.format(SEARCH_TABLE))
+        insert = 'INSERT INTO {} (barbershop_id, document) VALUES (%s, {})'.format(SEARCH_TABLE, ' || '.join(
+            "setweight(to_tsvector('simple', %s), '{}')".format(label) for label in POSTGRES_LABELS
+        ))
+    else:
+        return
+    Barbershop = apps.get_model('api', 'Barbershop')
+    with schema_editor.connection.cursor() as cursor:
+        for barbershop in Barbershop.objects.iterator():
+            cursor.execute(insert, [barbershop.pk] + search_document(barbershop))
+
+
+def drop_barbershop_search(apps, schema_editor):
+    if schema_editor.connection.vendor in ('sqlite', 'postgresql'):
+        schema_editor.execute('DROP TABLE IF EXISTS {}'.format(SEARCH_TABLE))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_mapcluster'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_barbershop_search, drop_barbershop_search),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.8 on 2026-10-18 16:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_barbershop_search'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='barbershop',
+            index=models.Index(fields=['verified', '-rating', '-id'], name='barbershop_rating_idx'),
+        ),
+    ]
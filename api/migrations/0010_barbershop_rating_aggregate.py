@@ -0,0 +1,115 @@
+# Generated by Django 3.2.8 on 2026-10-18 16:37
+
+import math
+
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+
+# api.ratings and api.clusters as of this migration
+RATING_STARS = range(1, 6)
+CLUSTER_MAX_ZOOM = 16
+CLUSTER_CELLS_PER_TILE = 4
+
+
+def stars_filter(stars):
+    condition = Q()
+    if stars > RATING_STARS[0]:
+        condition &= Q(comments__rating__gte=stars - 0.5)
+    if stars < RATING_STARS[-1]:
+        condition &= Q(comments__rating__lt=stars + 0.5)
+    return condition
+
+
+def rebuild_ratings(Barbershop):
+    histogram = {'stars_{}'.format(stars): Count('comments', filter=stars_filter(stars)) for stars in RATING_STARS}
+    barbershops = list(Barbershop.objects.annotate(
+        total=Sum('comments__rating'), total_count=Count('comments'), **histogram
+    ))
+    for barbershop in barbershops:
+        barbershop.rating_sum = barbershop.total or 0
+        barbershop.rating_count = barbershop.total_count
+        for stars in RATING_STARS:
+            setattr(barbershop, 'rating_count_{}'.format(stars), getattr(barbershop, 'stars_{}'.format(stars)))
+        if barbershop.rating_count:
+            barbershop.rating = round(barbershop.rating_sum / barbershop.rating_count, 2)
+    fields = ['rating', 'rating_sum', 'rating_count'] + ['rating_count_{}'.format(stars) for stars in RATING_STARS]
+    Barbershop.objects.bulk_update(barbershops, fields, batch_size=500)
+
+
+def cluster_cells(latitude, longitude):
+    for zoom in range(CLUSTER_MAX_ZOOM + 1):
+        size = 360 / (2 ** zoom) / CLUSTER_CELLS_PER_TILE
+        row = int(math.floor((min(max(latitude, -90.0), 90.0) + 90) / size))
+        column = int(math.floor((min(max(longitude, -180.0), 180.0) + 180) / size))
+        yield zoom, row, column
+
+
+def rebuild_clusters(Barbershop, MapCluster):
+    totals = {}
+    points = Barbershop.objects.filter(verified=True).values_list('latitude', 'longitude', 'rating')
+    for latitude, longitude, rating in points.iterator():
+        for cell in cluster_cells(latitude, longitude):
+            total = totals.setdefault(cell, [0, 0.0, 0.0, 0.0])
+            total[0] += 1
+            total[1] += latitude
+            total[2] += longitude
+            total[3] += rating
+    MapCluster.objects.all().delete()
+    MapCluster.objects.bulk_create([
+        MapCluster(
+            zoom=zoom, row=row, column=column,
+            count=count, latitude_sum=latitude_sum, longitude_sum=longitude_sum, rating_sum=rating_sum
+        )
+        for (zoom, row, column), (count, latitude_sum, longitude_sum, rating_sum) in totals.items()
+    ], batch_size=500)
+
+
+def populate_rating_aggregate(apps, schema_editor):
+    rebuild_ratings(apps.get_model('api', 'Barbershop'))
+    rebuild_clusters(apps.get_model('api', 'Barbershop'), apps.get_model('api', 'MapCluster'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_barbershop_barbershop_rating_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='barbershop',
+            name='rating_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='barbershop',
+            name='rating_count_1',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='barbershop',
+            name='rating_count_2',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='barbershop',
+            name='rating_count_3',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='barbershop',
+            name='rating_count_4',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='barbershop',
+            name='rating_count_5',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='barbershop',
+            name='rating_sum',
+            field=models.FloatField(default=0, editable=False),
+        ),
+        migrations.RunPython(populate_rating_aggregate, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 3.2.8 on 2026-10-18 16:39
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_barbershop_rating_aggregate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LeaderboardEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(max_length=7)),
+                ('city', models.CharField(blank=True, max_length=255)),
+                ('rank', models.PositiveSmallIntegerField()),
+                ('rating', models.FloatField()),
+            ],
+            options={
+                'verbose_name': 'LeaderboardEntry',
+                'verbose_name_plural': 'LeaderboardEntries',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='barbershop',
+            index=models.Index(fields=['city', 'verified', '-rating', '-id'], name='barbershop_city_rating_idx'),
+        ),
+        migrations.AddField(
+            model_name='leaderboardentry',
+            name='barbershop',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='leaderboard_entries', to='api.barbershop'),
+        ),
+        migrations.AddConstraint(
+            model_name='leaderboardentry',
+            constraint=models.UniqueConstraint(fields=('period', 'city', 'rank'), name='unique_leaderboard_rank'),
+        ),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 3.2.8 on 2026-10-18 16:43
+
+import math
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+# api.booking as of this migration: hour long appointments claim every
+# 15 minute slot they overlap
+SLOT_MINUTES = 15
+APPOINTMENT_MINUTES = 60
+
+
+def slot_range(time):
+    minutes = time.hour * 60 + time.minute + time.second / 60
+    return range(int(minutes // SLOT_MINUTES), math.ceil((minutes + APPOINTMENT_MINUTES) / SLOT_MINUTES))
+
+
+def populate_appointment_slots(apps, schema_editor):
+    # Where old appointments already overlap, the earliest one keeps the slot
+    Barbershop = apps.get_model('api', 'Barbershop')
+    AppointmentSlot = apps.get_model('api', 'AppointmentSlot')
+    slots = []
+    links = Barbershop.appointments.through.objects.select_related('appointment').order_by('appointment_id')
+    for link in links.iterator():
+        for slot in slot_range(link.appointment.time):
+            slots.append(AppointmentSlot(
+                barbershop_id=link.barbershop_id, appointment_id=link.appointment_id, date=link.appointment.date, slot=slot
+            ))
+    AppointmentSlot.objects.bulk_create(slots, batch_size=500, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_leaderboard'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AppointmentSlot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('slot', models.PositiveSmallIntegerField()),
+                ('appointment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='slots', to='api.appointment')),
+                ('barbershop', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='slots', to='api.barbershop')),
+            ],
+            options={
+                'verbose_name': 'AppointmentSlot',
+                'verbose_name_plural': 'AppointmentSlots',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='appointmentslot',
+            constraint=models.UniqueConstraint(fields=('barbershop', 'date', 'slot'), name='unique_appointment_slot'),
+        ),
+        migrations.RunPython(populate_appointment_slots, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,77 @@
+# Generated by Django 3.2.8 on 2026-10-18 16:52
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def link_to_barbershop(apps, schema_editor):
+    # A shop's appointments and messages were only ever added to that one
+    # shop; should a row be linked to several, the first link wins.
+    Barbershop = apps.get_model('api', 'Barbershop')
+    for model_name, field in (('Appointment', 'appointment'), ('Message', 'message')):
+        model = apps.get_model('api', model_name)
+        through = getattr(Barbershop, model_name.lower() + 's').through
+        barbershops = {}
+        for row_id, barbershop_id in through.objects.order_by('-id').values_list(field + '_id', 'barbershop_id').iterator():
+            barbershops[row_id] = barbershop_id
+        rows = [model(pk=row_id, barbershop_id=barbershop_id) for row_id, barbershop_id in barbershops.items()]
+        model.objects.bulk_update(rows, ['barbershop'], batch_size=500)
+
+
+def link_to_barbershop_reverse(apps, schema_editor):
+    Barbershop = apps.get_model('api', 'Barbershop')
+    for model_name, field in (('Appointment', 'appointment'), ('Message', 'message')):
+        model = apps.get_model('api', model_name)
+        through = getattr(Barbershop, model_name.lower() + 's').through
+        rows = model.objects.filter(barbershop__isnull=False).values_list('pk', 'barbershop_id').iterator()
+        through.objects.bulk_create(
+            [through(**{field + '_id': row_id, 'barbershop_id': barbershop_id}) for row_id, barbershop_id in rows],
+            batch_size=500
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_appointmentslot'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appointment',
+            name='barbershop',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='api.barbershop'),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='barbershop',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='api.barbershop'),
+        ),
+        migrations.RunPython(link_to_barbershop, link_to_barbershop_reverse),
+        migrations.RemoveField(
+            model_name='barbershop',
+            name='appointments',
+        ),
+        migrations.RemoveField(
+            model_name='barbershop',
+            name='messages',
+        ),
+        migrations.AlterField(
+            model_name='appointment',
+            name='barbershop',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='appointments', to='api.barbershop'),
+        ),
+        migrations.AlterField(
+            model_name='message',
+            name='barbershop',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='messages', to='api.barbershop'),
+        ),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['barbershop', 'date', 'time'], name='appointment_schedule_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['barbershop', 'user', 'created'], name='message_thread_idx'),
+        ),
+    ]
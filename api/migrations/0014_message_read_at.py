@@ -0,0 +1,18 @@
+# Generated by Django 3.2.8 on 2026-10-18 16:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_appointment_message_barbershop'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='read_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
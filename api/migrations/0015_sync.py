@@ -0,0 +1,86 @@
+# Generated by Django 3.2.8 on 2026-10-18 17:04
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('api', '0014_message_read_at'),
+    ]
+
+    operations = [
+        # Barbershop.favorites gets an explicit through model on its existing
+        # table, so only the migration state changes here.
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='Favorite',
+                    fields=[
+                        ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                        ('barbershop', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.barbershop')),
+                        ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+                    ],
+                    options={
+                        'verbose_name': 'Favorite',
+                        'verbose_name_plural': 'Favorites',
+                        'db_table': 'api_barbershop_favorites',
+                        'unique_together': {('barbershop', 'user')},
+                    },
+                ),
+                migrations.AlterField(
+                    model_name='barbershop',
+                    name='favorites',
+                    field=models.ManyToManyField(blank=True, related_name='favorites', through='api.Favorite', to=settings.AUTH_USER_MODEL),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name='favorite',
+            name='created',
+            field=models.DateTimeField(auto_now_add=True),
+        ),
+        migrations.AddIndex(
+            model_name='favorite',
+            index=models.Index(fields=['user', 'created'], name='favorite_sync_idx'),
+        ),
+        migrations.AddField(
+            model_name='appointment',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['user', 'updated_at'], name='appointment_sync_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['user', 'updated_at'], name='message_sync_idx'),
+        ),
+        migrations.CreateModel(
+            name='Tombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('collection', models.CharField(max_length=20)),
+                ('object_id', models.BigIntegerField()),
+                ('deleted_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tombstones', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Tombstone',
+                'verbose_name_plural': 'Tombstones',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='tombstone',
+            index=models.Index(fields=['user', 'collection', 'deleted_at'], name='tombstone_sync_idx'),
+        ),
+    ]
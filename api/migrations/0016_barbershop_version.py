@@ -0,0 +1,23 @@
+# Generated by Django 3.2.8 on 2026-10-18 17:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0015_sync'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='barbershop',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='barbershop',
+            name='version',
+            field=models.PositiveIntegerField(default=1, editable=False),
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 3.2.8 on 2026-10-18 17:06
+
+import api.models
+import api.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0016_barbershop_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaUpload',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(max_length=100)),
+                ('object_id', models.BigIntegerField()),
+                ('field', models.CharField(max_length=100)),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('uploaded_name', models.CharField(blank=True, max_length=255)),
+                ('status', models.CharField(default='pending', max_length=10)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'MediaUpload',
+                'verbose_name_plural': 'MediaUploads',
+            },
+        ),
+        migrations.AlterField(
+            model_name='barbershop',
+            name='document',
+            field=models.ImageField(blank=True, null=True, storage=api.storage.get_media_storage, upload_to='documents', validators=[api.models.validate_file_extension]),
+        ),
+        migrations.AlterField(
+            model_name='barbershop',
+            name='photo',
+            field=models.ImageField(blank=True, null=True, storage=api.storage.get_media_storage, upload_to='banners', validators=[api.models.validate_file_extension]),
+        ),
+        migrations.AlterField(
+            model_name='profile',
+            name='photo',
+            field=models.ImageField(blank=True, null=True, storage=api.storage.get_media_storage, upload_to='profiles', validators=[api.models.validate_file_extension]),
+        ),
+        migrations.AddIndex(
+            model_name='mediaupload',
+            index=models.Index(fields=['status', 'updated_at'], name='media_upload_queue_idx'),
+        ),
+    ]
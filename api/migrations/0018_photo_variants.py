@@ -0,0 +1,23 @@
+# Generated by Django 3.2.8 on 2026-10-18 17:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0017_mediaupload'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='barbershop',
+            name='photo_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='photo_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
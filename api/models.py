@@ -1,17 +1,10 @@
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
 from django.db import models
-from gdstorage.storage import GoogleDriveStorage, GoogleDrivePermissionType, GoogleDrivePermissionRole, GoogleDriveFilePermission
+from .geo import grid_cell
+from .storage import get_media_storage
 import os
 
-gd_storage = GoogleDriveStorage()
-
-permission = GoogleDriveFilePermission(
-    GoogleDrivePermissionRole.READER,
-    GoogleDrivePermissionType.USER,
-    "kbvnxl@gmail.com"
-)
-
 def validate_file_extension(value):
     ext = os.path.splitext(value.name)[1]  # [0] returns path+filename
     valid_extensions = ['.jpeg','.jpg', '.png']
@@ -71,10 +64,12 @@ class Comments(models.Model):
 
 
 class Appointment(models.Model):
+    barbershop = models.ForeignKey("Barbershop", on_delete=models.CASCADE, related_name="appointments", null=True, blank=True)
     user = models.ForeignKey(User, on_delete=models.DO_NOTHING)
     date = models.DateField()
     time = models.TimeField()
     status = models.CharField(max_length=20, default="pending")
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self) -> str:
         return "{}: {} - {}".format(self.user.username, self.date.strftime("%A %d"), self.time.strftime("%H:%M")) 
@@ -82,13 +77,20 @@ class Appointment(models.Model):
     class Meta:
         verbose_name = "Appointment"
         verbose_name_plural = "Appointments"
+        indexes = [
+            models.Index(fields=["barbershop", "date", "time"], name="appointment_schedule_idx"),
+            models.Index(fields=["user", "updated_at"], name="appointment_sync_idx"),
+        ]
 
 
 class Message(models.Model):
+    barbershop = models.ForeignKey("Barbershop", on_delete=models.CASCADE, related_name="messages", null=True, blank=True)
     user = models.ForeignKey(User, on_delete=models.DO_NOTHING)
     origin = models.CharField(max_length=5)
     created = models.DateTimeField(auto_now_add=True)
     text = models.TextField()
+    read_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self) -> str:
         return "{}: {} - {}".format(self.user.username, self.origin, self.text) 
@@ -96,6 +98,10 @@ class Message(models.Model):
     class Meta:
         verbose_name = "Message"
         verbose_name_plural = "Messages"
+        indexes = [
+            models.Index(fields=["barbershop", "user", "created"], name="message_thread_idx"),
+            models.Index(fields=["user", "updated_at"], name="message_sync_idx"),
+        ]
 
 
 class Barbershop(models.Model):
@@ -103,32 +109,247 @@ class Barbershop(models.Model):
     description = models.TextField(null=True, blank=True)
     address = models.CharField(max_length=255)
     contact_number = models.CharField(max_length=11, null=True, blank=True)
-    photo = models.ImageField(upload_to='banners', storage=gd_storage, validators=[validate_file_extension], null=True, blank=True)
+    photo = models.ImageField(upload_to='banners', storage=get_media_storage, validators=[validate_file_extension], null=True, blank=True)
+    photo_variants = models.JSONField(default=dict, blank=True, editable=False)
     rating = models.FloatField(default=0)
-    document = models.ImageField(upload_to='documents', storage=gd_storage, validators=[validate_file_extension], null=True, blank=True)
+    rating_sum = models.FloatField(default=0, editable=False)
+    rating_count = models.IntegerField(default=0, editable=False)
+    rating_count_1 = models.IntegerField(default=0, editable=False)
+    rating_count_2 = models.IntegerField(default=0, editable=False)
+    rating_count_3 = models.IntegerField(default=0, editable=False)
+    rating_count_4 = models.IntegerField(default=0, editable=False)
+    rating_count_5 = models.IntegerField(default=0, editable=False)
+    document = models.ImageField(upload_to='documents', storage=get_media_storage, validators=[validate_file_extension], null=True, blank=True)
     latitude = models.FloatField()
     longitude = models.FloatField()
+    grid_cell = models.IntegerField(default=0, db_index=True, editable=False)
     postal_code = models.CharField(max_length=6)
     street = models.CharField(max_length=255)
     barangay = models.CharField(max_length=255)
     city = models.CharField(max_length=255)
     verified = models.BooleanField(default=False)
+    version = models.PositiveIntegerField(default=1, editable=False)
+    updated_at = models.DateTimeField(auto_now=True)
     amenities = models.ManyToManyField(Amenities, related_name="amenities", blank=True)
     services = models.ManyToManyField(Services, related_name="services", blank=True)
     hours = models.ManyToManyField(OperationHours, related_name="hours", blank=True)
     comments = models.ManyToManyField(Comments, related_name="comments", blank=True)
-    favorites = models.ManyToManyField(User, related_name="favorites", blank=True)
-    appointments = models.ManyToManyField(Appointment, related_name="appointments", blank=True)
-    messages = models.ManyToManyField(Message, related_name="messages", blank=True)
+    favorites = models.ManyToManyField(User, through="Favorite", related_name="favorites", blank=True)
 
     def __str__(self) -> str:
         return self.name
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["verified", "-rating", "-id"], name="barbershop_rating_idx"),
+            models.Index(fields=["city", "verified", "-rating", "-id"], name="barbershop_city_rating_idx"),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        deferred = instance.get_deferred_fields()
+        if not {"latitude", "longitude", "rating", "verified"} & deferred:
+            instance._cluster_state = instance.get_cluster_state()
+        if not {"city", "rating", "verified"} & deferred:
+            instance._leaderboard_state = instance.get_leaderboard_state()
+        return instance
+
+    def get_cluster_state(self):
+        """
+        What this shop contributes to the map clusters, None when it is hidden.
+        """
+        if not self.verified:
+            return None
+        return (self.latitude, self.longitude, self.rating)
+
+    def get_leaderboard_state(self):
+        """
+        What places this shop on the leaderboards.
+        """
+        return (self.city, self.rating, self.verified)
+
+    def save(self, *args, **kwargs):
+        self.grid_cell = grid_cell(self.latitude, self.longitude)
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None:
+            extra = {"version", "updated_at"}
+            if "latitude" in update_fields or "longitude" in update_fields:
+                extra.add("grid_cell")
+            kwargs["update_fields"] = set(update_fields) | extra
+        if not self._state.adding:
+            # Incremented in SQL so an instance loaded before a change made
+            # through api.versions never writes an older version back
+            self.version = models.F("version") + 1
+        super().save(*args, **kwargs)
+
+
+class Favorite(models.Model):
+    """
+    A user's favorite barbershop, the through model of Barbershop.favorites
+    kept on the table the implicit one used.
+    """
+    id = models.BigAutoField(primary_key=True)
+    barbershop = models.ForeignKey(Barbershop, on_delete=models.CASCADE)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    created = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self) -> str:
+        return "{}: {}".format(self.user_id, self.barbershop_id)
+
+    class Meta:
+        db_table = "api_barbershop_favorites"
+        verbose_name = "Favorite"
+        verbose_name_plural = "Favorites"
+        unique_together = [("barbershop", "user")]
+        indexes = [
+            models.Index(fields=["user", "created"], name="favorite_sync_idx"),
+        ]
+
+
+class Tombstone(models.Model):
+    """
+    Records a row deleted from a user's synced collections so api.sync can
+    tell clients to drop it.
+    """
+    APPOINTMENT = "appointment"
+    MESSAGE = "message"
+    FAVORITE = "favorite"
+
+    collection = models.CharField(max_length=20)
+    object_id = models.BigIntegerField()
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="tombstones")
+    deleted_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self) -> str:
+        return "{} {}: {}".format(self.collection, self.object_id, self.user_id)
+
+    class Meta:
+        verbose_name = "Tombstone"
+        verbose_name_plural = "Tombstones"
+        indexes = [
+            models.Index(fields=["user", "collection", "deleted_at"], name="tombstone_sync_idx"),
+        ]
+
+
+class MapCluster(models.Model):
+    """
+    Running totals of the verified barbershops inside one map grid cell at a
+    zoom level, kept up to date by api.clusters.
+    """
+    zoom = models.PositiveSmallIntegerField()
+    row = models.IntegerField()
+    column = models.IntegerField()
+    count = models.IntegerField(default=0)
+    latitude_sum = models.FloatField(default=0)
+    longitude_sum = models.FloatField(default=0)
+    rating_sum = models.FloatField(default=0)
+
+    def __str__(self) -> str:
+        return "{}: {}/{} ({})".format(self.zoom, self.row, self.column, self.count)
+
+    @property
+    def latitude(self) -> float:
+        return self.latitude_sum / self.count
+
+    @property
+    def longitude(self) -> float:
+        return self.longitude_sum / self.count
+
+    @property
+    def rating(self) -> float:
+        return round(self.rating_sum / self.count, 2)
+
+    class Meta:
+        verbose_name = "MapCluster"
+        verbose_name_plural = "MapClusters"
+        constraints = [
+            models.UniqueConstraint(fields=["zoom", "row", "column"], name="unique_map_cluster_cell"),
+        ]
+
+
+class LeaderboardEntry(models.Model):
+    """
+    One place of a period's top rated barbershops, overall (empty city) or
+    per city, kept up to date by api.leaderboard.
+    """
+    period = models.CharField(max_length=7)
+    city = models.CharField(max_length=255, blank=True)
+    rank = models.PositiveSmallIntegerField()
+    barbershop = models.ForeignKey(Barbershop, on_delete=models.CASCADE, related_name="leaderboard_entries")
+    rating = models.FloatField()
+
+    def __str__(self) -> str:
+        return "{} {} #{}: {}".format(self.period, self.city or "all", self.rank, self.barbershop_id)
+
+    class Meta:
+        verbose_name = "LeaderboardEntry"
+        verbose_name_plural = "LeaderboardEntries"
+        constraints = [
+            models.UniqueConstraint(fields=["period", "city", "rank"], name="unique_leaderboard_rank"),
+        ]
+
+
+class AppointmentSlot(models.Model):
+    """
+    A quarter hour of a barbershop's day claimed by an appointment. The
+    unique constraint makes the database reject overlapping bookings, see
+    api.booking.
+    """
+    barbershop = models.ForeignKey(Barbershop, on_delete=models.CASCADE, related_name="slots")
+    appointment = models.ForeignKey(Appointment, on_delete=models.CASCADE, related_name="slots")
+    date = models.DateField()
+    slot = models.PositiveSmallIntegerField()
+
+    def __str__(self) -> str:
+        return "{} {} #{}: {}".format(self.barbershop_id, self.date, self.slot, self.appointment_id)
+
+    class Meta:
+        verbose_name = "AppointmentSlot"
+        verbose_name_plural = "AppointmentSlots"
+        constraints = [
+            models.UniqueConstraint(fields=["barbershop", "date", "slot"], name="unique_appointment_slot"),
+        ]
+
+
+class MediaUpload(models.Model):
+    """
+    A staged file waiting to be copied to the remote storage of the model
+    field it belongs to, processed by api.uploads.
+    """
+    PENDING = "pending"
+    UPLOADING = "uploading"
+    DONE = "done"
+    FAILED = "failed"
+    DISCARDED = "discarded"
+
+    model = models.CharField(max_length=100)
+    object_id = models.BigIntegerField()
+    field = models.CharField(max_length=100)
+    name = models.CharField(max_length=255, unique=True)
+    uploaded_name = models.CharField(max_length=255, blank=True)
+    status = models.CharField(max_length=10, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self) -> str:
+        return "{} {}.{}: {}".format(self.model, self.object_id, self.field, self.status)
+
+    class Meta:
+        verbose_name = "MediaUpload"
+        verbose_name_plural = "MediaUploads"
+        indexes = [
+            models.Index(fields=["status", "updated_at"], name="media_upload_queue_idx"),
+        ]
+
 
 class Profile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name="profile")
     contact_number = models.CharField(max_length=11, null=True, blank=True)
-    photo = models.ImageField(upload_to='profiles', storage=gd_storage, validators=[validate_file_extension], null=True, blank=True)
+    photo = models.ImageField(upload_to='profiles', storage=get_media_storage, validators=[validate_file_extension], null=True, blank=True)
+    photo_variants = models.JSONField(default=dict, blank=True, editable=False)
     address = models.CharField(max_length=255, null=True, blank=True)
     account_type = models.CharField(max_length=5)
     barbershop = models.ManyToManyField(Barbershop, related_name="shops", blank=True)
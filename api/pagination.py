@@ -0,0 +1,175 @@
+import base64
+import datetime
+import json
+from collections import OrderedDict
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class CursorEncoder(DjangoJSONEncoder):
+    """
+    Keeps the microseconds DjangoJSONEncoder drops, a truncated timestamp in
+    a cursor would skip the rows created within the same millisecond.
+    """
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination over a compound ordering.
+
+    The cursor holds the ordering values of the row at the edge of the page
+    and the adjacent page is fetched with a lexicographic comparison on
+    them, so a deep page costs the same index range scan as the first one.
+    ``ordering`` must end with a unique field such as ``id``.
+    """
+    ordering = ("-id",)
+    page_size = 20
+    max_page_size = 100
+    page_size_query_param = "page_size"
+    cursor_query_param = "cursor"
+    invalid_cursor_message = "Invalid cursor"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        fields = [(name.lstrip("-"), name.startswith("-")) for name in self.ordering]
+        position, reverse = self.decode_cursor(request)
+
+        if position is not None:
+            queryset = queryset.filter(self.keyset_filter(fields, position, forward=not reverse))
+        if reverse:
+            queryset = queryset.order_by(*[name if descending else "-" + name for name, descending in fields])
+        else:
+            queryset = queryset.order_by(*self.ordering)
+
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if reverse:
+            results.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, position is not None
+
+        self.next_position = self.get_position(results[-1], fields) if results else position
+        self.previous_position = self.get_position(results[0], fields) if results else position
+        return results
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(page_size, 1), self.max_page_size)
+
+    def keyset_filter(self, fields, position, forward):
+        condition = Q()
+        for index, (name, descending) in enumerate(fields):
+            lookup = "{}__{}".format(name, "lt" if descending == forward else "gt")
+            clause = Q(**{lookup: position[index]})
+            for previous, (previous_name, _) in enumerate(fields[:index]):
+                clause &= Q(**{previous_name: position[previous]})
+            condition |= clause
+        return condition
+
+    def get_position(self, row, fields):
+        if isinstance(row, dict):
+            return [row[name] for name, _ in fields]
+        return [getattr(row, name) for name, _ in fields]
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(encoded.encode("ascii")).decode("utf-8"))
+            position, reverse = cursor["p"], bool(cursor.get("r"))
+        except (TypeError, ValueError, KeyError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(position, list) or len(position) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return position, reverse
+
+    def encode_cursor(self, position, reverse):
+        cursor = json.dumps({"p": position, "r": reverse}, cls=CursorEncoder, separators=(",", ":"))
+        encoded = base64.urlsafe_b64encode(cursor.encode("utf-8")).decode("ascii")
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return self.encode_cursor(self.next_position, False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        return self.encode_cursor(self.previous_position, True)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ("next", self.get_next_link()),
+            ("previous", self.get_previous_link()),
+            ("results", data)
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "properties": {
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "previous": {"type": "string", "nullable": True, "format": "uri"},
+                "results": schema,
+            },
+        }
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                "name": self.cursor_query_param,
+                "required": False,
+                "in": "query",
+                "description": "The pagination cursor value.",
+                "schema": {"type": "string"},
+            },
+            {
+                "name": self.page_size_query_param,
+                "required": False,
+                "in": "query",
+                "description": "Number of results to return per page.",
+                "schema": {"type": "integer"},
+            },
+        ]
+
+
+class BarbershopPagination(KeysetPagination):
+    ordering = ("-rating", "-id")
+
+
+class ProfilePagination(KeysetPagination):
+    ordering = ("id",)
+
+
+class MessagePagination(KeysetPagination):
+    ordering = ("-created", "-id")
+
+
+class InboxPagination(KeysetPagination):
+    ordering = ("-last_created", "-user")
+
+
+class AppointmentPagination(KeysetPagination):
+    ordering = ("date", "time", "id")
+
+
+class SearchPagination(PageNumberPagination):
+    page_size = 20
+    page_size_query_param = "page_size"
+    max_page_size = 50
@@ -0,0 +1,16 @@
+from rest_framework import permissions
+from .models import Profile
+
+
+def owns_barbershop(user, barbershop_id):
+    return Profile.objects.filter(user=user, barbershop=barbershop_id).exists()
+
+
+class IsBarbershopOwner(permissions.IsAuthenticated):
+    """
+    Allows the detail actions of a shop to the users whose profile owns it.
+    """
+    message = "You do not own this barbershop."
+
+    def has_permission(self, request, view):
+        return super().has_permission(request, view) and owns_barbershop(request.user, view.kwargs.get("pk"))
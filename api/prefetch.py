@@ -0,0 +1,50 @@
+from django.db.models import Prefetch
+from rest_framework import serializers
+
+
+def _eager_plan(serializer, prefix="", querysets=None):
+    select = []
+    prefetch = []
+    for field in serializer.fields.values():
+        if field.write_only or field.source == "*" or "." in field.source:
+            continue
+        lookup = prefix + field.source
+        if isinstance(field, serializers.ListSerializer):
+            child = field.child
+            queryset = (querysets or {}).get(lookup, child.Meta.model._default_manager.all())
+            queryset = prefetch_queryset(queryset, child)
+            prefetch.append(Prefetch(lookup, queryset=queryset))
+        elif isinstance(field, serializers.BaseSerializer):
+            select.append(lookup)
+            nested_select, nested_prefetch = _eager_plan(field, lookup + "__", querysets)
+            select.extend(nested_select)
+            prefetch.extend(nested_prefetch)
+        elif isinstance(field, serializers.ManyRelatedField):
+            prefetch.append(lookup)
+    return select, prefetch
+
+
+def prefetch_queryset(queryset, serializer, querysets=None):
+    """
+    Applies the select_related/prefetch_related plan needed to render
+    ``queryset`` with ``serializer`` without issuing per-row queries.
+
+    The plan is derived from the serializer's fields: single nested
+    serializers become ``select_related`` joins, ``many=True`` serializers
+    become ``Prefetch`` objects whose querysets carry their own plan, and
+    plain many-to-many primary key fields are prefetched as is.
+
+    ``querysets`` maps lookups to the querysets their rows are prefetched
+    from instead of the default manager, to prefetch a filtered relation.
+    """
+    if isinstance(serializer, type):
+        serializer = serializer()
+    if isinstance(serializer, serializers.ListSerializer):
+        serializer = serializer.child
+
+    select, prefetch = _eager_plan(serializer, querysets=querysets)
+    if select:
+        queryset = queryset.select_related(*select)
+    if prefetch:
+        queryset = queryset.prefetch_related(*prefetch)
+    return queryset
@@ -0,0 +1,165 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+from queue import Full, Queue
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+import redis
+import redis.asyncio
+
+logger = logging.getLogger(__name__)
+
+# Slow websocket clients lose their oldest undelivered events rather than
+# growing the server's memory without bound.
+SUBSCRIBER_QUEUE_SIZE = 100
+REDIS_CHANNEL_PREFIX = "ptown:"
+REDIS_RECONNECT_DELAY = 1
+REDIS_TIMEOUT = 1
+# Messages waiting for the publisher thread; more are dropped while Redis is
+# unreachable, websocket clients catch up through sync.
+PUBLISH_QUEUE_SIZE = 1000
+
+
+def _put(queue, message):
+    if queue.full():
+        queue.get_nowait()
+    queue.put_nowait(message)
+
+
+class LocalBroker:
+    """
+    Delivers published messages to the subscribers of this process.
+
+    Subscribers are asyncio queues read by websocket connections; ``publish``
+    may be called from any thread, such as the worker thread of a sync view.
+    """
+    def __init__(self):
+        self._subscribers = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, channel):
+        queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        with self._lock:
+            self._subscribers.setdefault(channel, {})[queue] = asyncio.get_running_loop()
+        return queue
+
+    def unsubscribe(self, channel, queue):
+        with self._lock:
+            subscribers = self._subscribers.get(channel, {})
+            subscribers.pop(queue, None)
+            if not subscribers:
+                self._subscribers.pop(channel, None)
+
+    def publish(self, channel, message):
+        self.deliver(channel, message)
+
+    def deliver(self, channel, message):
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, {}).items())
+        for queue, loop in subscribers:
+            try:
+                loop.call_soon_threadsafe(_put, queue, message)
+            except RuntimeError:
+                # The connection's event loop is already closed
+                self.unsubscribe(channel, queue)
+
+
+class RedisBroker(LocalBroker):
+    """
+    Fans messages out across worker processes through Redis pub/sub.
+
+    ``publish`` only queues the message: a publisher thread per process
+    sends it with a blocking PUBLISH, so a slow or unreachable Redis never
+    holds up the request that published. After a failed attempt the thread
+    drops messages for REDIS_RECONNECT_DELAY before trying again. Each
+    process that has websocket subscribers runs one PSUBSCRIBE listener task
+    that hands the messages of every worker to the local subscribers.
+    """
+    def __init__(self, url):
+        super().__init__()
+        self.url = url
+        self.client = redis.Redis.from_url(url, socket_timeout=REDIS_TIMEOUT, socket_connect_timeout=REDIS_TIMEOUT)
+        self._retry_at = 0
+        self._outbox = Queue(maxsize=PUBLISH_QUEUE_SIZE)
+        self._publisher = None
+        self._publisher_lock = threading.Lock()
+        self._listeners = {}
+
+    def publish(self, channel, message):
+        payload = json.dumps({"channel": channel, "message": message}, cls=DjangoJSONEncoder)
+        try:
+            self._outbox.put_nowait((channel, payload))
+        except Full:
+            logger.warning("Publish queue full, dropped a message to %s", channel)
+        if self._publisher is None or not self._publisher.is_alive():
+            with self._publisher_lock:
+                # Also restarts it in a process forked after it was started
+                if self._publisher is None or not self._publisher.is_alive():
+                    self._publisher = threading.Thread(target=self._publish_forever, name="redis-publisher", daemon=True)
+                    self._publisher.start()
+
+    def _publish_forever(self):
+        while True:
+            channel, payload = self._outbox.get()
+            try:
+                self.send(channel, payload)
+            finally:
+                self._outbox.task_done()
+
+    def send(self, channel, payload):
+        """
+        PUBLISHes a message. Returns False when it was dropped because Redis
+        is unreachable.
+        """
+        if time.monotonic() < self._retry_at:
+            return False
+        try:
+            self.client.publish(REDIS_CHANNEL_PREFIX + channel, payload)
+            return True
+        except redis.RedisError:
+            logger.exception("Could not publish to %s", channel)
+        self._retry_at = time.monotonic() + REDIS_RECONNECT_DELAY
+        return False
+
+    def subscribe(self, channel):
+        queue = super().subscribe(channel)
+        loop = asyncio.get_running_loop()
+        if self._listeners.get(loop) is None or self._listeners[loop].done():
+            self._listeners[loop] = loop.create_task(self._listen())
+        return queue
+
+    async def _listen(self):
+        while True:
+            client = redis.asyncio.Redis.from_url(self.url, socket_connect_timeout=REDIS_TIMEOUT)
+            pubsub = client.pubsub()
+            try:
+                await pubsub.psubscribe(REDIS_CHANNEL_PREFIX + "*")
+                async for reply in pubsub.listen():
+                    self._dispatch(reply)
+            except redis.RedisError:
+                logger.exception("Redis subscription lost, reconnecting")
+                await asyncio.sleep(REDIS_RECONNECT_DELAY)
+            finally:
+                await pubsub.close()
+                await client.close()
+
+    def _dispatch(self, reply):
+        if reply["type"] == "pmessage":
+            payload = json.loads(reply["data"])
+            self.deliver(payload["channel"], payload["message"])
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                url = getattr(settings, "REALTIME_REDIS_URL", None)
+                _broker = RedisBroker(url) if url else LocalBroker()
+    return _broker
@@ -0,0 +1,101 @@
+import math
+from django.db import transaction
+from django.db.models import Case, Count, F, FloatField, Func, Q, Sum, Value, When
+from . import batching, clusters, leaderboard
+from .models import Barbershop
+
+RATING_STARS = range(1, 6)
+RATING_HISTOGRAM_FIELDS = ["rating_count_{}".format(stars) for stars in RATING_STARS]
+
+
+class RoundRating(Func):
+    """
+    ROUND(expression, 2) that also works on Postgres double precision values.
+    """
+    function = "ROUND"
+    template = "%(function)s(%(expressions)s, 2)"
+    output_field = FloatField()
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        return self.as_sql(
+            compiler, connection,
+            template="%(function)s((%(expressions)s)::numeric, 2)::double precision",
+            **extra_context
+        )
+
+
+def rating_stars(rating):
+    """
+    The histogram bucket of a rating: the nearest whole star, clamped to 1-5.
+    """
+    return min(max(int(math.floor(rating + 0.5)), RATING_STARS[0]), RATING_STARS[-1])
+
+
+def change_ratings(barbershop_id, ratings, sign=1):
+    """
+    Adds (``sign=1``) or removes (``sign=-1``) review ratings from a shop's
+    rating aggregate with F() updates, so the cost does not depend on how
+    many reviews the shop already has.
+    """
+    ratings = list(ratings)
+    if not ratings:
+        return
+    changes = {
+        "rating_sum": F("rating_sum") + sign * sum(ratings),
+        "rating_count": F("rating_count") + sign * len(ratings),
+    }
+    for rating in ratings:
+        field = "rating_count_{}".format(rating_stars(rating))
+        changes[field] = changes.get(field, F(field)) + sign
+
+    with transaction.atomic():
+        barbershop = Barbershop.objects.only("latitude", "longitude", "rating", "verified", "city").filter(pk=barbershop_id).first()
+        if barbershop is None:
+            return
+        barbershops = Barbershop.objects.filter(pk=barbershop_id)
+        barbershops.update(**changes)
+        barbershops.update(rating=Case(
+            When(rating_count__gt=0, then=RoundRating(F("rating_sum") / F("rating_count"))),
+            default=Value(0.0),
+            output_field=FloatField()
+        ))
+        previous = barbershop.get_cluster_state()
+        barbershop.refresh_from_db(fields=["rating"])
+        clusters.update_clusters(previous, barbershop.get_cluster_state())
+        if not batching.is_batched(barbershop_id):
+            leaderboard.barbershop_changed(barbershop)
+
+
+def _stars_filter(stars):
+    condition = Q()
+    if stars > RATING_STARS[0]:
+        condition &= Q(comments__rating__gte=stars - 0.5)
+    if stars < RATING_STARS[-1]:
+        condition &= Q(comments__rating__lt=stars + 0.5)
+    return condition
+
+
+def rebuild_ratings(barbershop_model):
+    """
+    Recomputes every shop's rating aggregate from its reviews.
+    """
+    histogram = {
+        "stars_{}".format(stars): Count("comments", filter=_stars_filter(stars))
+        for stars in RATING_STARS
+    }
+    barbershops = list(barbershop_model.objects.annotate(
+        total=Sum("comments__rating"), total_count=Count("comments"), **histogram
+    ))
+    for barbershop in barbershops:
+        barbershop.rating_sum = barbershop.total or 0
+        barbershop.rating_count = barbershop.total_count
+        for stars in RATING_STARS:
+            setattr(barbershop, "rating_count_{}".format(stars), getattr(barbershop, "stars_{}".format(stars)))
+        if barbershop.rating_count:
+            barbershop.rating = round(barbershop.rating_sum / barbershop.rating_count, 2)
+        else:
+            barbershop.rating = 0.0
+    barbershop_model.objects.bulk_update(
+        barbershops, ["rating", "rating_sum", "rating_count"] + RATING_HISTOGRAM_FIELDS, batch_size=500
+    )
+    return len(barbershops)
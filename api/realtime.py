@@ -0,0 +1,115 @@
+import asyncio
+import json
+import re
+from urllib.parse import parse_qs
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import close_old_connections
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.exceptions import InvalidToken
+from .authentication import CachedJWTAuthentication
+from .permissions import owns_barbershop
+from .pubsub import get_broker
+from .serializers import AppointmentsSerializer, MessagesListSerializer
+
+USER_PATH = re.compile(r"^/ws/user/?$")
+BARBERSHOP_PATH = re.compile(r"^/ws/barbershop/(?P<pk>\d+)/?$")
+CLOSE_FORBIDDEN = 4403
+
+
+def user_channel(user_id):
+    return "user.{}".format(user_id)
+
+
+def barbershop_channel(barbershop_id):
+    return "barbershop.{}".format(barbershop_id)
+
+
+def publish(event, data, user_id, barbershop_id):
+    """
+    Sends an event to the customer it concerns and to the shop.
+    """
+    message = {"event": event, "barbershop": barbershop_id, "data": data}
+    broker = get_broker()
+    broker.publish(user_channel(user_id), message)
+    if barbershop_id is not None:
+        broker.publish(barbershop_channel(barbershop_id), message)
+
+
+def message_created(message):
+    publish("message.created", MessagesListSerializer(message).data, message.user_id, message.barbershop_id)
+
+
+def appointment_changed(appointment, created):
+    event = "appointment.created" if created else "appointment.updated"
+    publish(event, AppointmentsSerializer(appointment).data, appointment.user_id, appointment.barbershop_id)
+
+
+def appointment_deleted(appointment_id, user_id, barbershop_id):
+    publish("appointment.deleted", {"id": appointment_id}, user_id, barbershop_id)
+
+
+def authorize(scope):
+    """
+    Returns the channel a websocket connection may listen to, or None.
+
+    The access token travels in the ``token`` query parameter because
+    browsers cannot set headers on websocket requests. ``/ws/user/`` streams
+    the events of the token's user and ``/ws/barbershop/<id>/`` those of a
+    shop the user's profile belongs to.
+    """
+    close_old_connections()
+    try:
+        token = parse_qs(scope.get("query_string", b"").decode("latin-1")).get("token")
+        if not token:
+            return None
+        authentication = CachedJWTAuthentication()
+        user = authentication.get_user(authentication.get_validated_token(token[0]))
+        path = scope["path"]
+        if USER_PATH.match(path):
+            return user_channel(user.pk)
+        match = BARBERSHOP_PATH.match(path)
+        if match and owns_barbershop(user, match.group("pk")):
+            return barbershop_channel(match.group("pk"))
+        return None
+    except (InvalidToken, AuthenticationFailed):
+        return None
+    finally:
+        close_old_connections()
+
+
+async def websocket_application(scope, receive, send):
+    """
+    ASGI application pushing published events to websocket clients as JSON
+    text frames. Messages sent by the client are ignored.
+    """
+    event = await receive()
+    if event["type"] != "websocket.connect":
+        return
+    channel = await sync_to_async(authorize)(scope)
+    if channel is None:
+        await send({"type": "websocket.close", "code": CLOSE_FORBIDDEN})
+        return
+
+    broker = get_broker()
+    queue = broker.subscribe(channel)
+    receiving = asyncio.ensure_future(receive())
+    getting = None
+    try:
+        await send({"type": "websocket.accept"})
+        while True:
+            getting = asyncio.ensure_future(queue.get())
+            done, _ = await asyncio.wait({receiving, getting}, return_when=asyncio.FIRST_COMPLETED)
+            if getting in done:
+                await send({"type": "websocket.send", "text": json.dumps(getting.result(), cls=DjangoJSONEncoder)})
+            if receiving in done:
+                if receiving.result()["type"] == "websocket.disconnect":
+                    break
+                receiving = asyncio.ensure_future(receive())
+            if not getting.done():
+                getting.cancel()
+    finally:
+        broker.unsubscribe(channel, queue)
+        for task in (receiving, getting):
+            if task is not None and not task.done():
+                task.cancel()
@@ -0,0 +1,105 @@
+import contextvars
+import random
+from contextlib import contextmanager
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DEFAULT_DB_ALIAS
+
+# Every database besides the default one is a read-only copy of it. Reads
+# go to a replica only inside ReplicaReadMixin's actions, everything else,
+# signals, commands and writes included, uses the primary.
+READ_METHODS = ("GET", "HEAD")
+WRITE_METHODS = ("POST", "PUT", "PATCH", "DELETE")
+PIN_KEY = "primary-pin:{}"
+
+# Alias of the replica the current request reads from
+_replica = contextvars.ContextVar("replica", default=None)
+
+
+def replicas():
+    return [alias for alias in settings.DATABASES if alias != DEFAULT_DB_ALIAS]
+
+
+def pin_to_primary(user_id):
+    cache.set(PIN_KEY.format(user_id), True, settings.READ_YOUR_WRITES_SECONDS)
+
+
+def is_pinned(user_id):
+    return cache.get(PIN_KEY.format(user_id)) is not None
+
+
+@contextmanager
+def primary_reads():
+    """
+    Sends the reads of the block to the primary. For reads whose result is
+    cached or written back, which must not come from a lagging replica.
+    Explicitly, as without a router's answer Django reads related objects
+    from the database their instance came from.
+    """
+    token = _replica.set(DEFAULT_DB_ALIAS)
+    try:
+        yield
+    finally:
+        _replica.reset(token)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        return _replica.get()
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get their schema from the primary
+        return db == DEFAULT_DB_ALIAS
+
+
+class ReplicaReadMixin:
+    """
+    Serves the ``replica_actions`` of a viewset from a read replica, one per
+    request so it reads a single snapshot. Users who wrote in the last
+    READ_YOUR_WRITES_SECONDS stay on the primary and see their own changes.
+    """
+    replica_actions = ()
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        aliases = replicas()
+        if not aliases or request.method not in READ_METHODS or self.action not in self.replica_actions:
+            return
+        if request.user.is_authenticated and is_pinned(request.user.pk):
+            return
+        self._replica_token = _replica.set(random.choice(aliases))
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        token = getattr(self, "_replica_token", None)
+        if token is not None:
+            _replica.reset(token)
+            self._replica_token = None
+        return super().finalize_response(request, response, *args, **kwargs)
+
+
+class ReadYourWritesMiddleware:
+    """
+    Pins users to the primary database for READ_YOUR_WRITES_SECONDS after a
+    successful write, so a replica lagging behind does not hide it from
+    them. Unused without replicas.
+    """
+    def __init__(self, get_response):
+        if not replicas():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if request.method in WRITE_METHODS and response.status_code < 400:
+            # Set by the API's authentication as well
+            user = getattr(request, "user", None)
+            if user is not None and user.is_authenticated:
+                pin_to_primary(user.pk)
+        return response
@@ -0,0 +1,121 @@
+import re
+from django.db import connection
+
+# Barbershop full-text index, kept outside the ORM because its shape depends
+# on the database: an FTS5 virtual table keyed by rowid on SQLite and a
+# tsvector table with a GIN index on Postgres.
+SEARCH_TABLE = "api_barbershop_search"
+SEARCH_COLUMNS = ["name", "description", "address", "amenities", "services"]
+SEARCH_MAX_TERMS = 10
+# Barbershop fields the document is built from, besides its relations
+INDEXED_FIELDS = {"name", "description", "address", "street", "barangay", "city", "postal_code"}
+
+# Column weights: bm25() weights on SQLite, tsvector labels on Postgres
+SQLITE_WEIGHTS = "10.0, 2.0, 4.0, 3.0, 3.0"
+POSTGRES_LABELS = ["A", "C", "B", "B", "B"]
+
+
+def search_document(barbershop):
+    """
+    The indexed text of a shop, one value per SEARCH_COLUMNS entry.
+    """
+    address = [barbershop.address, barbershop.street, barbershop.barangay, barbershop.city, barbershop.postal_code]
+    return [
+        barbershop.name,
+        barbershop.description or "",
+        " ".join(part for part in address if part),
+        " ".join(barbershop.amenities.values_list("name", flat=True)),
+        " ".join(barbershop.services.values_list("name", flat=True)),
+    ]
+
+
+def index_barbershop(barbershop):
+    document = search_document(barbershop)
+    with connection.cursor() as cursor:
+        if connection.vendor == "sqlite":
+            cursor.execute("DELETE FROM {} WHERE rowid = %s".format(SEARCH_TABLE), [barbershop.pk])
+            cursor.execute(
+                "INSERT INTO {} (rowid, {}) VALUES (%s, {})".format(
+                    SEARCH_TABLE, ", ".join(SEARCH_COLUMNS), ", ".join(["%s"] * len(SEARCH_COLUMNS))
+                ),
+                [barbershop.pk] + document
+            )
+        elif connection.vendor == "postgresql":
+            vector = " || ".join(
+                "setweight(to_tsvector('simple', %s), '{}')".format(label) for label in POSTGRES_LABELS
+            )
+            cursor.execute(
+                "INSERT INTO {0} (barbershop_id, document) VALUES (%s, {1}) "
+                "ON CONFLICT (barbershop_id) DO UPDATE SET document = EXCLUDED.document".format(SEARCH_TABLE, vector),
+                [barbershop.pk] + document
+            )
+
+
+def remove_barbershop(pk):
+    with connection.cursor() as cursor:
+        if connection.vendor == "sqlite":
+            cursor.execute("DELETE FROM {} WHERE rowid = %s".format(SEARCH_TABLE), [pk])
+        elif connection.vendor == "postgresql":
+            cursor.execute("DELETE FROM {} WHERE barbershop_id = %s".format(SEARCH_TABLE), [pk])
+
+
+def search_terms(query):
+    return re.findall(r"[^\W_]+", query.lower())[:SEARCH_MAX_TERMS]
+
+
+class SearchResults:
+    """
+    Ranked ``(pk, rank)`` matches for a query over verified shops, best first.
+
+    Supports ``count()`` and slicing so it can be handed to a paginator; each
+    slice runs one ranked query with LIMIT/OFFSET. Every term is matched as
+    a prefix and a shop matches if it contains any term, so shops matching
+    more of the terms rank higher.
+    """
+    def __init__(self, query):
+        terms = search_terms(query)
+        if connection.vendor == "sqlite":
+            self.match = " OR ".join('"{}"*'.format(term) for term in terms)
+            self.sql = (
+                "FROM {0} JOIN api_barbershop ON api_barbershop.id = {0}.rowid "
+                "WHERE {0} MATCH %s AND api_barbershop.verified".format(SEARCH_TABLE)
+            )
+            self.rank = "-bm25({}, {})".format(SEARCH_TABLE, SQLITE_WEIGHTS)
+            self.pk = "{}.rowid".format(SEARCH_TABLE)
+        else:
+            self.match = " | ".join("{}:*".format(term) for term in terms)
+            self.sql = (
+                "FROM {0} JOIN api_barbershop ON api_barbershop.id = {0}.barbershop_id "
+                "WHERE {0}.document @@ to_tsquery('simple', %s) AND api_barbershop.verified".format(SEARCH_TABLE)
+            )
+            self.rank = "ts_rank({}.document, to_tsquery('simple', %s))".format(SEARCH_TABLE)
+            self.pk = "{}.barbershop_id".format(SEARCH_TABLE)
+        self._count = None
+
+    def count(self):
+        if not self.match:
+            return 0
+        if self._count is None:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT COUNT(*) " + self.sql, [self.match])
+                self._count = cursor.fetchone()[0]
+        return self._count
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice) or key.stop is None:
+            raise TypeError("SearchResults only supports bounded slices")
+        start = key.start or 0
+        if not self.match or key.stop <= start:
+            return []
+        params = [self.match] if connection.vendor == "sqlite" else [self.match, self.match]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT {}, {} AS rank {} ORDER BY rank DESC, {} LIMIT %s OFFSET %s".format(
+                    self.pk, self.rank, self.sql, self.pk
+                ),
+                params + [key.stop - start, start]
+            )
+            return cursor.fetchall()
@@ -0,0 +1,232 @@
+import datetime
+import random
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.utils import timezone
+from . import leaderboard, search
+from .booking import appointment_slots
+from .clusters import rebuild_clusters
+from .geo import grid_cell
+from .models import (
+    Amenities, Appointment, AppointmentSlot, Barbershop, Comments, Favorite, MapCluster, Message, OperationHours,
+    Profile, Services
+)
+from .ratings import rebuild_ratings
+
+# Synthetic data for benchmarks and local load tests. Rows are written with
+# bulk_create, which skips the model signals, so the derived data (ratings,
+# clusters, search index, leaderboards) is rebuilt once at the end.
+SEED_PASSWORD = "ptown-seed"
+SEED_BATCH_SIZE = 500
+SEED_SIZES = {
+    "barbershops": 2000,
+    "users": 5000,
+    "appointments": 20000,
+    "messages": 20000,
+    "comments": 10000,
+    "favorites": 10000,
+}
+
+CITIES = [
+    ("Manila", 14.5995, 120.9842),
+    ("Quezon City", 14.6760, 121.0437),
+    ("Makati", 14.5547, 121.0244),
+    ("Pasig", 14.5764, 121.0851),
+    ("Taguig", 14.5176, 121.0509),
+    ("Cebu City", 10.3157, 123.8854),
+    ("Davao City", 7.1907, 125.4553),
+]
+AMENITIES = ["Air conditioning", "Wi-Fi", "Parking", "Coffee", "Television", "Card payment", "Wheelchair access"]
+SERVICES = [("Haircut", 150), ("Shave", 100), ("Beard trim", 120), ("Hair color", 500), ("Massage", 250), ("Kids cut", 120)]
+DAYS = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+FIRST_NAMES = ["Juan", "Jose", "Mark", "Paolo", "Miguel", "Carlo", "Angelo", "Rafael", "Maria", "Ana", "Grace", "Bea"]
+LAST_NAMES = ["Santos", "Reyes", "Cruz", "Bautista", "Garcia", "Mendoza", "Torres", "Villanueva", "Ramos", "Aquino"]
+WORDS = ["fresh", "classic", "sharp", "clean", "prime", "royal", "urban", "gentle", "golden", "modern"]
+APPOINTMENT_HOURS = range(8, 20)
+APPOINTMENT_DAYS = range(-30, 31)
+
+
+def _insert(model, objects):
+    """
+    Bulk inserts ``objects`` and returns their primary keys in order.
+
+    bulk_create does not return primary keys on every backend, so they are
+    read back as the rows above the previous maximum; seeding assumes
+    nothing else writes to the table meanwhile.
+    """
+    last = model.objects.order_by("-pk").values_list("pk", flat=True).first() or 0
+    model.objects.bulk_create(objects, batch_size=SEED_BATCH_SIZE)
+    return list(model.objects.filter(pk__gt=last).order_by("pk").values_list("pk", flat=True))
+
+
+def _sentence(rng, words):
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+def seed(barbershops=None, users=None, appointments=None, messages=None, comments=None, favorites=None, random_seed=0):
+    """
+    Generates shops with amenities, services and hours, customer and owner
+    accounts, and appointments, messages, reviews and favorites between
+    them. The same ``random_seed`` produces the same data. Seeded accounts
+    log in with SEED_PASSWORD.
+
+    Returns the number of rows created per kind.
+    """
+    sizes = dict(SEED_SIZES)
+    sizes.update({name: value for name, value in {
+        "barbershops": barbershops, "users": users, "appointments": appointments,
+        "messages": messages, "comments": comments, "favorites": favorites,
+    }.items() if value is not None})
+    if sizes["users"] < 1:
+        raise ValueError("Seeding needs at least one user")
+    rng = random.Random(random_seed)
+    now = timezone.now()
+    today = timezone.localdate()
+
+    with transaction.atomic():
+        Amenities.objects.bulk_create([Amenities(name=name) for name in AMENITIES], ignore_conflicts=True)
+        amenity_ids = list(Amenities.objects.filter(name__in=AMENITIES).values_list("pk", flat=True))
+        service_ids = _insert(Services, [Services(name=name, price=price) for name, price in SERVICES])
+        hour_ids = _insert(OperationHours, [
+            OperationHours(day=day, opening_time=datetime.time(8), closing_time=datetime.time(20 if index < 6 else 17))
+            for index, day in enumerate(DAYS)
+        ])
+
+        start = User.objects.filter(username__startswith="seed").count()
+        password = make_password(SEED_PASSWORD)
+        user_ids = _insert(User, [
+            User(
+                username="seed{}".format(start + index),
+                first_name=rng.choice(FIRST_NAMES),
+                last_name=rng.choice(LAST_NAMES),
+                email="seed{}@example.com".format(start + index),
+                password=password,
+            )
+            for index in range(sizes["users"])
+        ])
+        # One account in ten owns shops, the rest are customers
+        owner_ids = user_ids[:max(1, len(user_ids) // 10)]
+        customer_ids = user_ids[len(owner_ids):] or owner_ids
+        profile_ids = _insert(Profile, [
+            Profile(user_id=user_id, account_type="owner" if index < len(owner_ids) else "user")
+            for index, user_id in enumerate(user_ids)
+        ])
+
+        shops = []
+        for index in range(sizes["barbershops"]):
+            city, latitude, longitude = rng.choice(CITIES)
+            latitude += rng.uniform(-0.1, 0.1)
+            longitude += rng.uniform(-0.1, 0.1)
+            shops.append(Barbershop(
+                name="{} {} Barbershop".format(rng.choice(WORDS).capitalize(), rng.choice(LAST_NAMES)),
+                description=_sentence(rng, 12),
+                address="{} {} Street".format(rng.randint(1, 999), rng.choice(LAST_NAMES)),
+                contact_number="09{:09d}".format(rng.randrange(10 ** 9)),
+                latitude=latitude,
+                longitude=longitude,
+                grid_cell=grid_cell(latitude, longitude),
+                postal_code="{:04d}".format(rng.randint(1000, 9999)),
+                street="{} Street".format(rng.choice(LAST_NAMES)),
+                barangay="Barangay {}".format(rng.randint(1, 200)),
+                city=city,
+                verified=rng.random() < 0.9,
+            ))
+        shop_ids = _insert(Barbershop, shops)
+
+        Barbershop.amenities.through.objects.bulk_create([
+            Barbershop.amenities.through(barbershop_id=shop_id, amenities_id=amenity_id)
+            for shop_id in shop_ids for amenity_id in rng.sample(amenity_ids, rng.randint(1, len(amenity_ids)))
+        ], batch_size=SEED_BATCH_SIZE)
+        Barbershop.services.through.objects.bulk_create([
+            Barbershop.services.through(barbershop_id=shop_id, services_id=service_id)
+            for shop_id in shop_ids for service_id in rng.sample(service_ids, rng.randint(1, len(service_ids)))
+        ], batch_size=SEED_BATCH_SIZE)
+        Barbershop.hours.through.objects.bulk_create([
+            Barbershop.hours.through(barbershop_id=shop_id, operationhours_id=hour_id)
+            for shop_id in shop_ids for hour_id in hour_ids
+        ], batch_size=SEED_BATCH_SIZE)
+        Profile.barbershop.through.objects.bulk_create([
+            Profile.barbershop.through(profile_id=profile_ids[index % len(owner_ids)], barbershop_id=shop_id)
+            for index, shop_id in enumerate(shop_ids)
+        ], batch_size=SEED_BATCH_SIZE)
+
+        comment_shops = [rng.choice(shop_ids) for _ in range(sizes["comments"])] if shop_ids else []
+        comment_ids = _insert(Comments, [
+            Comments(
+                text=_sentence(rng, 8),
+                rating=rng.choice([1, 2, 3, 3.5, 4, 4, 4.5, 5, 5]),
+                type="review",
+                user_id=rng.choice(customer_ids),
+            )
+            for _ in comment_shops
+        ])
+        Barbershop.comments.through.objects.bulk_create([
+            Barbershop.comments.through(barbershop_id=shop_id, comments_id=comment_id)
+            for shop_id, comment_id in zip(comment_shops, comment_ids)
+        ], batch_size=SEED_BATCH_SIZE)
+
+        # Appointments take distinct hours of a shop's day so their slots
+        # never overlap
+        booked = set()
+        bookings = []
+        for _ in range(sizes["appointments"] if shop_ids else 0):
+            key = (rng.choice(shop_ids), rng.choice(APPOINTMENT_DAYS), rng.choice(APPOINTMENT_HOURS))
+            if key in booked:
+                continue
+            booked.add(key)
+            shop_id, day, hour = key
+            date = today + datetime.timedelta(days=day)
+            bookings.append(Appointment(
+                barbershop_id=shop_id,
+                user_id=rng.choice(customer_ids),
+                date=date,
+                time=datetime.time(hour),
+                status="done" if day < 0 else rng.choice(["pending", "pending", "accepted"]),
+            ))
+        appointment_ids = _insert(Appointment, bookings)
+        slots = []
+        for appointment_id, appointment in zip(appointment_ids, bookings):
+            appointment.pk = appointment_id
+            slots.extend(appointment_slots(appointment.barbershop_id, appointment))
+        AppointmentSlot.objects.bulk_create(slots, batch_size=SEED_BATCH_SIZE)
+
+        # Messages come in threads of a customer and a shop
+        threads = []
+        while shop_ids and sum(length for _, _, length in threads) < sizes["messages"]:
+            threads.append((rng.choice(shop_ids), rng.choice(customer_ids), rng.randint(1, 10)))
+        chat = []
+        for shop_id, user_id, length in threads:
+            for index in range(length):
+                chat.append(Message(
+                    barbershop_id=shop_id,
+                    user_id=user_id,
+                    origin="user" if index % 2 == 0 else "shop",
+                    text=_sentence(rng, rng.randint(3, 15)),
+                    read_at=now if index < length - 1 or rng.random() < 0.5 else None,
+                ))
+        chat = chat[:sizes["messages"]]
+        Message.objects.bulk_create(chat, batch_size=SEED_BATCH_SIZE)
+
+        favorite_pairs = {
+            (rng.choice(shop_ids), rng.choice(customer_ids)) for _ in range(sizes["favorites"] if shop_ids else 0)
+        }
+        Favorite.objects.bulk_create([
+            Favorite(barbershop_id=shop_id, user_id=user_id) for shop_id, user_id in favorite_pairs
+        ], batch_size=SEED_BATCH_SIZE, ignore_conflicts=True)
+
+        rebuild_ratings(Barbershop)
+        rebuild_clusters(Barbershop, MapCluster)
+        for barbershop in Barbershop.objects.filter(pk__in=shop_ids):
+            search.index_barbershop(barbershop)
+        for city in [""] + sorted({name for name, _, _ in CITIES}):
+            leaderboard.refresh_leaderboard(city)
+
+    return {
+        "barbershops": len(shop_ids),
+        "users": len(user_ids),
+        "appointments": len(appointment_ids),
+        "messages": len(chat),
+        "comments": len(comment_ids),
+        "favorites": len(favorite_pairs),
+    }
@@ -1,16 +1,138 @@
 from django.contrib.auth.models import User
+from django.db import transaction
 from django.db.models import Q
+from django.urls import reverse
+from django.utils import timezone
 from rest_framework import serializers
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
-from .models import Amenities, Appointment, Message, Services, OperationHours, Comments, Barbershop, Profile
+from .authentication import token_claims
+from .availability import AVAILABILITY_MAX_DAYS
+from .batching import batched_relations
+from .booking import reschedule_appointment
+from .metrics import serialization_timer
+from .models import Amenities, Appointment, Message, Services, OperationHours, Comments, Barbershop, MapCluster, Profile
 import datetime
 
+# Denormalized Barbershop columns maintained by the models, not part of the API
+BARBERSHOP_INTERNAL_FIELDS = [
+    "grid_cell",
+    "rating_sum",
+    "rating_count_1",
+    "rating_count_2",
+    "rating_count_3",
+    "rating_count_4",
+    "rating_count_5",
+    "version",
+    "updated_at"
+]
+
+
+def parse_field_paths(value):
+    """
+    Turns ``"name,comments.user,comments.text"`` into a nested dict of
+    field names: ``{"name": {}, "comments": {"user": {}, "text": {}}}``.
+    """
+    tree = {}
+    for path in (value or "").split(","):
+        path = path.strip()
+        if not path:
+            continue
+        node = tree
+        for part in path.split("."):
+            node = node.setdefault(part, {})
+    return tree
+
+
+class DynamicFieldsMixin:
+    """
+    Shapes the output with the ``fields`` and ``expand`` query parameters.
+
+    ``?fields=name,latitude`` keeps only the listed fields. Relations listed
+    in ``Meta.expandable_fields`` are omitted unless named in ``?expand=``
+    (or ``fields``), ``expand=*`` expanding all of them. Dotted paths such
+    as ``expand=barbershop.comments`` apply to nested serializers. The
+    selection can also be passed as ``fields``/``expand`` keyword
+    arguments; without either, or a request in the context, every field is
+    rendered.
+    """
+    def __init__(self, *args, **kwargs):
+        fields = kwargs.pop("fields", None)
+        expand = kwargs.pop("expand", None)
+        super().__init__(*args, **kwargs)
+        self._field_selection = None
+        if fields is not None or expand is not None:
+            self._field_selection = (parse_field_paths(fields), parse_field_paths(expand))
+
+    def get_field_selection(self):
+        if self._field_selection is not None:
+            return self._field_selection
+        parent = self.parent
+        if isinstance(parent, serializers.ListSerializer):
+            parent = parent.parent
+        request = self.context.get("request")
+        if parent is not None or request is None:
+            return None
+        params = getattr(request, "query_params", request.GET)
+        return parse_field_paths(params.get("fields")), parse_field_paths(params.get("expand"))
+
+    def get_fields(self):
+        fields = super().get_fields()
+        selection = self.get_field_selection()
+        if selection is None:
+            return fields
+        only, expand = selection
+        expandable = getattr(self.Meta, "expandable_fields", ())
+        for name in list(fields):
+            if only and name not in only:
+                fields.pop(name)
+                continue
+            if name in expandable and name not in expand and name not in only and "*" not in expand:
+                fields.pop(name)
+                continue
+            nested = getattr(fields[name], "child", fields[name])
+            if isinstance(nested, DynamicFieldsMixin):
+                nested._field_selection = (only.get(name, {}), expand.get(name, {}))
+        return fields
+
+    def to_representation(self, instance):
+        with serialization_timer():
+            return super().to_representation(instance)
+
+
+class ImageVariantsField(serializers.DictField):
+    """
+    The URL, width and height of each generated size of an image, see
+    api.images. Empty until the upload has been processed.
+    """
+    def __init__(self, **kwargs):
+        kwargs.setdefault("read_only", True)
+        super().__init__(child=serializers.DictField(), **kwargs)
+
+    def to_representation(self, value):
+        request = self.context.get("request")
+        variants = {}
+        for variant, image in (value or {}).items():
+            url = reverse("image-variant", args=[image["name"]])
+            variants[variant] = {
+                "url": request.build_absolute_uri(url) if request else url,
+                "width": image["width"],
+                "height": image["height"],
+            }
+        return variants
+
+
 class MyTokenObtainPairSerializer(TokenObtainPairSerializer):
+    @classmethod
+    def get_token(cls, user):
+        # Read by api.authentication.CachedJWTAuthentication
+        token = super().get_token(user)
+        for claim, value in token_claims(user).items():
+            token[claim] = value
+        return token
+
     def validate(self, attrs):
+        # Authenticates and mints the pair through get_token
         data = super().validate(attrs)
-        refresh = self.get_token(self.user)
-        data['refresh'] = str(refresh)
-        data['access'] = str(refresh.access_token)
 
         # Add extra responses here
         data['id'] = self.user.id
@@ -27,7 +149,7 @@ class UserFavoritesSerializer(serializers.ModelSerializer):
         ]
 
 
-class UserListSerializer(serializers.ModelSerializer):
+class UserListSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = User
         fields = [
@@ -58,7 +180,6 @@ class UserCreateSerializer(serializers.ModelSerializer):
             email=validated_data["email"],
             password=validated_data["password"],
         )
-        user.set_password(validated_data["password"])
         return user
     
 
@@ -96,47 +217,47 @@ class OperationHoursSerializer(serializers.ModelSerializer):
         fields = "__all__"
 
 
-class CommentsSerializer(serializers.ModelSerializer):
+class CommentsSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     user = UserListSerializer(read_only=True)
     class Meta:
         model = Comments
         fields = "__all__"
         
         
-class AppointmentFilteredListUserSerializer(serializers.ListSerializer):
-    def to_representation(self, data):
-        data = data.filter(user=self.context['request'].user)
-        return super(AppointmentFilteredListUserSerializer, self).to_representation(data)
-
-    
-class AppointmentsFilteredSerializer(serializers.ModelSerializer):
+class AppointmentsFilteredSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     user = UserListSerializer(read_only=True)
     class Meta:
         model = Appointment
-        fields = "__all__"
-        list_serializer_class = AppointmentFilteredListUserSerializer
+        exclude = ["barbershop"]
         
 
 class AppointmentsUpdateSerializer(serializers.ModelSerializer):
     user = UserListSerializer(read_only=True)
     class Meta:
         model = Appointment
-        fields = "__all__"
+        exclude = ["barbershop"]
+
+    def update(self, instance, validated_data):
+        with transaction.atomic():
+            appointment = super().update(instance, validated_data)
+            if "date" in validated_data or "time" in validated_data:
+                reschedule_appointment(appointment)
+        return appointment
 
 
-class AppointmentsSerializer(serializers.ModelSerializer):
+class AppointmentsSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     user = UserListSerializer(read_only=True)
     class Meta:
         model = Appointment
-        fields = "__all__"
+        exclude = ["barbershop"]
 
     def validate(self, data):
         user =  self.context['request'].user
         barbershop =  self.context['barbershop']
         if Appointment.objects.filter(
-            Q(date=data["date"], appointments=barbershop, user=user) |
-            Q(date=data["date"], time__range=(data["time"], (datetime.datetime.combine(datetime.date(1,1,1), data["time"]) + datetime.timedelta(minutes=59)).strftime("%H:%M:%S")), appointments=barbershop) |
-            Q(date=data["date"], time__range=((datetime.datetime.combine(datetime.date(1,1,1), data["time"]) - datetime.timedelta(minutes=59)).strftime("%H:%M:%S"), data["time"]), appointments=barbershop)
+            Q(date=data["date"], barbershop=barbershop, user=user) |
+            Q(date=data["date"], time__range=(data["time"], (datetime.datetime.combine(datetime.date(1,1,1), data["time"]) + datetime.timedelta(minutes=59)).strftime("%H:%M:%S")), barbershop=barbershop) |
+            Q(date=data["date"], time__range=((datetime.datetime.combine(datetime.date(1,1,1), data["time"]) - datetime.timedelta(minutes=59)).strftime("%H:%M:%S"), data["time"]), barbershop=barbershop)
         ).exists():
             raise serializers.ValidationError("There is an existing appointment")
         return data
@@ -160,6 +281,29 @@ class MessagesUserSerializer(serializers.ModelSerializer):
         ]
 
 
+class MessagesReadSerializer(serializers.Serializer):
+    user = serializers.IntegerField()
+    origin = serializers.CharField(max_length=5, help_text="Origin of the reader; messages from other origins are marked read")
+
+
+class MessagesReadResultSerializer(serializers.Serializer):
+    read = serializers.IntegerField()
+
+
+class InboxQuerySerializer(serializers.Serializer):
+    origin = serializers.CharField(max_length=5, help_text="Origin of the reader; unread counts messages from other origins")
+
+
+class InboxSerializer(serializers.Serializer):
+    user = serializers.IntegerField()
+    username = serializers.CharField(source="user__username")
+    name = serializers.CharField()
+    last_message = serializers.CharField()
+    last_origin = serializers.CharField()
+    last_created = serializers.DateTimeField()
+    unread = serializers.IntegerField()
+
+
 class MessagesCreateSerializer(serializers.ModelSerializer):
     user = serializers.IntegerField()
     class Meta:
@@ -173,6 +317,7 @@ class MessagesCreateSerializer(serializers.ModelSerializer):
     def create(self, data):
         user = User.objects.get(pk=data["user"])
         instance = Message.objects.create(
+            barbershop=data.get("barbershop"),
             user=user,
             text=data["text"],
             origin=data["origin"]
@@ -181,14 +326,15 @@ class MessagesCreateSerializer(serializers.ModelSerializer):
         return instance
 
 
-class MessagesListSerializer(serializers.ModelSerializer):
+class MessagesListSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     user = UserListSerializer(read_only=True)
     class Meta:
         model = Message
-        fields = "__all__"
+        exclude = ["barbershop"]
 
 
-class BarbershopSerializer(serializers.ModelSerializer):
+class BarbershopSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    photo_variants = ImageVariantsField()
     amenities = AmenitiesSerializer(many=True)
     services = ServicesSerializer(many=True)
     hours = OperationHoursSerializer(many=True)
@@ -196,10 +342,23 @@ class BarbershopSerializer(serializers.ModelSerializer):
     favorites = UserListSerializer(many=True)
     appointments = AppointmentsSerializer(many=True)
     messages = MessagesListSerializer(many=True)
+    rating_histogram = serializers.SerializerMethodField()
 
     class Meta:
         model = Barbershop
-        fields = "__all__"
+        exclude = BARBERSHOP_INTERNAL_FIELDS
+        expandable_fields = [
+            "amenities",
+            "services",
+            "hours",
+            "comments",
+            "favorites",
+            "appointments",
+            "messages"
+        ]
+
+    def get_rating_histogram(self, obj) -> dict:
+        return {str(stars): getattr(obj, "rating_count_{}".format(stars)) for stars in range(1, 6)}
 
 
 class BarbershopProfileSerializer(serializers.ModelSerializer):
@@ -233,7 +392,8 @@ class BarbershopCreateSerializer(serializers.ModelSerializer):
         ]
 
 
-class BarbershopListSerializer(serializers.ModelSerializer):
+class BarbershopListSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    photo_variants = ImageVariantsField()
     amenities = AmenitiesSerializer(many=True)
     services = ServicesSerializer(many=True)
     hours = OperationHoursSerializer(many=True)
@@ -244,21 +404,145 @@ class BarbershopListSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Barbershop
-        fields = "__all__"
+        exclude = BARBERSHOP_INTERNAL_FIELDS
+        expandable_fields = [
+            "amenities",
+            "services",
+            "hours",
+            "comments",
+            "favorites",
+            "appointments",
+            "messages"
+        ]
         
  
-class BarbershopListUserSerializer(serializers.ModelSerializer):
+class BarbershopListUserSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    photo_variants = ImageVariantsField()
     amenities = AmenitiesSerializer(many=True)
     services = ServicesSerializer(many=True)
     hours = OperationHoursSerializer(many=True)
     comments = CommentsSerializer(many=True)
     favorites = UserListSerializer(many=True)
+    # Only the user's, the view prefetches them filtered
     appointments = AppointmentsFilteredSerializer(many=True)
     messages = MessagesListSerializer(many=True)
 
     class Meta:
         model = Barbershop
-        fields = "__all__"
+        exclude = BARBERSHOP_INTERNAL_FIELDS
+        expandable_fields = [
+            "amenities",
+            "services",
+            "hours",
+            "comments",
+            "favorites",
+            "messages"
+        ]
+
+
+class BarbershopNearbySerializer(BarbershopListSerializer):
+    distance = serializers.FloatField(read_only=True)
+
+    class Meta(BarbershopListSerializer.Meta):
+        pass
+
+
+class NearbyQuerySerializer(serializers.Serializer):
+    latitude = serializers.FloatField(min_value=-90, max_value=90)
+    longitude = serializers.FloatField(min_value=-180, max_value=180)
+    radius = serializers.FloatField(min_value=0.1, max_value=50, default=5, help_text="Search radius in km")
+    limit = serializers.IntegerField(min_value=1, max_value=100, default=20)
+
+
+class BarbershopSearchSerializer(BarbershopListSerializer):
+    rank = serializers.FloatField(read_only=True)
+
+    class Meta(BarbershopListSerializer.Meta):
+        pass
+
+
+class SearchQuerySerializer(serializers.Serializer):
+    q = serializers.CharField(max_length=255)
+
+
+class LeaderboardQuerySerializer(serializers.Serializer):
+    city = serializers.CharField(max_length=255, required=False, allow_blank=True, default="", help_text="Rank within a city")
+
+
+class AvailabilityQuerySerializer(serializers.Serializer):
+    start = serializers.DateField(required=False)
+    end = serializers.DateField(required=False)
+
+    def validate(self, data):
+        start = data.get("start") or timezone.localdate()
+        end = data.get("end") or start + datetime.timedelta(days=6)
+        if end < start:
+            raise serializers.ValidationError("end must not be before start")
+        if (end - start).days >= AVAILABILITY_MAX_DAYS:
+            raise serializers.ValidationError("The range cannot exceed {} days".format(AVAILABILITY_MAX_DAYS))
+        return {"start": start, "end": end}
+
+
+class AvailabilitySerializer(serializers.Serializer):
+    date = serializers.DateField()
+    slots = serializers.ListField(child=serializers.TimeField(format="%H:%M"))
+
+
+class MapClusterSerializer(serializers.ModelSerializer):
+    latitude = serializers.FloatField(read_only=True)
+    longitude = serializers.FloatField(read_only=True)
+    rating = serializers.FloatField(read_only=True)
+
+    class Meta:
+        model = MapCluster
+        fields = [
+            "count",
+            "latitude",
+            "longitude",
+            "rating"
+        ]
+
+
+class ClusterQuerySerializer(serializers.Serializer):
+    south = serializers.FloatField(min_value=-90, max_value=90)
+    west = serializers.FloatField(min_value=-180, max_value=180)
+    north = serializers.FloatField(min_value=-90, max_value=90)
+    east = serializers.FloatField(min_value=-180, max_value=180)
+    zoom = serializers.IntegerField(min_value=0, max_value=22)
+
+    def validate(self, data):
+        if data["south"] > data["north"] or data["west"] > data["east"]:
+            raise serializers.ValidationError("Invalid bounding box")
+        return data
+
+
+def get_or_create_rows(model, fields, items):
+    """
+    Returns the rows of ``model`` matching ``items`` on ``fields``, in order
+    and without repeats, inserting the missing ones. Costs one lookup, or
+    two lookups and a bulk insert when rows are missing; a row created
+    concurrently is picked up by the second lookup.
+    """
+    keys = list(dict.fromkeys(tuple(item[field] for field in fields) for item in items))
+    if not keys:
+        return []
+
+    def lookup():
+        queryset = model.objects.filter(**{
+            "{}__in".format(field): {key[index] for key in keys} for index, field in enumerate(fields)
+        })
+        rows = {}
+        # The oldest row wins where the table holds duplicates
+        for row in queryset.order_by("-pk"):
+            rows[tuple(getattr(row, field) for field in fields)] = row
+        return rows
+
+    rows = lookup()
+    missing = [model(**dict(zip(fields, key))) for key in keys if key not in rows]
+    if missing:
+        model.objects.bulk_create(missing, ignore_conflicts=True)
+        rows = lookup()
+    return [rows[key] for key in keys if key in rows]
 
 
 class BarbershopUpdateSerializer(serializers.ModelSerializer):
@@ -270,7 +554,7 @@ class BarbershopUpdateSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Barbershop
-        fields = "__all__"
+        exclude = BARBERSHOP_INTERNAL_FIELDS
 
     def save(self):
         self.instance.name = self.validated_data.get("name", self.instance.name)
@@ -285,68 +569,63 @@ class BarbershopUpdateSerializer(serializers.ModelSerializer):
         self.instance.latitude = self.validated_data.get("latitude", self.instance.latitude)
         self.instance.longitude = self.validated_data.get("longitude", self.instance.longitude)
         self.instance.verified = self.validated_data.get("verified", self.instance.verified)
-        amenities_data = self.validated_data.get('amenities')
-        services_data = self.validated_data.get('services')
-        hours_data = self.validated_data.get('hours')
-        comments_data = self.validated_data.get('comments')
-        if amenities_data:
-            for amenities_item in amenities_data:
-                if amenities_item.get("name"):
-                    if Amenities.objects.filter(name=amenities_item.get("name")).exists():
-                        amenity = Amenities.objects.get(name=amenities_item.get("name"))
-                    else:
-                        amenity = Amenities.objects.create(**amenities_item)
-                    self.instance.amenities.add(amenity)
-        if services_data:
-            for services_item in services_data:
-                if services_item.get("name") and services_item.get("price"):
-                    if Services.objects.filter(name=services_item.get("name"), price=services_item.get("price")).exists():
-                        service = Services.objects.get(name=services_item.get("name"), price=services_item.get("price"))
-                    else:
-                        service = Services.objects.create(**services_item)
-                    self.instance.services.add(service)
-        if hours_data:
-            for hours_item in hours_data:
-                if hours_item.get("day") and hours_item.get("opening_time") and hours_item.get("closing_time"):
-                    if OperationHours.objects.filter(day=hours_item.get("day"), opening_time=hours_item.get("opening_time"), closing_time=hours_item.get("closing_time")).exists():
-                        hour = OperationHours.objects.get(day=hours_item.get("day"), opening_time=hours_item.get("opening_time"), closing_time=hours_item.get("closing_time"))
-                    else:
-                        hour = OperationHours.objects.create(**hours_item)
-                    self.instance.hours.add(hour)
-        if comments_data: 
-            for comments_item in comments_data:
-                if comments_item.get("text") and comments_item.get("rating") and comments_item.get("type"):
-                    user =  self.context['request'].user
-                    if Comments.objects.filter(text=comments_item.get("text"), rating=comments_item.get("rating"), type=comments_item.get("type"), user=user).exists():
-                        comment = Comments.objects.get(text=comments_item.get("text"), rating=comments_item.get("rating"), type=comments_item.get("type"), user=user)
-                    else:
-                        comment = Comments.objects.create(
-                            text=comments_item.get("text"), 
-                            rating=comments_item.get("rating"), 
-                            type=comments_item.get("type"),
-                            user=user
-                        )
-                    self.instance.comments.add(comment)
-
-                    comments = self.instance.comments.all()
-
-                    tally = 0
-                    count = 1
-                    for comment in comments:
-                        tally += comment.rating
-                        count += 1
-                    self.instance.rating = round(tally / count, 2)
-        self.instance.save()
+        amenities_data = self.validated_data.get('amenities') or []
+        services_data = self.validated_data.get('services') or []
+        hours_data = self.validated_data.get('hours') or []
+        comments_data = self.validated_data.get('comments') or []
+        user = self.context['request'].user
+        # The relations are reindexed, bumped and re-ranked once, by the save
+        with transaction.atomic(), batched_relations(self.instance):
+            amenities = get_or_create_rows(Amenities, ["name"], [
+                item for item in amenities_data if item.get("name")
+            ])
+            services = get_or_create_rows(Services, ["name", "price"], [
+                item for item in services_data if item.get("name") and item.get("price")
+            ])
+            hours = get_or_create_rows(OperationHours, ["day", "opening_time", "closing_time"], [
+                item for item in hours_data if item.get("day") and item.get("opening_time") and item.get("closing_time")
+            ])
+            comments = get_or_create_rows(Comments, ["text", "rating", "type", "user_id"], [
+                dict(item, user_id=user.pk) for item in comments_data
+                if item.get("text") and item.get("rating") and item.get("type") and user.is_authenticated
+            ])
+            if amenities:
+                self.instance.amenities.add(*amenities)
+            if services:
+                self.instance.services.add(*services)
+            if hours:
+                self.instance.hours.add(*hours)
+            if comments:
+                # Updates the rating aggregate, see api.signals
+                self.instance.comments.add(*comments)
+            self.instance.save(update_fields=[
+                "name",
+                "description",
+                "address",
+                "postal_code",
+                "street",
+                "barangay",
+                "city",
+                "contact_number",
+                "photo",
+                "latitude",
+                "longitude",
+                "verified"
+            ])
         return self.instance
 
 
-class ProfileSerializer(serializers.ModelSerializer):
+class ProfileSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     user =  UserListSerializer()
+    photo_variants = ImageVariantsField()
     barbershop = BarbershopSerializer(many=True)
 
     class Meta:
         model = Profile
         fields = "__all__"
+        expandable_fields = [
+            "barbershop"
+        ]
 
 
 class ProfileCreateSerializer(serializers.ModelSerializer):
@@ -364,10 +643,8 @@ class ProfileCreateSerializer(serializers.ModelSerializer):
         ]
 
     def create(self, validated_data):
-        users_data = validated_data.pop('user')
-        users = UserCreateSerializer(data=users_data)
-        users.is_valid(raise_exception=True)
-        user = users.save()
+        # Validated along with the profile already
+        user = UserCreateSerializer().create(validated_data.pop('user'))
         instance = Profile.objects.create(
             user=user,
             contact_number=validated_data.get("contact_number", None),
@@ -378,13 +655,17 @@ class ProfileCreateSerializer(serializers.ModelSerializer):
         return instance
 
 
-class ProfileListSerializer(serializers.ModelSerializer):
+class ProfileListSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     user =  UserListSerializer()
+    photo_variants = ImageVariantsField()
     barbershop = BarbershopListSerializer(many=True)
 
     class Meta:
         model = Profile
         fields = "__all__"
+        expandable_fields = [
+            "barbershop"
+        ]
 
 
 class ProfileUpdateSerializer(serializers.ModelSerializer):
@@ -420,3 +701,50 @@ class ProfileUpdateSerializer(serializers.ModelSerializer):
             user.save()
         self.instance.save()
         return self.instance
+
+
+class SyncQuerySerializer(serializers.Serializer):
+    appointments = serializers.DateTimeField(required=False, help_text="Appointments cursor of the previous sync")
+    messages = serializers.DateTimeField(required=False, help_text="Messages cursor of the previous sync")
+    favorites = serializers.DateTimeField(required=False, help_text="Favorites cursor of the previous sync")
+
+
+class SyncAppointmentSerializer(AppointmentsSerializer):
+    class Meta(AppointmentsSerializer.Meta):
+        exclude = None
+        fields = "__all__"
+
+
+class SyncMessageSerializer(MessagesListSerializer):
+    class Meta(MessagesListSerializer.Meta):
+        exclude = None
+        fields = "__all__"
+
+
+class SyncCollectionSerializer(serializers.Serializer):
+    """
+    Clients apply ``deleted`` before ``changed``, or replace the collection
+    with ``changed`` when ``reset`` is set, and send ``cursor`` next time.
+    """
+    deleted = serializers.ListField(child=serializers.IntegerField())
+    reset = serializers.BooleanField()
+    cursor = serializers.DateTimeField()
+
+
+class SyncAppointmentsSerializer(SyncCollectionSerializer):
+    changed = SyncAppointmentSerializer(many=True)
+
+
+class SyncMessagesSerializer(SyncCollectionSerializer):
+    changed = SyncMessageSerializer(many=True)
+
+
+class SyncFavoritesSerializer(SyncCollectionSerializer):
+    changed = BarbershopListSerializer(many=True, expand="")
+    deleted = serializers.ListField(child=serializers.IntegerField(), help_text="Ids of the unfavorited barbershops")
+
+
+class SyncSerializer(serializers.Serializer):
+    appointments = SyncAppointmentsSerializer()
+    messages = SyncMessagesSerializer()
+    favorites = SyncFavoritesSerializer()
@@ -0,0 +1,296 @@
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+from . import authentication, batching, clusters, leaderboard, ratings, realtime, search, sync, uploads, versions
+from .availability import invalidate_availability
+from .models import Amenities, Appointment, Barbershop, Comments, Favorite, Message, OperationHours, Profile, Services, Tombstone
+
+
+@receiver(pre_save, sender=Barbershop)
+def load_previous_state(sender, instance, raw, **kwargs):
+    if raw or instance.pk is None or (hasattr(instance, "_cluster_state") and hasattr(instance, "_leaderboard_state")):
+        return
+    previous = Barbershop.objects.only("latitude", "longitude", "rating", "verified", "city").filter(pk=instance.pk).first()
+    if not hasattr(instance, "_cluster_state"):
+        instance._cluster_state = previous.get_cluster_state() if previous else None
+    if not hasattr(instance, "_leaderboard_state"):
+        instance._leaderboard_state = previous.get_leaderboard_state() if previous else None
+
+
+@receiver(post_save, sender=Barbershop)
+def update_barbershop_clusters(sender, instance, raw, **kwargs):
+    if raw:
+        return
+    current = instance.get_cluster_state()
+    clusters.update_clusters(getattr(instance, "_cluster_state", None), current)
+    instance._cluster_state = current
+
+
+@receiver(post_delete, sender=Barbershop)
+def remove_barbershop_clusters(sender, instance, **kwargs):
+    clusters.update_clusters(getattr(instance, "_cluster_state", instance.get_cluster_state()), None)
+
+
+@receiver(post_save, sender=Barbershop)
+def update_barbershop_leaderboard(sender, instance, raw, **kwargs):
+    if raw:
+        return
+    previous = getattr(instance, "_leaderboard_state", None)
+    current = instance.get_leaderboard_state()
+    if previous != current:
+        leaderboard.barbershop_changed(instance, previous[0] if previous else None)
+    instance._leaderboard_state = current
+
+
+@receiver(post_delete, sender=Barbershop)
+def remove_barbershop_leaderboard(sender, instance, **kwargs):
+    leaderboard.barbershop_changed(instance)
+
+
+@receiver(post_save, sender=Barbershop)
+def index_barbershop(sender, instance, raw, update_fields, **kwargs):
+    if not raw and (update_fields is None or search.INDEXED_FIELDS & set(update_fields)):
+        search.index_barbershop(instance)
+
+
+@receiver(post_delete, sender=Barbershop)
+def unindex_barbershop(sender, instance, **kwargs):
+    search.remove_barbershop(instance.pk)
+
+
+@receiver(m2m_changed, sender=Barbershop.amenities.through)
+@receiver(m2m_changed, sender=Barbershop.services.through)
+def index_barbershop_relations(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    if not reverse and batching.is_batched(instance.pk):
+        return
+    if not reverse:
+        search.index_barbershop(instance)
+    elif pk_set:
+        for barbershop in Barbershop.objects.filter(pk__in=pk_set):
+            search.index_barbershop(barbershop)
+
+
+@receiver(post_save, sender=Amenities)
+def index_amenity_barbershops(sender, instance, created, raw, **kwargs):
+    if not raw and not created:
+        for barbershop in instance.amenities.all():
+            search.index_barbershop(barbershop)
+
+
+@receiver(post_save, sender=Services)
+def index_service_barbershops(sender, instance, created, raw, **kwargs):
+    if not raw and not created:
+        for barbershop in instance.services.all():
+            search.index_barbershop(barbershop)
+
+
+@receiver(m2m_changed, sender=Barbershop.comments.through)
+def update_barbershop_rating(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == "pre_clear" and not reverse:
+        ratings.change_ratings(instance.pk, instance.comments.values_list("rating", flat=True), -1)
+    elif action == "pre_clear":
+        for barbershop_id in instance.comments.values_list("pk", flat=True):
+            ratings.change_ratings(barbershop_id, [instance.rating], -1)
+    elif action in ("post_add", "pre_remove") and pk_set:
+        # post_add only lists the rows actually added, pre_remove every pk
+        # passed to remove(), linked or not
+        sign = 1 if action == "post_add" else -1
+        if not reverse:
+            comments = Comments.objects.filter(pk__in=pk_set)
+            if action == "pre_remove":
+                comments = instance.comments.filter(pk__in=pk_set)
+            ratings.change_ratings(instance.pk, comments.values_list("rating", flat=True), sign)
+        else:
+            barbershop_ids = pk_set
+            if action == "pre_remove":
+                barbershop_ids = instance.comments.filter(pk__in=pk_set).values_list("pk", flat=True)
+            for barbershop_id in barbershop_ids:
+                ratings.change_ratings(barbershop_id, [instance.rating], sign)
+    else:
+        return
+    if not reverse:
+        # Keep the in-memory shop in step so a later save() neither writes
+        # back stale totals nor counts the rating change in the clusters
+        # twice. The states keep the other values as stored, the instance
+        # may hold changes not saved yet.
+        instance.refresh_from_db(fields=["rating", "rating_sum", "rating_count"] + ratings.RATING_HISTOGRAM_FIELDS)
+        previous = getattr(instance, "_cluster_state", None)
+        if previous is not None:
+            instance._cluster_state = previous[:2] + (instance.rating,)
+        previous = getattr(instance, "_leaderboard_state", None)
+        # A batched shop was not re-ranked, its save() does that
+        if previous is not None and not batching.is_batched(instance.pk):
+            instance._leaderboard_state = (previous[0], instance.rating, previous[2])
+
+
+@receiver(pre_save, sender=Comments)
+def update_edited_comment_rating(sender, instance, raw, **kwargs):
+    if raw or instance.pk is None:
+        return
+    previous = Comments.objects.filter(pk=instance.pk).values_list("rating", flat=True).first()
+    if previous is None or previous == instance.rating:
+        return
+    for barbershop_id in instance.comments.values_list("pk", flat=True):
+        ratings.change_ratings(barbershop_id, [previous], -1)
+        ratings.change_ratings(barbershop_id, [instance.rating], 1)
+
+
+@receiver(pre_delete, sender=Comments)
+def remove_deleted_comment_rating(sender, instance, **kwargs):
+    for barbershop_id in instance.comments.values_list("pk", flat=True):
+        ratings.change_ratings(barbershop_id, [instance.rating], -1)
+
+
+@receiver(m2m_changed, sender=Barbershop.hours.through)
+def invalidate_hours_link_availability(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ("post_add", "post_remove", "pre_clear"):
+        return
+    if not reverse:
+        invalidate_availability(instance.pk)
+        return
+    barbershop_ids = pk_set
+    if action == "pre_clear":
+        barbershop_ids = sender.objects.filter(operationhours=instance).values_list("barbershop_id", flat=True)
+    for barbershop_id in barbershop_ids:
+        invalidate_availability(barbershop_id)
+
+
+@receiver(post_save, sender=Appointment)
+@receiver(pre_delete, sender=Appointment)
+def invalidate_appointment_availability(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    if instance.barbershop_id is not None:
+        invalidate_availability(instance.barbershop_id)
+
+
+@receiver(post_save, sender=OperationHours)
+@receiver(pre_delete, sender=OperationHours)
+def invalidate_hours_availability(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    for barbershop_id in instance.hours.values_list("pk", flat=True):
+        invalidate_availability(barbershop_id)
+
+
+@receiver(post_save, sender=Message)
+def publish_created_message(sender, instance, created, raw, **kwargs):
+    if created and not raw:
+        transaction.on_commit(lambda: realtime.message_created(instance))
+
+
+@receiver(post_save, sender=Appointment)
+def publish_changed_appointment(sender, instance, created, raw, **kwargs):
+    if not raw:
+        transaction.on_commit(lambda: realtime.appointment_changed(instance, created))
+
+
+@receiver(post_delete, sender=Appointment)
+def publish_deleted_appointment(sender, instance, **kwargs):
+    # The primary key is cleared once the deletion completes
+    appointment_id, user_id, barbershop_id = instance.pk, instance.user_id, instance.barbershop_id
+    transaction.on_commit(lambda: realtime.appointment_deleted(appointment_id, user_id, barbershop_id))
+
+
+@receiver(post_delete, sender=Appointment)
+def record_deleted_appointment(sender, instance, **kwargs):
+    sync.record_deletion(Tombstone.APPOINTMENT, instance.pk, instance.user_id)
+
+
+@receiver(post_delete, sender=Message)
+def record_deleted_message(sender, instance, **kwargs):
+    sync.record_deletion(Tombstone.MESSAGE, instance.pk, instance.user_id)
+
+
+@receiver(post_delete, sender=Favorite)
+def record_deleted_favorite(sender, instance, **kwargs):
+    # Removing a favorite deletes the through row, the client knows it by shop
+    sync.record_deletion(Tombstone.FAVORITE, instance.barbershop_id, instance.user_id)
+
+
+def _relation_name(through):
+    return next(field.name for field in Barbershop._meta.many_to_many if field.remote_field.through is through)
+
+
+@receiver(m2m_changed, sender=Barbershop.amenities.through)
+@receiver(m2m_changed, sender=Barbershop.services.through)
+@receiver(m2m_changed, sender=Barbershop.hours.through)
+@receiver(m2m_changed, sender=Barbershop.comments.through)
+@receiver(m2m_changed, sender=Barbershop.favorites.through)
+def bump_barbershop_relations(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ("post_add", "post_remove", "pre_clear"):
+        return
+    if not reverse and batching.is_batched(instance.pk):
+        return
+    if not reverse:
+        versions.bump_versions([instance.pk])
+    elif action == "pre_clear":
+        versions.bump_versions(Barbershop.objects.filter(**{_relation_name(sender): instance}).values("pk"))
+    else:
+        versions.bump_versions(list(pk_set))
+
+
+@receiver(post_save, sender=Amenities)
+@receiver(pre_delete, sender=Amenities)
+@receiver(post_save, sender=Services)
+@receiver(pre_delete, sender=Services)
+@receiver(post_save, sender=OperationHours)
+@receiver(pre_delete, sender=OperationHours)
+@receiver(post_save, sender=Comments)
+@receiver(pre_delete, sender=Comments)
+def bump_related_barbershops(sender, instance, raw=False, created=False, **kwargs):
+    if raw or created:
+        return
+    accessor = next(
+        field.remote_field.related_name for field in Barbershop._meta.many_to_many if field.related_model is sender
+    )
+    versions.bump_versions(getattr(instance, accessor).values("pk"))
+
+
+@receiver(post_save, sender=Appointment)
+@receiver(post_delete, sender=Appointment)
+@receiver(post_save, sender=Message)
+@receiver(post_delete, sender=Message)
+def bump_owning_barbershop(sender, instance, raw=False, **kwargs):
+    if not raw:
+        versions.bump_versions([instance.barbershop_id])
+
+
+@receiver(post_save, sender=User)
+def bump_user_barbershops(sender, instance, created, raw, update_fields, **kwargs):
+    # Shop details embed the names of the users who favorited, reviewed,
+    # booked or messaged it
+    if raw or created or (update_fields is not None and set(update_fields) <= {"last_login", "password"}):
+        return
+    versions.bump_versions(Barbershop.objects.filter(
+        Q(favorites=instance) | Q(comments__user=instance) | Q(appointments__user=instance) | Q(messages__user=instance)
+    ).values("pk"))
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def forget_authenticated_user(sender, instance, **kwargs):
+    authentication.forget_user(instance.pk)
+
+
+@receiver(post_save, sender=Profile)
+@receiver(post_delete, sender=Profile)
+def forget_profile_user(sender, instance, **kwargs):
+    authentication.forget_user(instance.user_id)
+
+
+@receiver(post_save, sender=Barbershop)
+@receiver(post_save, sender=Profile)
+def queue_media_uploads(sender, instance, raw, **kwargs):
+    if not raw:
+        uploads.queue_uploads(instance)
+
+
+@receiver(uploads.upload_finished, sender=Barbershop)
+def bump_uploaded_barbershop(sender, object_id, **kwargs):
+    # The field was repointed with an update(), which skips Barbershop.save
+    versions.bump_versions([object_id])
@@ -0,0 +1,226 @@
+import hashlib
+import mimetypes
+import mmap
+import os
+import posixpath
+import re
+import tempfile
+import threading
+import uuid
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage, Storage
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.http import Http404, StreamingHttpResponse
+from django.urls import reverse
+from django.utils.deconstruct import deconstructible
+from django.utils.module_loading import import_string
+
+PENDING_PREFIX = "pending/"
+# Content addressed names: the SHA-256 of the file and its extension
+CONTENT_NAME = re.compile(r"^[0-9a-f]{64}(\.[0-9a-z]{1,10})?$")
+STORED_CACHE_CONTROL = "public, max-age=31536000, immutable"
+SERVE_CHUNK_SIZE = 256 * 1024
+
+_remote_lock = threading.Lock()
+
+
+@deconstructible
+class QueuedStorage(Storage):
+    """
+    Saves files to a local staging area and leaves copying them to
+    ``remote``, the MEDIA_STORAGE backend unless given, to a background
+    worker, see api.uploads.
+
+    Until then a file's name starts with PENDING_PREFIX and it is read from
+    and served out of the staging area; the worker points the model at the
+    remote name once the upload is done.
+    """
+    def __init__(self, remote=None):
+        self._remote = remote
+
+    @property
+    def remote(self):
+        # Set up on first use from MEDIA_STORAGE, so importing the models
+        # never builds a storage client
+        if self._remote is None:
+            with _remote_lock:
+                if self._remote is None:
+                    self._remote = import_string(settings.MEDIA_STORAGE)()
+        return self._remote
+
+    @remote.setter
+    def remote(self, storage):
+        self._remote = storage
+
+    @property
+    def local(self):
+        return FileSystemStorage(location=settings.MEDIA_STAGING_ROOT)
+
+    def is_pending(self, name):
+        return name.startswith(PENDING_PREFIX)
+
+    def staged_name(self, name):
+        return name[len(PENDING_PREFIX):]
+
+    def _resolve(self, name):
+        if self.is_pending(name):
+            return self.local, self.staged_name(name)
+        return self.remote, name
+
+    def get_available_name(self, name, max_length=None):
+        # A random name, staged files are served to anyone who has the URL
+        directory, filename = posixpath.split(name.replace("\\", "/"))
+        return posixpath.join(PENDING_PREFIX + directory, uuid.uuid4().hex + posixpath.splitext(filename)[1].lower())
+
+    def _save(self, name, content):
+        return PENDING_PREFIX + self.local.save(self.staged_name(name), content)
+
+    def _open(self, name, mode="rb"):
+        storage, name = self._resolve(name)
+        return storage.open(name, mode)
+
+    def delete(self, name):
+        storage, name = self._resolve(name)
+        storage.delete(name)
+
+    def exists(self, name):
+        storage, name = self._resolve(name)
+        return storage.exists(name)
+
+    def size(self, name):
+        storage, name = self._resolve(name)
+        return storage.size(name)
+
+    def url(self, name):
+        if self.is_pending(name):
+            return reverse("pending-media", args=[self.staged_name(name)])
+        return self.remote.url(name)
+
+
+@deconstructible
+class ContentAddressedStorage(Storage):
+    """
+    Local storage naming files by the SHA-256 of their content, so a file
+    saved any number of times is kept once.
+
+    Files live in ``<location>/ab/cd/<hash><ext>``; the directory a file was
+    saved under only survives in its name, "banners/<hash>.png", and names
+    from different directories with the same content share the file. Files
+    are never deleted through the storage for that reason.
+    """
+    def __init__(self, location=None):
+        self._location = location
+
+    @property
+    def location(self):
+        return os.path.abspath(str(self._location or settings.MEDIA_ROOT))
+
+    def path(self, name):
+        filename = posixpath.basename(name)
+        if not CONTENT_NAME.match(filename):
+            raise SuspiciousFileOperation("{} is not a content addressed name".format(name))
+        return os.path.join(self.location, filename[:2], filename[2:4], filename)
+
+    def get_available_name(self, name, max_length=None):
+        # Picked from the content by _save
+        return name
+
+    def _save(self, name, content):
+        directory, filename = posixpath.split(name.replace("\\", "/"))
+        extension = posixpath.splitext(filename)[1].lower()
+        os.makedirs(self.location, exist_ok=True)
+        descriptor, temporary = tempfile.mkstemp(dir=self.location, prefix=".upload-")
+        try:
+            digest = hashlib.sha256()
+            with os.fdopen(descriptor, "wb") as file:
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    file.write(chunk)
+            name = digest.hexdigest() + extension
+            if not CONTENT_NAME.match(name):
+                name = digest.hexdigest()
+            path = self.path(name)
+            if os.path.exists(path):
+                os.remove(temporary)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                if settings.FILE_UPLOAD_PERMISSIONS is not None:
+                    os.chmod(temporary, settings.FILE_UPLOAD_PERMISSIONS)
+                os.replace(temporary, path)
+        except BaseException:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            raise
+        return posixpath.join(directory, name)
+
+    def _open(self, name, mode="rb"):
+        return File(open(self.path(name), mode))
+
+    def delete(self, name):
+        pass
+
+    def exists(self, name):
+        try:
+            return os.path.exists(self.path(name))
+        except SuspiciousFileOperation:
+            return False
+
+    def size(self, name):
+        return os.path.getsize(self.path(name))
+
+    def url(self, name):
+        return reverse("stored-media", args=[name])
+
+
+def get_media_storage():
+    """
+    The storage of uploaded photos and documents, passed to the model fields
+    as a callable so migrations reference it instead of a backend.
+    """
+    return media_storage
+
+
+media_storage = QueuedStorage()
+
+
+@receiver(setting_changed)
+def reset_media_storage(setting, **kwargs):
+    if setting in ("MEDIA_STORAGE", "MEDIA_ROOT"):
+        media_storage.remote = None
+
+
+def mapped_chunks(mapping):
+    try:
+        for offset in range(0, len(mapping), SERVE_CHUNK_SIZE):
+            yield mapping[offset:offset + SERVE_CHUNK_SIZE]
+    finally:
+        mapping.close()
+
+
+def stored_media(request, name):
+    """
+    Serves a file of the content addressed storage straight from a memory
+    map of it.
+    """
+    storage = media_storage.remote
+    if not isinstance(storage, ContentAddressedStorage):
+        raise Http404
+    try:
+        path = storage.path(name)
+        with open(path, "rb") as file:
+            size = os.fstat(file.fileno()).st_size
+            # The map outlives the file, it holds a descriptor of its own
+            mapping = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+    except (SuspiciousFileOperation, FileNotFoundError):
+        raise Http404
+    response = StreamingHttpResponse(
+        mapped_chunks(mapping) if mapping else iter(()),
+        content_type=mimetypes.guess_type(path)[0] or "application/octet-stream"
+    )
+    response["Content-Length"] = size
+    response["Cache-Control"] = STORED_CACHE_CONTROL
+    response["ETag"] = '"{}"'.format(posixpath.splitext(posixpath.basename(path))[0])
+    return response
@@ -0,0 +1,41 @@
+import datetime
+from django.utils import timezone
+from .models import Tombstone
+
+# Cursors are handed out this far in the past so rows written by a
+# transaction that commits after the sync query are picked up next time;
+# clients upsert by id, so the overlap only costs a few repeated rows.
+SYNC_OVERLAP = datetime.timedelta(seconds=30)
+# Tombstones are kept this long; older cursors get a full collection back.
+TOMBSTONE_RETENTION = datetime.timedelta(days=30)
+
+
+def sync_cursor():
+    return timezone.now() - SYNC_OVERLAP
+
+
+def collection_changes(queryset, timestamp_field, collection, user, since):
+    """
+    Returns ``(changed, deleted, reset)`` for one synced collection.
+
+    ``changed`` is ``queryset`` narrowed to rows whose ``timestamp_field`` is
+    at or after ``since`` and ``deleted`` the ids of the user's rows deleted
+    since then. Without a cursor, or with one older than the tombstones, the
+    whole collection is returned with ``reset`` set and the client should
+    replace what it has.
+    """
+    if since is None or since < timezone.now() - TOMBSTONE_RETENTION:
+        return queryset, [], True
+    changed = queryset.filter(**{timestamp_field + "__gte": since})
+    deleted = Tombstone.objects.filter(
+        user=user, collection=collection, deleted_at__gte=since
+    ).values_list("object_id", flat=True).distinct()
+    return changed, list(deleted), False
+
+
+def record_deletion(collection, object_id, user_id):
+    Tombstone.objects.create(collection=collection, object_id=object_id, user_id=user_id)
+
+
+def prune_tombstones():
+    return Tombstone.objects.filter(deleted_at__lt=timezone.now() - TOMBSTONE_RETENTION).delete()[0]
@@ -1,3 +1,1136 @@
-from django.test import TestCase
+import asyncio
+import datetime
+import io
+import json
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+from unittest import mock
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import DEFAULT_DB_ALIAS, IntegrityError, connection, connections
+from django.db.migrations.executor import MigrationExecutor
+from django.db.models import Count
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+from rest_framework.test import APIClient
+from . import authentication, leaderboard, search
+from .booking import SlotTaken
+from .hashers import is_credential_request, offload_credentials
+from .metrics import METRICS_CONTENT_TYPE, Histogram
+from .models import (
+    Appointment, AppointmentSlot, Barbershop, Comments, Favorite, LeaderboardEntry, MediaUpload, Message, OperationHours, Profile
+)
+from .prefetch import prefetch_queryset
+from .pubsub import LocalBroker, RedisBroker
+from .ratings import RATING_HISTOGRAM_FIELDS, rebuild_ratings
+from .routers import ReadYourWritesMiddleware, ReplicaRouter, primary_reads
+from .seed import seed
+from .serializers import MyTokenObtainPairSerializer, ProfileListSerializer
+from .storage import PENDING_PREFIX, media_storage
+from .uploads import process_upload
 
-# Create your tests here.
+# Query budgets of the API endpoints over seeded data. Paginated endpoints
+# are requested at a small and a large page size and must run the same,
+# bounded number of queries at both; a count that grows with the page is an
+# N+1. BENCHMARK_SCALE multiplies the seeded volumes (BENCHMARK_SCALE=10
+# seeds thousands of shops); latencies are measured by the loadtest command.
+BENCHMARK_SCALE = float(os.environ.get("BENCHMARK_SCALE", 1))
+BENCHMARK_SIZES = {
+    "barbershops": 200,
+    "users": 400,
+    "appointments": 2000,
+    "messages": 2000,
+    "comments": 1000,
+    "favorites": 1000,
+}
+PAGE_SIZES = (5, 50)
+
+
+class QueryBudgetBenchmark(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        seed(**{name: max(1, int(size * BENCHMARK_SCALE)) for name, size in BENCHMARK_SIZES.items()})
+        cls.barbershop = Barbershop.objects.filter(verified=True).annotate(
+            count=Count("comments")
+        ).order_by("-count", "pk").first()
+        cls.user = User.objects.filter(profile__account_type="user").order_by("pk").first()
+        # The shop's inbox is only open to its owners
+        cls.user.profile.barbershop.add(cls.barbershop)
+        customers = list(User.objects.filter(profile__account_type="user").exclude(pk=cls.user.pk)[:max(PAGE_SIZES)])
+
+        # Give the benchmark user and shop more rows than the largest page
+        shops = Barbershop.objects.filter(verified=True).exclude(favorites=cls.user)[:max(PAGE_SIZES)]
+        Favorite.objects.bulk_create([Favorite(barbershop=shop, user=cls.user) for shop in shops])
+        # Past the seeded appointments so no slot is taken twice
+        first_day = timezone.localdate() + datetime.timedelta(days=40)
+        Appointment.objects.bulk_create([
+            Appointment(
+                barbershop=cls.barbershop,
+                user=cls.user,
+                date=first_day + datetime.timedelta(days=index // 10),
+                time=datetime.time(8 + index % 10),
+            )
+            for index in range(max(PAGE_SIZES))
+        ])
+        Message.objects.bulk_create(
+            [Message(barbershop=cls.barbershop, user=cls.user, origin="user", text="Hello") for _ in range(max(PAGE_SIZES))]
+            + [Message(barbershop=cls.barbershop, user=customer, origin="user", text="Hello") for customer in customers]
+        )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def measure(self, method, path, data=None):
+        """
+        Requests ``path`` with cold caches and returns the response and its
+        query count.
+        """
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(self.client, method)(path, data, format="json")
+        self.assertEqual(response.status_code, 200, response.content[:500])
+        return response, len(queries)
+
+    def assertBudget(self, name, budget, path, method="get", data=None):
+        response, queries = self.measure(method, path, data)
+        self.assertLessEqual(queries, budget, "{} ran {} queries".format(name, queries))
+        return response
+
+    def assertPagedBudget(self, name, budget, path, method="get", data=None, param="page_size"):
+        counts = []
+        for page_size in PAGE_SIZES:
+            separator = "&" if "?" in path else "?"
+            response, queries = self.measure(method, "{}{}{}={}".format(path, separator, param, page_size), data)
+            rows = response.data["results"] if isinstance(response.data, dict) else response.data
+            self.assertEqual(len(rows), page_size, "{} returned a partial page".format(name))
+            counts.append(queries)
+        self.assertEqual(counts[0], counts[-1], "{} queries grow with the page size: {}".format(name, counts))
+        self.assertLessEqual(counts[-1], budget, "{} ran {} queries".format(name, counts[-1]))
+
+    def test_barbershop_list(self):
+        self.assertPagedBudget("barbershop list", 1, "/api/barbershop/")
+
+    def test_barbershop_list_expanded(self):
+        self.assertPagedBudget("barbershop list expand=*", 8, "/api/barbershop/?expand=*")
+
+    def test_barbershop_detail(self):
+        self.assertBudget("barbershop detail", 2, "/api/barbershop/{}/".format(self.barbershop.pk))
+
+    def test_favorites(self):
+        self.assertPagedBudget("favorites", 1, "/api/barbershop/favorite_user/")
+
+    def test_search(self):
+        self.assertPagedBudget("search", 3, "/api/barbershop/search/?q=barbershop")
+
+    def test_nearby(self):
+        self.assertPagedBudget(
+            "nearby", 2, "/api/barbershop/nearby/?latitude=14.58&longitude=121.03&radius=50", param="limit"
+        )
+
+    def test_profile_list(self):
+        self.assertPagedBudget("profile list", 2, "/api/profile/?expand=barbershop")
+
+    def test_appointments(self):
+        self.assertPagedBudget("shop appointments", 2, "/api/barbershop/{}/get_appointment/".format(self.barbershop.pk))
+
+    def test_messages_thread(self):
+        self.assertPagedBudget(
+            "messages thread", 3, "/api/barbershop/{}/messages_thread/".format(self.barbershop.pk),
+            method="post", data={"user": self.user.pk}
+        )
+
+    def test_inbox(self):
+        self.assertPagedBudget("inbox", 3, "/api/barbershop/{}/inbox/?origin=shop".format(self.barbershop.pk))
+
+    def test_appointment_user(self):
+        self.assertBudget("user appointments", 2, "/api/barbershop/appointment_user/")
+
+    def test_sync(self):
+        self.assertBudget("sync", 3, "/api/barbershop/sync/")
+
+    def test_availability(self):
+        self.assertBudget("availability", 3, "/api/barbershop/{}/availability/".format(self.barbershop.pk))
+
+    def test_top_rated(self):
+        self.assertBudget("top rated", 2, "/api/barbershop/top_rated/")
+
+    def test_barbershop_update(self):
+        # Submitted amenities, services, hours and reviews are written in
+        # bulk and reindexed, bumped and re-ranked once, the count must not
+        # grow with them. Of the 50
+        # queries 1 loads the shop, 12 get or create the rows, 8 link them,
+        # 8 update the rating and its clusters, 7 save, re-rank and reindex
+        # the shop, 8 render it and 6 are savepoints.
+        path = "/api/barbershop/{}/".format(self.barbershop.pk)
+        counts = []
+        for size in PAGE_SIZES:
+            data = {
+                "amenities": [{"name": "Amenity {}-{}".format(size, index)} for index in range(size)],
+                "services": [{"name": "Service {}-{}".format(size, index), "price": 100 + index} for index in range(size)],
+                "hours": [
+                    {"day": "Day {}".format(index), "opening_time": "08:{:02d}".format(size), "closing_time": "18:00"}
+                    for index in range(size)
+                ],
+                "comments": [
+                    {"text": "Review {}-{}".format(size, index), "rating": 1 + index % 5, "type": "shop"}
+                    for index in range(size)
+                ],
+            }
+            response, queries = self.measure("patch", path, data)
+            self.assertEqual(len(response.data["services"]), self.barbershop.services.count())
+            counts.append(queries)
+        self.assertEqual(counts[0], counts[-1], "barbershop update queries grow with the rows: {}".format(counts))
+        self.assertLessEqual(counts[-1], 50, "barbershop update ran {} queries".format(counts[-1]))
+
+    def test_map_clusters(self):
+        self.assertBudget(
+            "map clusters", 1, "/api/barbershop/map_clusters/?south=4&west=116&north=21&east=127&zoom=6"
+        )
+
+
+class MediaUploadTest(TestCase):
+    """
+    The upload pipeline with the content addressed storage standing in for
+    Google Drive.
+    """
+    def setUp(self):
+        staging, remote = tempfile.mkdtemp(), tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, staging)
+        self.addCleanup(shutil.rmtree, remote)
+        cache_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_root)
+        settings = override_settings(
+            MEDIA_STAGING_ROOT=staging, MEDIA_UPLOAD_WORKERS=0, MEDIA_CACHE_ROOT=cache_root,
+            MEDIA_STORAGE="api.storage.ContentAddressedStorage", MEDIA_ROOT=remote
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.client = APIClient()
+        banner = io.BytesIO()
+        Image.new("RGB", (16, 8), "red").save(banner, "PNG")
+        self.banner = banner.getvalue()
+
+    def create_barbershop(self, content=None):
+        return Barbershop.objects.create(
+            name="Kanto", address="1 Street", latitude=14.6, longitude=121.0, postal_code="1000",
+            street="Street", barangay="Barangay", city="Manila",
+            photo=SimpleUploadedFile("banner.PNG", content or self.banner, content_type="image/png")
+        )
+
+    def test_upload_is_staged_then_copied(self):
+        barbershop = self.create_barbershop()
+        staged = barbershop.photo.name
+        self.assertTrue(staged.startswith(PENDING_PREFIX))
+        response = self.client.get(barbershop.photo.url)
+        self.assertEqual(b"".join(response.streaming_content), self.banner)
+
+        upload = MediaUpload.objects.get()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertTrue(process_upload(upload.pk))
+        barbershop.refresh_from_db()
+        self.assertFalse(barbershop.photo.name.startswith(PENDING_PREFIX))
+        self.assertTrue(barbershop.photo.name.endswith(".png"))
+        self.assertEqual(media_storage.remote.open(barbershop.photo.name).read(), self.banner)
+        self.assertFalse(media_storage.exists(staged))
+        self.assertEqual(barbershop.version, 2)
+        self.assertEqual(MediaUpload.objects.get().status, MediaUpload.DONE)
+        response = self.client.get(barbershop.photo.url)
+        self.assertEqual(response["Content-Type"], "image/png")
+        self.assertEqual(b"".join(response.streaming_content), self.banner)
+
+    def test_identical_uploads_are_stored_once(self):
+        first, second = self.create_barbershop(), self.create_barbershop()
+        for upload in MediaUpload.objects.all():
+            self.assertTrue(process_upload(upload.pk))
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual(first.photo.name, second.photo.name)
+        # Not counting the variants stored alongside
+        originals = [name for _, _, files in os.walk(media_storage.remote.location) for name in files if name.endswith(".png")]
+        self.assertEqual(len(originals), 1)
+
+    def test_replaced_upload_is_discarded(self):
+        barbershop = self.create_barbershop()
+        first = MediaUpload.objects.get()
+        barbershop.photo = SimpleUploadedFile("other.png", b"other", content_type="image/png")
+        barbershop.save()
+
+        self.assertFalse(process_upload(first.pk))
+        self.assertEqual(MediaUpload.objects.get(pk=first.pk).status, MediaUpload.DISCARDED)
+        self.assertFalse(media_storage.exists(first.name))
+        self.assertEqual(os.listdir(media_storage.remote.location), [])
+        self.assertFalse(process_upload(first.pk))
+
+    def test_photo_variants(self):
+        banner = io.BytesIO()
+        Image.new("RGB", (2000, 1000), "red").save(banner, "PNG")
+        barbershop = self.create_barbershop(banner.getvalue())
+        self.assertTrue(process_upload(MediaUpload.objects.get().pk))
+        barbershop.refresh_from_db()
+        self.assertEqual(
+            {name: (image["width"], image["height"]) for name, image in barbershop.photo_variants.items()},
+            {"thumbnail": (160, 160), "list": (480, 240), "detail": (1280, 640)}
+        )
+
+        self.client.force_authenticate(User.objects.create_user("customer"))
+        data = self.client.get("/api/barbershop/{}/".format(barbershop.pk)).data["photo_variants"]
+        response = self.client.get(data["list"]["url"])
+        self.assertEqual(response["Content-Type"], "image/webp")
+        self.assertEqual(Image.open(io.BytesIO(b"".join(response.streaming_content))).size, (480, 240))
+        # Served from the remote storage once evicted from the local cache
+        empty_cache = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, empty_cache)
+        with override_settings(MEDIA_CACHE_ROOT=empty_cache):
+            self.assertEqual(self.client.get(data["detail"]["url"]).status_code, 200)
+
+
+class CachedAuthenticationTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("customer", password="secret")
+        Profile.objects.create(user=self.user, account_type="user")
+        response = self.client.post("/api/token/", {"username": "customer", "password": "secret"})
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION="Bearer {}".format(response.data["access"]))
+
+    def user_queries(self, queries):
+        return [query["sql"] for query in queries if 'FROM "auth_user"' in query["sql"]]
+
+    def test_token_claims_replace_user_query(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get("/api/barbershop/favorite_user/").status_code, 200)
+        self.assertEqual(self.user_queries(queries), [])
+
+    def test_changed_user_is_reloaded(self):
+        self.assertEqual(self.client.get("/api/barbershop/favorite_user/").status_code, 200)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get("/api/barbershop/favorite_user/").status_code, 401)
+
+    def test_claims_read_after_change_are_trusted(self):
+        # In the same second as the change
+        authentication.forget_user(self.user.pk)
+        token = MyTokenObtainPairSerializer.get_token(self.user).access_token
+        self.client.credentials(HTTP_AUTHORIZATION="Bearer {}".format(token))
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get("/api/barbershop/favorite_user/").status_code, 200)
+        self.assertEqual(self.user_queries(queries), [])
+
+    def test_old_change_times_are_dropped(self):
+        start = time.time()
+        with override_settings(AUTH_USER_CACHE_TTL=1), mock.patch("api.authentication.time.time") as now:
+            now.return_value = start + 10
+            authentication.forget_user(self.user.pk)
+            now.return_value += 2
+            authentication.forget_user(0)
+        self.assertNotIn(self.user.pk, authentication._changed)
+
+    def test_stale_claims_are_reloaded(self):
+        with override_settings(AUTH_USER_CACHE_TTL=0), CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get("/api/barbershop/favorite_user/").status_code, 200)
+        self.assertEqual(len([query for query in queries if '"api_profile"' in query["sql"]]), 1)
+
+    def test_password_rehashed_at_configured_cost(self):
+        with override_settings(PASSWORD_HASH_ITERATIONS=1000):
+            response = self.client.post("/api/token/", {"username": "customer", "password": "secret"})
+            self.assertEqual(response.status_code, 200)
+            self.user.refresh_from_db()
+            self.assertTrue(self.user.password.startswith("pbkdf2_sha256$1000$"))
+
+    def test_only_credential_requests_are_offloaded(self):
+        requests = {
+            ("POST", "/api/token/"): True,
+            ("POST", "/api/token/refresh/"): False,
+            ("POST", "/api/profile/"): True,
+            ("GET", "/api/profile/"): False,
+            ("PATCH", "/api/profile/3/"): True,
+            ("GET", "/api/profile/3/"): False,
+        }
+        for (method, path), offloaded in requests.items():
+            self.assertIs(is_credential_request({"type": "http", "method": method, "path": path}), offloaded, path)
+
+    def test_login_does_not_hold_up_other_requests(self):
+        # Django runs the sync views of an ASGI deployment on one shared
+        # thread; the login waits for a request that arrives after it
+        other_done = threading.Event()
+
+        @sync_to_async
+        def view(path):
+            if path == "/api/token/":
+                return other_done.wait(1)
+            other_done.set()
+
+        async def application(scope, receive, send):
+            return await view(scope["path"])
+
+        async def serve():
+            served = offload_credentials(application)
+            login = asyncio.ensure_future(served({"type": "http", "method": "POST", "path": "/api/token/"}, None, None))
+            await asyncio.sleep(0.05)
+            await served({"type": "http", "method": "GET", "path": "/api/barbershop/"}, None, None)
+            return await login
+
+        with mock.patch("api.hashers._semaphore", None):
+            self.assertTrue(asyncio.run(serve()))
+
+
+class RatingAggregateTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("customer")
+        self.barbershop = Barbershop.objects.create(
+            name="Kanto", address="1 Street", latitude=14.6, longitude=121.0, postal_code="1000",
+            street="Street", barangay="Barangay", city="Manila", verified=True
+        )
+        self.comments = [
+            Comments.objects.create(text="Review", rating=rating, type="shop", user=self.user) for rating in (5, 4, 2)
+        ]
+
+    def assertRating(self, rating, count, histogram):
+        barbershop = Barbershop.objects.get(pk=self.barbershop.pk)
+        self.assertEqual((barbershop.rating, barbershop.rating_count), (rating, count))
+        self.assertEqual([getattr(barbershop, field) for field in RATING_HISTOGRAM_FIELDS], histogram)
+
+    def test_reviews_added_and_removed(self):
+        self.barbershop.comments.add(*self.comments)
+        self.assertRating(3.67, 3, [0, 1, 0, 1, 1])
+        self.barbershop.comments.remove(self.comments[0])
+        self.assertRating(3.0, 2, [0, 1, 0, 1, 0])
+        self.comments[1].rating = 1
+        self.comments[1].save()
+        self.assertRating(1.5, 2, [1, 1, 0, 0, 0])
+        self.comments[2].delete()
+        self.assertRating(1.0, 1, [1, 0, 0, 0, 0])
+        self.barbershop.comments.clear()
+        self.assertRating(0.0, 0, [0, 0, 0, 0, 0])
+
+    def test_rebuild_matches_incremental_ratings(self):
+        self.barbershop.comments.add(self.comments[0], self.comments[1])
+        Barbershop.objects.filter(pk=self.barbershop.pk).update(rating=5, rating_sum=0, rating_count=0)
+        rebuild_ratings(Barbershop)
+        self.assertRating(4.5, 2, [0, 0, 0, 1, 1])
+        self.barbershop.comments.clear()
+        Barbershop.objects.filter(pk=self.barbershop.pk).update(rating=5)
+        rebuild_ratings(Barbershop)
+        self.assertRating(0.0, 0, [0, 0, 0, 0, 0])
+
+    def test_removing_unlinked_review_changes_nothing(self):
+        self.barbershop.comments.add(self.comments[1])
+        self.barbershop.comments.remove(self.comments[0], self.comments[1])
+        self.barbershop.comments.remove(self.comments[1])
+        self.assertRating(0.0, 0, [0, 0, 0, 0, 0])
+        self.comments[0].comments.remove(self.barbershop)
+        self.assertRating(0.0, 0, [0, 0, 0, 0, 0])
+
+
+class LeaderboardTest(TestCase):
+    def setUp(self):
+        self.barbershops = [
+            Barbershop.objects.create(
+                name="Shop {}".format(index), address="1 Street", latitude=14.6, longitude=121.0, postal_code="1000",
+                street="Street", barangay="Barangay", city="Quezon City", rating=index, verified=True
+            )
+            for index in range(1, 4)
+        ]
+
+    def test_shop_moving_city_leaves_its_board(self):
+        self.assertEqual(leaderboard.get_leaderboard("Quezon City"), [shop.pk for shop in reversed(self.barbershops)])
+        moved = Barbershop.objects.get(pk=self.barbershops[0].pk)
+        moved.city = "Makati"
+        moved.save()
+        self.assertEqual(leaderboard.get_leaderboard("Quezon City"), [self.barbershops[2].pk, self.barbershops[1].pk])
+        self.assertEqual(leaderboard.get_leaderboard("Makati"), [moved.pk])
+
+    def test_unranked_change_keeps_board(self):
+        leaderboard.get_leaderboard("Quezon City")
+        barbershop = Barbershop.objects.get(pk=self.barbershops[0].pk)
+        barbershop.description = "Fades"
+        with CaptureQueriesContext(connection) as queries:
+            barbershop.save()
+        self.assertFalse([query for query in queries if "api_leaderboardentry" in query["sql"]])
+
+    def test_concurrently_created_board_is_kept(self):
+        # Another refresh inserted the board first, as if between the lock
+        # and the insert
+        LeaderboardEntry.objects.all().delete()
+        with mock.patch.object(LeaderboardEntry.objects, "bulk_create", side_effect=IntegrityError):
+            leaderboard.refresh_leaderboard("Quezon City")
+        self.assertEqual(LeaderboardEntry.objects.count(), 0)
+
+    def test_responses_are_cached_per_host(self):
+        Barbershop.objects.filter(pk=self.barbershops[2].pk).update(photo="banners/shop.png")
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user("customer"))
+        for host in ("a.example.com", "b.example.com"):
+            with override_settings(ALLOWED_HOSTS=[host], MEDIA_STORAGE="api.storage.ContentAddressedStorage"):
+                data = client.get("/api/barbershop/top_rated/", HTTP_HOST=host).data
+            self.assertTrue(data[0]["photo"].startswith("http://{}/".format(host)), data[0]["photo"])
+
+    def test_cache_key_is_memcached_safe(self):
+        key = leaderboard.cache_key(leaderboard.current_period(), "Las Piñas City")
+        self.assertRegex(key, r"^[\x21-\x7e]+$")
+        self.assertNotEqual(key, leaderboard.cache_key(leaderboard.current_period(), "Las Pinas City"))
+
+
+class BookingTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("customer")
+        self.other = User.objects.create_user("other")
+        self.barbershop = Barbershop.objects.create(
+            name="Kanto", address="1 Street", latitude=14.6, longitude=121.0, postal_code="1000",
+            street="Street", barangay="Barangay", city="Manila"
+        )
+        self.date = timezone.localdate() + datetime.timedelta(days=3)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def book(self, time, user=None):
+        self.client.force_authenticate(user or self.user)
+        return self.client.post(
+            "/api/barbershop/{}/add_appointment/".format(self.barbershop.pk),
+            {"date": self.date.isoformat(), "time": time}, format="json"
+        )
+
+    def slots(self, appointment_id):
+        return list(AppointmentSlot.objects.filter(appointment_id=appointment_id).order_by("slot").values_list("date", "slot"))
+
+    def test_overlapping_booking_is_rejected(self):
+        self.assertEqual(self.book("10:00").status_code, 200)
+        self.assertEqual(self.book("10:30", self.other).status_code, 400)
+        self.assertEqual(self.book("11:00", self.other).status_code, 200)
+        self.assertEqual(AppointmentSlot.objects.count(), 8)
+
+    def test_reschedule_moves_slots(self):
+        self.book("10:00")
+        appointment = Appointment.objects.get()
+        response = self.client.patch("/api/appointment/{}/".format(appointment.pk), {"time": "13:15"}, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.slots(appointment.pk), [(self.date, slot) for slot in range(53, 57)])
+
+    def test_reschedule_onto_taken_slot_conflicts(self):
+        self.book("10:00")
+        self.book("12:00", self.other)
+        appointment = Appointment.objects.get(user=self.other)
+        response = self.client.patch("/api/appointment/{}/".format(appointment.pk), {"time": "10:45"}, format="json")
+        self.assertEqual(response.status_code, 409)
+        appointment.refresh_from_db()
+        self.assertEqual(appointment.time, datetime.time(12))
+        self.assertEqual(self.slots(appointment.pk), [(self.date, slot) for slot in range(48, 52)])
+
+    @override_settings(STATICFILES_STORAGE="django.contrib.staticfiles.storage.StaticFilesStorage")
+    def test_admin_saves_claim_slots(self):
+        admin = User.objects.create_superuser("admin", password="secret")
+        self.client.force_login(admin)
+        self.book("10:00")
+        data = {"barbershop": self.barbershop.pk, "user": self.other.pk, "date": self.date.isoformat(), "status": "pending"}
+        response = self.client.post("/admin/api/appointment/add/", dict(data, time="10:30"))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, SlotTaken.default_detail)
+        response = self.client.post("/admin/api/appointment/add/", dict(data, time="14:00"))
+        self.assertEqual(response.status_code, 302)
+        appointment = Appointment.objects.get(user=self.other)
+        self.assertEqual(self.slots(appointment.pk), [(self.date, slot) for slot in range(56, 60)])
+        response = self.client.post("/admin/api/appointment/{}/change/".format(appointment.pk), dict(data, time="16:00"))
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.slots(appointment.pk), [(self.date, slot) for slot in range(64, 68)])
+
+
+class InboxTest(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user("owner")
+        self.customer = User.objects.create_user("customer")
+        self.barbershop = Barbershop.objects.create(
+            name="Kanto", address="1 Street", latitude=14.6, longitude=121.0, postal_code="1000",
+            street="Street", barangay="Barangay", city="Manila"
+        )
+        Profile.objects.create(user=self.owner, account_type="shop").barbershop.add(self.barbershop)
+        Profile.objects.create(user=self.customer, account_type="user")
+        Message.objects.create(barbershop=self.barbershop, user=self.customer, origin="user", text="Hello")
+        self.inbox = "/api/barbershop/{}/inbox/?origin=shop".format(self.barbershop.pk)
+        self.mark_read = "/api/barbershop/{}/mark_read/".format(self.barbershop.pk)
+        self.client = APIClient()
+
+    def test_owner_reads_inbox(self):
+        self.client.force_authenticate(self.owner)
+        self.assertEqual(self.client.get(self.inbox).data["results"][0]["unread"], 1)
+        response = self.client.post(self.mark_read, {"user": self.customer.pk, "origin": "shop"}, format="json")
+        self.assertEqual(response.data, {"read": 1})
+        self.assertEqual(self.client.get(self.inbox).data["results"][0]["unread"], 0)
+
+    def test_mark_read_changes_detail_etag(self):
+        self.client.force_authenticate(self.owner)
+        detail = "/api/barbershop/{}/?expand=messages".format(self.barbershop.pk)
+        etag = self.client.get(detail)["ETag"]
+        self.client.post(self.mark_read, {"user": self.customer.pk, "origin": "shop"}, format="json")
+        response = self.client.get(detail, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNotNone(json.loads(response.content)["messages"][0]["read_at"])
+
+    def test_inbox_is_closed_to_others(self):
+        data = {"user": self.customer.pk, "origin": "shop"}
+        self.assertEqual(self.client.get(self.inbox).status_code, 401)
+        self.assertEqual(self.client.post(self.mark_read, data, format="json").status_code, 401)
+        self.client.force_authenticate(self.customer)
+        self.assertEqual(self.client.get(self.inbox).status_code, 403)
+        self.assertEqual(self.client.post(self.mark_read, data, format="json").status_code, 403)
+        self.assertIsNone(Message.objects.get().read_at)
+
+
+class RedisBrokerTest(SimpleTestCase):
+    def closed_port(self):
+        server = socket.socket()
+        server.bind(("127.0.0.1", 0))
+        port = server.getsockname()[1]
+        server.close()
+        return port
+
+    def test_publish_is_sent_by_publisher_thread(self):
+        broker = RedisBroker("redis://127.0.0.1:{}".format(self.closed_port()))
+        with mock.patch.object(broker.client, "publish") as publish:
+            broker.publish("user:1", {"id": 1})
+            broker._outbox.join()
+        publish.assert_called_once_with("ptown:user:1", '{"channel": "user:1", "message": {"id": 1}}')
+
+    def test_unreachable_redis_does_not_hold_up_publish(self):
+        broker = RedisBroker("redis://127.0.0.1:{}".format(self.closed_port()))
+        with self.assertLogs("api.pubsub", "ERROR"):
+            start = time.perf_counter()
+            broker.publish("user:1", {"id": 1})
+            self.assertLess(time.perf_counter() - start, 0.1)
+            broker._outbox.join()
+        # Dropped without trying again until REDIS_RECONNECT_DELAY passes
+        with mock.patch.object(broker.client, "publish") as publish:
+            self.assertFalse(broker.send("user:1", "{}"))
+        publish.assert_not_called()
+
+    def test_pattern_messages_reach_local_subscribers(self):
+        broker = RedisBroker("redis://127.0.0.1:{}".format(self.closed_port()))
+
+        async def receive():
+            queue = LocalBroker.subscribe(broker, "user:1")
+            broker._dispatch({"type": "psubscribe", "pattern": None, "channel": b"ptown:*", "data": 1})
+            broker._dispatch({
+                "type": "pmessage", "pattern": b"ptown:*", "channel": b"ptown:user:1",
+                "data": b'{"channel": "user:1", "message": {"id": 1}}',
+            })
+            return await asyncio.wait_for(queue.get(), 1), queue.qsize()
+
+        self.assertEqual(asyncio.run(receive()), ({"id": 1}, 0))
+
+
+class SyncTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("customer")
+        self.barbershop = Barbershop.objects.create(
+            name="Kanto", address="1 Street", latitude=14.6, longitude=121.0, postal_code="1000",
+            street="Street", barangay="Barangay", city="Manila"
+        )
+        self.appointment = Appointment.objects.create(
+            barbershop=self.barbershop, user=self.user, date=timezone.localdate(), time=datetime.time(10)
+        )
+        Favorite.objects.create(barbershop=self.barbershop, user=self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_anonymous_sync_is_rejected(self):
+        self.client.force_authenticate(None)
+        self.assertEqual(self.client.get("/api/barbershop/sync/").status_code, 401)
+
+    def test_sync_returns_changes_and_tombstones(self):
+        data = self.client.get("/api/barbershop/sync/").data
+        self.assertTrue(data["appointments"]["reset"])
+        self.assertEqual([row["id"] for row in data["appointments"]["changed"]], [self.appointment.pk])
+        self.assertEqual([row["id"] for row in data["favorites"]["changed"]], [self.barbershop.pk])
+
+        message = Message.objects.create(barbershop=self.barbershop, user=self.user, origin="user", text="Hello")
+        appointment_id = self.appointment.pk
+        self.appointment.delete()
+        self.barbershop.favorites.remove(self.user)
+        cursors = {name: data[name]["cursor"] for name in ("appointments", "messages", "favorites")}
+        data = self.client.get("/api/barbershop/sync/", cursors).data
+        self.assertFalse(data["messages"]["reset"])
+        self.assertEqual([row["id"] for row in data["messages"]["changed"]], [message.pk])
+        self.assertEqual((data["appointments"]["changed"], data["appointments"]["deleted"]), ([], [appointment_id]))
+        self.assertEqual((data["favorites"]["changed"], data["favorites"]["deleted"]), ([], [self.barbershop.pk]))
+
+
+class BarbershopUpdateTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("owner")
+        self.barbershop = Barbershop.objects.create(
+            name="Kanto", address="1 Street", latitude=14.6, longitude=121.0, postal_code="1000",
+            street="Street", barangay="Barangay", city="Manila", verified=True
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_nested_update_applies_side_effects_once(self):
+        self.assertEqual(leaderboard.get_leaderboard("Manila"), [self.barbershop.pk])
+        response = self.client.patch("/api/barbershop/{}/".format(self.barbershop.pk), {
+            "city": "Makati",
+            "amenities": [{"name": "Aircon"}],
+            "services": [{"name": "Shave", "price": 150}],
+            "comments": [{"text": "Great", "rating": 4, "type": "shop"}],
+        }, format="json")
+        self.assertEqual(response.status_code, 200)
+        barbershop = Barbershop.objects.get(pk=self.barbershop.pk)
+        self.assertEqual((barbershop.version, barbershop.rating), (2, 4.0))
+        self.assertEqual(list(search.SearchResults("aircon shave")[0:10])[0][0], barbershop.pk)
+        self.assertEqual(leaderboard.get_leaderboard("Manila"), [])
+        self.assertEqual(LeaderboardEntry.objects.get(city="Makati").rating, 4.0)
+
+
+class ReplicaRoutingTest(TestCase):
+    """
+    Reads against a second SQLite file standing in for a replica that has
+    the shop but not yet its appointment.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("customer")
+        cls.barbershop = Barbershop.objects.create(
+            name="Kanto", address="1 Street", latitude=14.6, longitude=121.0, postal_code="1000",
+            street="Street", barangay="Barangay", city="Manila", verified=True
+        )
+        cls.barbershop.hours.add(OperationHours.objects.create(day="Monday", opening_time="09:00", closing_time="11:00"))
+        cls.monday = timezone.localdate() + datetime.timedelta(days=7 - timezone.localdate().weekday())
+        Appointment.objects.create(barbershop=cls.barbershop, user=cls.user, date=cls.monday, time=datetime.time(9))
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        handle, cls.replica = tempfile.mkstemp(suffix=".sqlite3")
+        os.close(handle)
+        connections.databases["replica1"] = dict(connections.databases["default"], NAME=cls.replica)
+        with connections["replica1"].schema_editor() as editor:
+            for model in (User, Barbershop, OperationHours, Appointment):
+                editor.create_model(model)
+        for model, rows in ((User, [cls.user]), (Barbershop, [cls.barbershop])):
+            model.objects.using("replica1").bulk_create([
+                model(**{field.attname: getattr(row, field.attname) for field in model._meta.concrete_fields}) for row in rows
+            ])
+
+    @classmethod
+    def tearDownClass(cls):
+        connections["replica1"].close()
+        del connections["replica1"]
+        del connections.databases["replica1"]
+        os.remove(cls.replica)
+        super().tearDownClass()
+
+    def setUp(self):
+        patcher = mock.patch("api.routers.replicas", return_value=["replica1"])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_safe_actions_read_from_replica(self):
+        response = self.client.get("/api/barbershop/{}/get_appointment/".format(self.barbershop.pk))
+        self.assertEqual(response.data["results"], [])
+        with primary_reads():
+            self.assertEqual(ReplicaRouter().db_for_read(Appointment), DEFAULT_DB_ALIAS)
+
+    def test_cached_availability_is_read_from_primary(self):
+        response = self.client.get("/api/barbershop/{}/availability/".format(self.barbershop.pk), {
+            "start": self.monday.isoformat(), "end": self.monday.isoformat()
+        })
+        self.assertEqual(response.data[0]["slots"], ["10:00"])
+
+    def test_writer_is_pinned_to_primary(self):
+        middleware = ReadYourWritesMiddleware(lambda request: HttpResponse(status=201))
+        request = RequestFactory().post("/api/barbershop/")
+        request.user = self.user
+        middleware(request)
+        response = self.client.get("/api/barbershop/{}/get_appointment/".format(self.barbershop.pk))
+        self.assertEqual(len(response.data["results"]), 1)
+
+
+class KeysetPaginationTest(TestCase):
+    def setUp(self):
+        # Ties on the rating are broken by the id
+        self.barbershops = [
+            Barbershop.objects.create(
+                name="Kanto {}".format(index), address="1 Street", latitude=14.6, longitude=121.0, postal_code="1000",
+                street="Street", barangay="Barangay", city="Manila", verified=True, rating=index % 3
+            )
+            for index in range(7)
+        ]
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user("customer"))
+
+    def test_pages_follow_ordering_both_ways(self):
+        expected = [shop.pk for shop in sorted(self.barbershops, key=lambda shop: (-shop.rating, -shop.pk))]
+        pages, url = [], "/api/barbershop/?page_size=3"
+        while url:
+            data = self.client.get(url).data
+            pages.append([row["id"] for row in data["results"]])
+            url = data["next"]
+        self.assertEqual(pages, [expected[0:3], expected[3:6], expected[6:]])
+
+        data = self.client.get(self.client.get("/api/barbershop/?page_size=3").data["next"]).data
+        self.assertEqual([row["id"] for row in self.client.get(data["next"]).data["results"]], expected[6:])
+        previous = self.client.get(data["previous"]).data
+        self.assertEqual([row["id"] for row in previous["results"]], expected[0:3])
+        self.assertIsNone(previous["previous"])
+
+    def test_invalid_cursor_is_not_found(self):
+        self.assertEqual(self.client.get("/api/barbershop/", {"cursor": "garbage"}).status_code, 404)
+
+
+class FieldSelectionTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("owner")
+        self.barbershop = Barbershop.objects.create(
+            name="Kanto", address="1 Street", latitude=14.6, longitude=121.0, postal_code="1000",
+            street="Street", barangay="Barangay", city="Manila", verified=True
+        )
+        Profile.objects.create(user=self.user, account_type="barber").barbershop.add(self.barbershop)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_fields_keep_only_listed(self):
+        row = self.client.get("/api/barbershop/", {"fields": "name,latitude"}).data["results"][0]
+        self.assertEqual(set(row), {"name", "latitude"})
+
+    def test_relations_only_when_expanded(self):
+        row = self.client.get("/api/barbershop/").data["results"][0]
+        self.assertIn("name", row)
+        self.assertNotIn("services", row)
+        row = self.client.get("/api/barbershop/", {"expand": "services"}).data["results"][0]
+        self.assertEqual(row["services"], [])
+        self.assertNotIn("comments", row)
+
+    def test_dotted_paths_reach_nested_serializers(self):
+        data = self.client.get("/api/profile/", {"fields": "id,barbershop.name"}).data["results"]
+        self.assertEqual(data, [{"id": self.user.profile.pk, "barbershop": [{"name": "Kanto"}]}])
+
+
+class NearbyTest(TestCase):
+    def setUp(self):
+        def create(name, latitude, verified=True):
+            return Barbershop.objects.create(
+                name=name, address="1 Street", latitude=latitude, longitude=121.0, postal_code="1000",
+                street="Street", barangay="Barangay", city="Manila", verified=verified
+            )
+
+        # About 2 km south, in the grid row below, 0.5 km north and 10 km north
+        self.south = create("South", 14.582)
+        self.north = create("North", 14.6045)
+        create("Far", 14.69)
+        create("Unverified", 14.601, verified=False)
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user("customer"))
+
+    def test_nearest_first_within_radius(self):
+        data = self.client.get("/api/barbershop/nearby/", {"latitude": 14.6, "longitude": 121.0, "radius": 5}).data
+        self.assertEqual([row["id"] for row in data], [self.north.pk, self.south.pk])
+        self.assertAlmostEqual(data[0]["distance"], 0.5, places=2)
+        self.assertAlmostEqual(data[1]["distance"], 2.0, places=2)
+
+    def test_limit(self):
+        data = self.client.get("/api/barbershop/nearby/", {"latitude": 14.6, "longitude": 121.0, "radius": 50, "limit": 1}).data
+        self.assertEqual([row["id"] for row in data], [self.north.pk])
+
+
+class MapClusterTest(TestCase):
+    def setUp(self):
+        def create(latitude, longitude, rating, verified=True):
+            return Barbershop.objects.create(
+                name="Kanto", address="1 Street", latitude=latitude, longitude=longitude, postal_code="1000",
+                street="Street", barangay="Barangay", city="Manila", verified=verified, rating=rating
+            )
+
+        self.manila = create(14.6, 121.0, 4)
+        create(14.62, 121.02, 2)
+        create(14.61, 121.01, 5, verified=False)
+        create(10.3, 123.9, 3)
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user("customer"))
+
+    def clusters(self, **box):
+        data = self.client.get("/api/barbershop/map_clusters/", dict({"zoom": 6}, **box)).data
+        return sorted((row["count"], round(row["latitude"], 2), round(row["longitude"], 2), row["rating"]) for row in data)
+
+    def test_clusters_in_box(self):
+        self.assertEqual(
+            self.clusters(south=4, west=116, north=21, east=127),
+            [(1, 10.3, 123.9, 3.0), (2, 14.61, 121.01, 3.0)]
+        )
+        self.assertEqual(self.clusters(south=13, west=120, north=16, east=122), [(2, 14.61, 121.01, 3.0)])
+
+    def test_clusters_follow_shop_changes(self):
+        self.manila.latitude, self.manila.longitude = 10.32, 123.92
+        self.manila.save()
+        self.assertEqual(
+            self.clusters(south=4, west=116, north=21, east=127),
+            [(1, 14.62, 121.02, 2.0), (2, 10.31, 123.91, 3.5)]
+        )
+        self.manila.verified = False
+        self.manila.save()
+        self.assertEqual(
+            self.clusters(south=4, west=116, north=21, east=127),
+            [(1, 10.3, 123.9, 3.0), (1, 14.62, 121.02, 2.0)]
+        )
+
+
+class SearchTest(TestCase):
+    def setUp(self):
+        def create(name, description="", verified=True):
+            return Barbershop.objects.create(
+                name=name, description=description, address="1 Street", latitude=14.6, longitude=121.0,
+                postal_code="1000", street="Street", barangay="Barangay", city="Manila", verified=verified
+            )
+
+        self.described = create("Kanto", "Skin fades and tapers")
+        self.named = create("Fade Studio")
+        create("Fade House", verified=False)
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user("customer"))
+
+    def search(self, query):
+        return [row["id"] for row in self.client.get("/api/barbershop/search/", {"q": query}).data["results"]]
+
+    def test_name_outranks_description(self):
+        self.assertEqual(self.search("fade"), [self.named.pk, self.described.pk])
+
+    def test_terms_match_as_prefixes(self):
+        self.assertEqual(self.search("stud"), [self.named.pk])
+        self.assertEqual(self.search("taper studio"), [self.named.pk, self.described.pk])
+        self.assertEqual(self.search("?!"), [])
+
+    def test_relations_are_indexed(self):
+        self.described.services.create(name="Beard trim", price=150)
+        self.assertEqual(self.search("beard"), [self.described.pk])
+
+
+class ConditionalDetailTest(TestCase):
+    def setUp(self):
+        self.barbershop = Barbershop.objects.create(
+            name="Kanto", address="1 Street", latitude=14.6, longitude=121.0, postal_code="1000",
+            street="Street", barangay="Barangay", city="Manila", verified=True
+        )
+        self.detail = "/api/barbershop/{}/".format(self.barbershop.pk)
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user("customer"))
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    def test_unchanged_detail_is_not_modified(self):
+        response = self.client.get(self.detail)
+        self.assertEqual(response.status_code, 200)
+        with self.assertNumQueries(1):
+            not_modified = self.client.get(self.detail, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual((not_modified.status_code, not_modified["ETag"]), (304, response["ETag"]))
+        not_modified = self.client.get(self.detail, HTTP_IF_MODIFIED_SINCE=response["Last-Modified"])
+        self.assertEqual(not_modified.status_code, 304)
+        with self.assertNumQueries(1):
+            cached = self.client.get(self.detail)
+        self.assertEqual(cached.content, response.content)
+
+    def test_unknown_detail_is_not_found(self):
+        self.assertEqual(self.client.get("/api/barbershop/abc/").status_code, 404)
+        self.assertEqual(self.client.get("/api/barbershop/{}/".format(self.barbershop.pk + 1)).status_code, 404)
+
+    def test_variants_have_their_own_etag(self):
+        etag = self.client.get(self.detail)["ETag"]
+        response = self.client.get(self.detail, {"expand": "services"}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_change_invalidates_etag(self):
+        etag = self.client.get(self.detail, {"expand": "services"})["ETag"]
+        self.barbershop.services.create(name="Shave", price=150)
+        response = self.client.get(self.detail, {"expand": "services"}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([service["name"] for service in response.data["services"]], ["Shave"])
+
+
+class PrefetchPlanTest(TestCase):
+    def create_profiles(self, count):
+        for index in range(count):
+            user = User.objects.create_user("owner-{}-{}".format(count, index))
+            barbershop = Barbershop.objects.create(
+                name="Kanto", address="1 Street", latitude=14.6, longitude=121.0, postal_code="1000",
+                street="Street", barangay="Barangay", city="Manila"
+            )
+            barbershop.services.create(name="Shave", price=150)
+            Profile.objects.create(user=user, account_type="shop").barbershop.add(barbershop)
+
+    def test_plan_follows_serializer(self):
+        queryset = prefetch_queryset(Profile.objects.all(), ProfileListSerializer(expand="barbershop.services"))
+        self.assertEqual(queryset.query.select_related, {"user": {}})
+        self.assertEqual([lookup.prefetch_to for lookup in queryset._prefetch_related_lookups], ["barbershop"])
+        nested = queryset._prefetch_related_lookups[0].queryset
+        self.assertEqual([lookup.prefetch_to for lookup in nested._prefetch_related_lookups], ["services"])
+
+    def test_queries_do_not_grow_with_rows(self):
+        counts = []
+        for count in (2, 6):
+            Profile.objects.all().delete()
+            self.create_profiles(count)
+            serializer = ProfileListSerializer(many=True, expand="barbershop.services")
+            with CaptureQueriesContext(connection) as queries:
+                data = ProfileListSerializer(
+                    prefetch_queryset(Profile.objects.all(), serializer), many=True, expand="barbershop.services"
+                ).data
+            self.assertEqual([profile["barbershop"][0]["services"][0]["name"] for profile in data], ["Shave"] * count)
+            counts.append(len(queries))
+        self.assertEqual(counts, [3, 3])
+
+    def test_only_own_appointments_are_prefetched(self):
+        user, other = User.objects.create_user("customer"), User.objects.create_user("other")
+        barbershop = Barbershop.objects.create(
+            name="Kanto", address="1 Street", latitude=14.6, longitude=121.0, postal_code="1000",
+            street="Street", barangay="Barangay", city="Manila"
+        )
+        date = timezone.localdate() + datetime.timedelta(days=3)
+        own = Appointment.objects.create(barbershop=barbershop, user=user, date=date, time=datetime.time(10))
+        Appointment.objects.create(barbershop=barbershop, user=other, date=date, time=datetime.time(12))
+        client = APIClient()
+        client.force_authenticate(user)
+        with CaptureQueriesContext(connection) as queries:
+            data = client.get("/api/barbershop/appointment_user/").data
+        self.assertEqual([appointment["id"] for appointment in data[0]["appointments"]], [own.pk])
+        prefetch = [query["sql"] for query in queries if query["sql"].startswith('SELECT "api_appointment"')]
+        self.assertEqual(len(prefetch), 1)
+        self.assertIn('"api_appointment"."user_id" = {}'.format(user.pk), prefetch[0])
+
+
+@override_settings(METRICS_ENABLED=True, METRICS_TOKEN="secret")
+class MetricsTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user("customer"))
+
+    def test_server_timing_reports_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/api/barbershop/")
+        self.assertIn('desc="{} queries"'.format(len(queries)), response["Server-Timing"])
+        self.assertIn("total;dur=", response["Server-Timing"])
+
+    def test_metrics_require_token(self):
+        self.client.get("/api/barbershop/")
+        self.assertEqual(self.client.get("/metrics").status_code, 401)
+        response = self.client.get("/metrics", HTTP_AUTHORIZATION="Bearer secret")
+        self.assertEqual(response["Content-Type"], METRICS_CONTENT_TYPE)
+        self.assertIn('ptown_request_queries_count{view="barbershop-list",method="GET"}', response.content.decode())
+
+    def test_metrics_without_token_are_not_served(self):
+        with override_settings(METRICS_TOKEN=None):
+            self.assertEqual(self.client.get("/metrics").status_code, 404)
+
+    def test_disabled_metrics(self):
+        with override_settings(METRICS_ENABLED=False):
+            client = APIClient()
+            self.assertEqual(client.get("/metrics").status_code, 404)
+            self.assertNotIn("Server-Timing", client.get("/api/barbershop/"))
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = Histogram("test_seconds", "Test.", ("view",), (1, 5))
+        for value in (0.5, 1, 3, 10):
+            histogram.observe(value, "a")
+        self.assertEqual(histogram.collect()[2:], [
+            'test_seconds_bucket{view="a",le="1"} 2',
+            'test_seconds_bucket{view="a",le="5"} 3',
+            'test_seconds_bucket{view="a",le="+Inf"} 4',
+            'test_seconds_sum{view="a"} 14.5',
+            'test_seconds_count{view="a"} 4',
+        ])
+
+
+class AvailabilityTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("customer")
+        self.barbershop = Barbershop.objects.create(
+            name="Kanto", address="1 Street", latitude=14.6, longitude=121.0, postal_code="1000",
+            street="Street", barangay="Barangay", city="Manila"
+        )
+        self.hours = OperationHours.objects.create(day="Mon", opening_time="09:00", closing_time="13:00")
+        self.barbershop.hours.add(self.hours)
+        self.monday = timezone.localdate() + datetime.timedelta(days=7 - timezone.localdate().weekday())
+        self.path = "/api/barbershop/{}/availability/".format(self.barbershop.pk)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    def slots(self, start, end=None):
+        data = self.client.get(self.path, {"start": start.isoformat(), "end": (end or start).isoformat()}).data
+        return {day["date"]: day["slots"] for day in data}
+
+    def test_booked_slots_are_taken(self):
+        # Overlaps the 10:00 and 11:00 slots
+        Appointment.objects.create(barbershop=self.barbershop, user=self.user, date=self.monday, time=datetime.time(10, 30))
+        tuesday = self.monday + datetime.timedelta(days=1)
+        self.assertEqual(self.slots(self.monday, tuesday), {
+            self.monday.isoformat(): ["09:00", "12:00"], tuesday.isoformat(): []
+        })
+
+    def test_changes_invalidate_cached_slots(self):
+        self.assertEqual(self.slots(self.monday)[self.monday.isoformat()], ["09:00", "10:00", "11:00", "12:00"])
+        appointment = Appointment.objects.create(
+            barbershop=self.barbershop, user=self.user, date=self.monday, time=datetime.time(9)
+        )
+        self.assertEqual(self.slots(self.monday)[self.monday.isoformat()], ["10:00", "11:00", "12:00"])
+        appointment.delete()
+        self.hours.closing_time = datetime.time(11)
+        self.hours.save()
+        self.assertEqual(self.slots(self.monday)[self.monday.isoformat()], ["09:00", "10:00"])
+
+    def test_invalid_range(self):
+        response = self.client.get(self.path, {"start": self.monday.isoformat(), "end": "2000-01-01"})
+        self.assertEqual(response.status_code, 400)
+
+
+class ShopForeignKeyMigrationTest(TransactionTestCase):
+    """
+    0013 moves the appointment and message links from the join tables to
+    the new foreign keys, and back when reversed.
+    """
+    before = [("api", "0012_appointmentslot")]
+    after = [("api", "0013_appointment_message_barbershop")]
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def test_links_are_copied_both_ways(self):
+        apps = self.migrate(self.before)
+        Barbershop = apps.get_model("api", "Barbershop")
+        Appointment = apps.get_model("api", "Appointment")
+        Message = apps.get_model("api", "Message")
+        user = apps.get_model("auth", "User").objects.create(username="customer")
+        barbershop = Barbershop.objects.create(
+            name="Kanto", address="1 Street", latitude=14.6, longitude=121.0, postal_code="1000",
+            street="Street", barangay="Barangay", city="Manila"
+        )
+        linked = Appointment.objects.create(user=user, date=datetime.date(2021, 11, 1), time=datetime.time(10))
+        unlinked = Appointment.objects.create(user=user, date=datetime.date(2021, 11, 1), time=datetime.time(12))
+        message = Message.objects.create(user=user, origin="user", text="Hello")
+        barbershop.appointments.add(linked)
+        barbershop.messages.add(message)
+
+        apps = self.migrate(self.after)
+        appointments = apps.get_model("api", "Appointment").objects.order_by("pk").values_list("pk", "barbershop_id")
+        self.assertEqual(list(appointments), [(linked.pk, barbershop.pk), (unlinked.pk, None)])
+        self.assertEqual(apps.get_model("api", "Message").objects.get().barbershop_id, barbershop.pk)
+
+        apps = self.migrate(self.before)
+        barbershop = apps.get_model("api", "Barbershop").objects.get()
+        self.assertEqual(list(barbershop.appointments.values_list("pk", flat=True)), [linked.pk])
+        self.assertEqual(list(barbershop.messages.values_list("pk", flat=True)), [message.pk])
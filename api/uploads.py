@@ -0,0 +1,154 @@
+import datetime
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.apps import apps
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.db import close_old_connections, transaction
+from django.db.models import F, FileField, Q
+from django.dispatch import Signal
+from django.http import FileResponse, Http404
+from django.utils import timezone
+from . import images
+from .models import MediaUpload
+from .storage import QueuedStorage, media_storage
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_MAX_ATTEMPTS = 5
+# An upload claimed longer ago than this is assumed lost with its worker
+UPLOAD_STALE_AFTER = datetime.timedelta(minutes=10)
+
+# Sent with the model class, the instance's ``object_id`` and the ``field``
+# once the field points at the uploaded file.
+upload_finished = Signal()
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def queued_fields(instance):
+    return [
+        field for field in instance._meta.concrete_fields
+        if isinstance(field, FileField) and isinstance(field.storage, QueuedStorage)
+    ]
+
+
+def queue_uploads(instance):
+    """
+    Records a job for every staged file of a saved instance and hands the
+    new ones to the worker pool once the transaction commits.
+    """
+    for field in queued_fields(instance):
+        name = getattr(instance, field.attname).name
+        if not name or not field.storage.is_pending(name):
+            continue
+        upload, created = MediaUpload.objects.get_or_create(
+            name=name, defaults={"model": instance._meta.label_lower, "object_id": instance.pk, "field": field.name}
+        )
+        if created:
+            transaction.on_commit(lambda pk=upload.pk: schedule(pk))
+
+
+def schedule(upload_id):
+    global _executor
+    workers = getattr(settings, "MEDIA_UPLOAD_WORKERS", 0)
+    if not workers:
+        return
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="upload")
+    _executor.submit(run_upload, upload_id)
+
+
+def run_upload(upload_id):
+    close_old_connections()
+    try:
+        process_upload(upload_id)
+    except Exception:
+        logger.exception("Upload %s failed", upload_id)
+    finally:
+        close_old_connections()
+
+
+def claimable():
+    return Q(status__in=[MediaUpload.PENDING, MediaUpload.FAILED], attempts__lt=UPLOAD_MAX_ATTEMPTS) | Q(
+        status=MediaUpload.UPLOADING, updated_at__lt=timezone.now() - UPLOAD_STALE_AFTER
+    )
+
+
+def process_upload(upload_id):
+    """
+    Copies a staged file to the remote storage and points its model field
+    at the copy. Returns whether the field was updated.
+
+    The job is claimed with a conditional update so two workers never
+    upload the same file. A failed upload keeps the staged file for a
+    retry by ``process_uploads``.
+    """
+    claimed = MediaUpload.objects.filter(claimable(), pk=upload_id).update(
+        status=MediaUpload.UPLOADING, attempts=F("attempts") + 1, updated_at=timezone.now()
+    )
+    if not claimed:
+        return False
+    upload = MediaUpload.objects.get(pk=upload_id)
+    model = apps.get_model(upload.model)
+    storage = model._meta.get_field(upload.field).storage
+    current = model.objects.filter(pk=upload.object_id, **{upload.field: upload.name})
+
+    if not current.exists():
+        # Replaced or deleted before it was uploaded
+        storage.delete(upload.name)
+        upload.status = MediaUpload.DISCARDED
+        upload.save(update_fields=["status", "updated_at"])
+        return False
+
+    # Fields with a "<field>_variants" companion get resized copies, see
+    # api.images
+    variants_field = "{}_variants".format(upload.field)
+    changes = {}
+    try:
+        with storage.open(upload.name) as staged:
+            changes[upload.field] = storage.remote.save(storage.staged_name(upload.name), staged)
+            if hasattr(model, variants_field):
+                staged.seek(0)
+                changes[variants_field] = images.create_variants(storage.remote, staged)
+    except Exception as error:
+        upload.status = MediaUpload.FAILED
+        upload.error = str(error)
+        upload.save(update_fields=["status", "error", "updated_at"])
+        raise
+
+    with transaction.atomic():
+        updated = current.update(**changes)
+        upload.status = MediaUpload.DONE if updated else MediaUpload.DISCARDED
+        upload.uploaded_name = changes[upload.field]
+        upload.error = ""
+        upload.save(update_fields=["status", "uploaded_name", "error", "updated_at"])
+        if updated:
+            transaction.on_commit(lambda: upload_finished.send(
+                sender=model, object_id=upload.object_id, field=upload.field
+            ))
+    if not updated:
+        storage.remote.delete(changes[upload.field])
+    storage.delete(upload.name)
+    return bool(updated)
+
+
+def pending_uploads():
+    return MediaUpload.objects.filter(claimable()).order_by("created").values_list("pk", flat=True)
+
+
+def pending_media(request, path):
+    """
+    Serves a staged file until its upload is done.
+    """
+    storage = media_storage.local
+    try:
+        if not storage.exists(path):
+            raise Http404
+        return FileResponse(storage.open(path))
+    except SuspiciousFileOperation:
+        raise Http404
@@ -0,0 +1,64 @@
+import hashlib
+from django.core.cache import cache
+from django.db.models import F
+from django.utils import timezone
+from django.utils.http import http_date, parse_etags, parse_http_date_safe
+from .models import Barbershop
+
+# Rendered shop details are cached per version, so a bump makes the old
+# entries unreachable and the cache backend evicts them.
+DETAIL_CACHE_TIMEOUT = 60 * 60 * 24
+
+
+def bump_versions(barbershop_ids):
+    """
+    Marks shops as changed: their ETags change and cached details are no
+    longer served. ``barbershop_ids`` may be a list or an ids queryset.
+    """
+    if isinstance(barbershop_ids, (list, set, tuple)):
+        barbershop_ids = [pk for pk in barbershop_ids if pk is not None]
+        if not barbershop_ids:
+            return
+    Barbershop.objects.filter(pk__in=barbershop_ids).update(version=F("version") + 1, updated_at=timezone.now())
+
+
+def detail_etag(barbershop_id, version, request):
+    """
+    A strong ETag for a rendered shop detail. Besides the version it covers
+    everything else the bytes depend on: the negotiated media type, the host
+    used for absolute URLs and the query string (``fields``/``expand``).
+    """
+    variant = "|".join([
+        request.accepted_media_type or "",
+        request.get_host(),
+        "&".join(sorted(request.META.get("QUERY_STRING", "").split("&"))),
+    ])
+    return '"{}-{}-{}"'.format(barbershop_id, version, hashlib.sha1(variant.encode("utf-8")).hexdigest()[:16])
+
+
+def detail_headers(etag, updated_at):
+    return {"ETag": etag, "Last-Modified": http_date(updated_at.timestamp())}
+
+
+def not_modified(request, etag, updated_at):
+    """
+    Evaluates If-None-Match, or If-Modified-Since when it is absent.
+    """
+    if_none_match = request.META.get("HTTP_IF_NONE_MATCH")
+    if if_none_match:
+        etags = parse_etags(if_none_match)
+        return "*" in etags or etag in etags
+    if_modified_since = parse_http_date_safe(request.META.get("HTTP_IF_MODIFIED_SINCE", ""))
+    return if_modified_since is not None and int(updated_at.timestamp()) <= if_modified_since
+
+
+def detail_cache_key(etag):
+    return "barbershop-detail:{}".format(etag.strip('"'))
+
+
+def get_cached_detail(etag):
+    return cache.get(detail_cache_key(etag))
+
+
+def cache_detail(etag, response):
+    cache.set(detail_cache_key(etag), (response.content, response["Content-Type"]), DETAIL_CACHE_TIMEOUT)
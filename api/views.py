@@ -1,4 +1,5 @@
 from django.contrib.auth.models import User
+from django.http import Http404, HttpResponse, HttpResponseNotModified
 from django_filters import rest_framework as filters
 from drf_spectacular.utils import extend_schema
 from rest_framework import serializers, status, viewsets, permissions
@@ -10,14 +11,29 @@ from .serializers import (
     AppointmentIDSerializer,
     AppointmentsSerializer,
     AppointmentsUpdateSerializer,
+    AvailabilityQuerySerializer,
+    AvailabilitySerializer,
     BarbershopSerializer, 
     BarbershopListSerializer,
     BarbershopListUserSerializer,
+    BarbershopNearbySerializer,
+    BarbershopSearchSerializer,
+    ClusterQuerySerializer,
+    MapClusterSerializer,
     BarbershopCreateSerializer,
     BarbershopUpdateSerializer,
+    LeaderboardQuerySerializer,
     MessagesCreateSerializer,
     MessagesListSerializer,
+    MessagesReadResultSerializer,
+    MessagesReadSerializer,
+    InboxQuerySerializer,
+    InboxSerializer,
     MessagesUserSerializer,
+    NearbyQuerySerializer,
+    SearchQuerySerializer,
+    SyncQuerySerializer,
+    SyncSerializer,
     # Profile
     ProfileSerializer,
     ProfileListSerializer,
@@ -30,8 +46,45 @@ from .serializers import (
 from .models import (
     Appointment,
     Barbershop, 
-    Profile
+    Favorite,
+    Message,
+    Profile,
+    Tombstone
 )
+from . import clusters, geo, leaderboard, search, versions
+from .availability import free_slots
+from .booking import book_appointment
+from .inbox import inbox_threads, mark_thread_read
+from .pagination import (
+    AppointmentPagination,
+    BarbershopPagination,
+    InboxPagination,
+    MessagePagination,
+    ProfilePagination,
+    SearchPagination
+)
+from .permissions import IsBarbershopOwner
+from .prefetch import prefetch_queryset
+from .routers import ReplicaReadMixin
+from .sync import collection_changes, sync_cursor
+
+
+class PrefetchMixin:
+    """
+    Eager loads querysets for the serializer an action renders with, honouring
+    the ``fields``/``expand`` selection of the current request.
+    """
+    prefetch_serializer_classes = {}
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        serializer_class = self.prefetch_serializer_classes.get(self.action)
+        if serializer_class is not None:
+            queryset = self.prefetch(queryset, serializer_class)
+        return queryset
+
+    def prefetch(self, queryset, serializer_class, querysets=None):
+        return prefetch_queryset(queryset, serializer_class(context=self.get_serializer_context()), querysets)
 
 
 class MyTokenObtainPairView(TokenObtainPairView):
@@ -59,7 +112,7 @@ class BarbershopFilter(filters.FilterSet):
         ]
 
 
-class BarbershopViewSet(viewsets.ModelViewSet):
+class BarbershopViewSet(ReplicaReadMixin, PrefetchMixin, viewsets.ModelViewSet):
     """
     A viewset that provides the standard actions for Amenities object
     """
@@ -68,7 +121,18 @@ class BarbershopViewSet(viewsets.ModelViewSet):
     filter_backends = (filters.DjangoFilterBackend,)
     permission_classes = [permissions.AllowAny]
     filterset_class = BarbershopFilter
+    pagination_class = BarbershopPagination
     http_method_names = ['get', 'post', 'patch', 'delete', 'head', 'options', 'trace']
+    prefetch_serializer_classes = {
+        "list": BarbershopListSerializer,
+        "retrieve": BarbershopSerializer,
+    }
+    # Sync stays on the primary, a lagging replica could move its cursors
+    # past changes it has not seen yet
+    replica_actions = (
+        "list", "retrieve", "favorite_user", "barbershop_of_the_month", "top_rated", "nearby", "search",
+        "map_clusters", "availability", "get_appointment", "appointment_user", "inbox", "messages_barber",
+    )
 
     @extend_schema(
         request=BarbershopCreateSerializer,
@@ -93,12 +157,44 @@ class BarbershopViewSet(viewsets.ModelViewSet):
 
         page = self.paginate_queryset(queryset)
         if page is not None:
-            serializer = BarbershopListSerializer(page, many=True)
+            serializer = BarbershopListSerializer(page, many=True, context=self.get_serializer_context())
             return self.get_paginated_response(serializer.data)
 
-        serializer = BarbershopListSerializer(queryset, many=True)
+        serializer = BarbershopListSerializer(queryset, many=True, context=self.get_serializer_context())
         return Response(serializer.data)
 
+    def retrieve(self, request, *args, **kwargs):
+        """
+        Conditional GET on the shop's version: a matching If-None-Match (or
+        an If-Modified-Since not older than the last change) gets a 304
+        and unchanged details are served from the rendered-bytes cache.
+        """
+        try:
+            state = Barbershop.objects.filter(pk=kwargs["pk"]).values_list("version", "updated_at").first()
+        except (TypeError, ValueError):
+            raise Http404
+        if state is None:
+            raise Http404
+        version, updated_at = state
+        etag = versions.detail_etag(kwargs["pk"], version, request)
+        headers = versions.detail_headers(etag, updated_at)
+        if versions.not_modified(request, etag, updated_at):
+            response = HttpResponseNotModified()
+        else:
+            cached = versions.get_cached_detail(etag)
+            if cached is not None:
+                response = HttpResponse(cached[0], content_type=cached[1])
+            else:
+                response = super().retrieve(request, *args, **kwargs)
+                response.accepted_renderer = request.accepted_renderer
+                response.accepted_media_type = request.accepted_media_type
+                response.renderer_context = self.get_renderer_context()
+                response.render()
+                versions.cache_detail(etag, response)
+        for name, value in headers.items():
+            response[name] = value
+        return response
+
     @extend_schema(
         request=BarbershopUpdateSerializer,
         responses={200: BarbershopSerializer}
@@ -118,6 +214,7 @@ class BarbershopViewSet(viewsets.ModelViewSet):
 
     def perform_update(self, serializer):
         instance = serializer.save()
+        instance = prefetch_queryset(Barbershop.objects.all(), BarbershopSerializer).get(pk=instance.pk)
         return BarbershopSerializer(instance)
     
     @extend_schema(
@@ -136,13 +233,12 @@ class BarbershopViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=['POST'])
     def add_favorite_user(self, request, pk=None):
         barbershop = Barbershop.objects.get(pk=pk)
-        if request.user in barbershop.favorites.all():
+        if barbershop.favorites.filter(pk=request.user.pk).exists():
             barbershop.favorites.remove(request.user)
         else:
             barbershop.favorites.add(request.user)
-        barbershop.save()
-        barbers = request.user.favorites.all()
-        return Response(BarbershopListSerializer(barbers, many=True).data, status=status.HTTP_200_OK)
+        barbers = self.prefetch(request.user.favorites.all(), BarbershopListSerializer)
+        return Response(BarbershopListSerializer(barbers, many=True, context=self.get_serializer_context()).data, status=status.HTTP_200_OK)
 
     @extend_schema(
         request=None,
@@ -150,17 +246,108 @@ class BarbershopViewSet(viewsets.ModelViewSet):
     )
     @action(detail=False, methods=['GET'])
     def favorite_user(self, request):
-        barbershops = request.user.favorites.all()
-        return Response(BarbershopListSerializer(barbershops, many=True).data, status=status.HTTP_200_OK)
+        barbershops = self.paginate_queryset(self.prefetch(request.user.favorites.all(), BarbershopListSerializer))
+        return self.get_paginated_response(BarbershopListSerializer(barbershops, many=True, context=self.get_serializer_context()).data)
 
     @extend_schema(
         request=None,
+        parameters=[LeaderboardQuerySerializer],
         responses=BarbershopListSerializer
     )
     @action(detail=False, methods=['GET'])
     def barbershop_of_the_month(self, request):
-        barbershop = Barbershop.objects.order_by("-rating").first()
-        return Response(BarbershopListSerializer(barbershop).data, status=status.HTTP_200_OK)
+        serializer = LeaderboardQuerySerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+
+        def render(ranking):
+            barbershop = self.prefetch(Barbershop.objects.filter(pk__in=ranking[:1]), BarbershopListSerializer).first()
+            return BarbershopListSerializer(barbershop, context=self.get_serializer_context()).data
+
+        variant = ("barbershop_of_the_month", request.get_host(), request.query_params.urlencode())
+        data = leaderboard.cached_response(serializer.validated_data["city"], variant, render)
+        return Response(data, status=status.HTTP_200_OK)
+
+    @extend_schema(
+        request=None,
+        parameters=[LeaderboardQuerySerializer],
+        responses=BarbershopListSerializer(many=True)
+    )
+    @action(detail=False, methods=['GET'])
+    def top_rated(self, request):
+        serializer = LeaderboardQuerySerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+
+        def render(ranking):
+            barbershops = self.prefetch(Barbershop.objects.all(), BarbershopListSerializer).in_bulk(ranking)
+            return BarbershopListSerializer(
+                [barbershops[pk] for pk in ranking if pk in barbershops], many=True, context=self.get_serializer_context()
+            ).data
+
+        variant = ("top_rated", request.get_host(), request.query_params.urlencode())
+        data = leaderboard.cached_response(serializer.validated_data["city"], variant, render)
+        return Response(data, status=status.HTTP_200_OK)
+
+    @extend_schema(
+        description='Verified barbershops within a radius, nearest first',
+        parameters=[NearbyQuerySerializer],
+        responses=BarbershopNearbySerializer(many=True)
+    )
+    @action(detail=False, methods=['GET'])
+    def nearby(self, request):
+        serializer = NearbyQuerySerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        queryset = self.filter_queryset(Barbershop.objects.filter(verified=True))
+        results = geo.nearby(queryset, **serializer.validated_data)
+        barbershops = self.prefetch(Barbershop.objects.all(), BarbershopNearbySerializer).in_bulk([pk for _, pk in results])
+        for distance, pk in results:
+            barbershops[pk].distance = round(distance, 3)
+        data = BarbershopNearbySerializer(
+            [barbershops[pk] for _, pk in results], many=True, context=self.get_serializer_context()
+        ).data
+        return Response(data, status=status.HTTP_200_OK)
+
+    @extend_schema(
+        description='Full-text search over verified barbershops, best match first',
+        parameters=[SearchQuerySerializer],
+        responses=BarbershopSearchSerializer(many=True)
+    )
+    @action(detail=False, methods=['GET'], pagination_class=SearchPagination)
+    def search(self, request):
+        serializer = SearchQuerySerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        results = self.paginate_queryset(search.SearchResults(serializer.validated_data["q"]))
+        barbershops = self.prefetch(Barbershop.objects.all(), BarbershopSearchSerializer).in_bulk([pk for pk, _ in results])
+        for pk, rank in results:
+            barbershops[pk].rank = rank
+        data = BarbershopSearchSerializer(
+            [barbershops[pk] for pk, _ in results], many=True, context=self.get_serializer_context()
+        ).data
+        return self.get_paginated_response(data)
+
+    @extend_schema(
+        description='Verified barbershop clusters inside a bounding box at a map zoom level',
+        parameters=[ClusterQuerySerializer],
+        responses=MapClusterSerializer(many=True)
+    )
+    @action(detail=False, methods=['GET'])
+    def map_clusters(self, request):
+        serializer = ClusterQuerySerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        queryset = clusters.clusters_in_box(**serializer.validated_data)
+        return Response(MapClusterSerializer(queryset, many=True).data, status=status.HTTP_200_OK)
+
+    @extend_schema(
+        description='Free appointment slots per day between start and end (default: the next 7 days)',
+        parameters=[AvailabilityQuerySerializer],
+        responses=AvailabilitySerializer(many=True)
+    )
+    @action(detail=True, methods=['GET'])
+    def availability(self, request, pk=None):
+        serializer = AvailabilityQuerySerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        barbershop = Barbershop.objects.get(pk=pk)
+        days = free_slots(barbershop, serializer.validated_data["start"], serializer.validated_data["end"])
+        return Response(AvailabilitySerializer(days, many=True).data, status=status.HTTP_200_OK)
 
     @extend_schema(
         description='Add Appointment', 
@@ -173,11 +360,9 @@ class BarbershopViewSet(viewsets.ModelViewSet):
         barbershop = Barbershop.objects.get(pk=pk)
         serializer = AppointmentsSerializer(data=request.data, context={'request': request, 'barbershop': barbershop})
         serializer.is_valid(raise_exception=True)
-        appointment = serializer.save(user=request.user)
-        barbershop.appointments.add(appointment)
-        barbershop.save()
-        barber = barbershop.appointments.all()
-        return Response(AppointmentsSerializer(barber, many=True).data, status=status.HTTP_200_OK)
+        book_appointment(barbershop, serializer, request.user)
+        barber = self.prefetch(barbershop.appointments.all(), AppointmentsSerializer)
+        return Response(AppointmentsSerializer(barber, many=True, context=self.get_serializer_context()).data, status=status.HTTP_200_OK)
 
     @extend_schema(
         description='Cancel Appointment', 
@@ -191,21 +376,19 @@ class BarbershopViewSet(viewsets.ModelViewSet):
         serializer.is_valid(raise_exception=True)
         appointment = Appointment.objects.get(pk=serializer.validated_data.get("id"))
         barbershop = Barbershop.objects.get(pk=pk)
-        if appointment in barbershop.appointments.all():
-            barbershop.appointments.remove(appointment)
+        if appointment.barbershop_id == barbershop.pk:
             appointment.delete()
-        barbershop.save()
-        barbers = barbershop.appointments.all()
-        return Response(AppointmentsSerializer(barbers, many=True).data, status=status.HTTP_200_OK)
+        barbers = self.prefetch(barbershop.appointments.all(), AppointmentsSerializer)
+        return Response(AppointmentsSerializer(barbers, many=True, context=self.get_serializer_context()).data, status=status.HTTP_200_OK)
 
     @extend_schema(
         request=None,
         responses=AppointmentsSerializer
     )
-    @action(detail=True, methods=['GET'])
+    @action(detail=True, methods=['GET'], pagination_class=AppointmentPagination)
     def get_appointment(self, request, pk=None):
-        barbershops = Barbershop.objects.get(pk=pk).appointments.all()
-        return Response(AppointmentsSerializer(barbershops, many=True).data, status=status.HTTP_200_OK)
+        barbershops = self.paginate_queryset(self.prefetch(Barbershop.objects.get(pk=pk).appointments.all(), AppointmentsSerializer))
+        return self.get_paginated_response(AppointmentsSerializer(barbershops, many=True, context=self.get_serializer_context()).data)
     
     @extend_schema(
         request=None,
@@ -213,9 +396,41 @@ class BarbershopViewSet(viewsets.ModelViewSet):
     )
     @action(detail=False, methods=['GET'])
     def appointment_user(self, request):
-        barbershops = Barbershop.objects.filter(appointments__user=request.user).distinct()
+        barbershops = self.prefetch(
+            Barbershop.objects.filter(appointments__user=request.user).distinct(),
+            BarbershopListUserSerializer,
+            {"appointments": Appointment.objects.filter(user=request.user)}
+        )
         return Response(BarbershopListUserSerializer(barbershops, many=True, context={'request': request}).data, status=status.HTTP_200_OK)
 
+    @extend_schema(
+        description='Appointments, messages and favorites of the user created, updated or deleted since the cursors returned by the previous sync',
+        parameters=[SyncQuerySerializer],
+        responses=SyncSerializer
+    )
+    @action(detail=False, methods=['GET'], permission_classes=[permissions.IsAuthenticated])
+    def sync(self, request):
+        serializer = SyncQuerySerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        cursor = sync_cursor()
+        collections = {
+            "appointments": (Appointment.objects.filter(user=request.user), "updated_at", Tombstone.APPOINTMENT),
+            "messages": (Message.objects.filter(user=request.user), "updated_at", Tombstone.MESSAGE),
+            "favorites": (Favorite.objects.filter(user=request.user), "created", Tombstone.FAVORITE),
+        }
+        data = {}
+        for name, (queryset, timestamp_field, collection) in collections.items():
+            changed, deleted, reset = collection_changes(
+                queryset, timestamp_field, collection, request.user, serializer.validated_data.get(name)
+            )
+            data[name] = {"changed": changed, "deleted": deleted, "reset": reset, "cursor": cursor}
+        data["favorites"]["changed"] = Barbershop.objects.filter(pk__in=data["favorites"]["changed"].values("barbershop_id"))
+
+        sync = SyncSerializer(data, context=self.get_serializer_context())
+        for name, collection in data.items():
+            collection["changed"] = prefetch_queryset(collection["changed"], sync.fields[name].fields["changed"])
+        return Response(sync.data, status=status.HTTP_200_OK)
+
     @extend_schema(
         description='Add Message', 
         methods=["POST"],
@@ -226,38 +441,65 @@ class BarbershopViewSet(viewsets.ModelViewSet):
     def add_message(self, request, pk=None):
         serializer = MessagesCreateSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        message = serializer.save()
         barbershop = Barbershop.objects.get(pk=pk)
-        barbershop.messages.add(message)
-        barbershop.save()
-        barber = barbershop.messages.filter(user=message.user).order_by("-created")
-        return Response(MessagesListSerializer(barber, many=True).data, status=status.HTTP_200_OK)
+        message = serializer.save(barbershop=barbershop)
+        barber = self.prefetch(barbershop.messages.filter(user=message.user).order_by("-created"), MessagesListSerializer)
+        return Response(MessagesListSerializer(barber, many=True, context=self.get_serializer_context()).data, status=status.HTTP_200_OK)
 
     @extend_schema(
         request=MessagesUserSerializer,
         responses=MessagesListSerializer
     )
-    @action(detail=True, methods=['POST'])
+    @action(detail=True, methods=['POST'], pagination_class=MessagePagination)
     def messages_thread(self, request, pk=None):
         serializer = MessagesUserSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         user = User.objects.get(pk=serializer.validated_data.get("user"))
-        messages = Barbershop.objects.get(pk=pk).messages.filter(user=user).order_by("-created")
-        return Response(MessagesListSerializer(messages, many=True).data, status=status.HTTP_200_OK)
+        messages = self.paginate_queryset(self.prefetch(
+            Barbershop.objects.get(pk=pk).messages.filter(user=user),
+            MessagesListSerializer
+        ))
+        return self.get_paginated_response(MessagesListSerializer(messages, many=True, context=self.get_serializer_context()).data)
+
+    @extend_schema(
+        description='One row per customer with their last message and unread count, most recent first',
+        parameters=[InboxQuerySerializer],
+        responses=InboxSerializer(many=True)
+    )
+    @action(detail=True, methods=['GET'], pagination_class=InboxPagination, permission_classes=[IsBarbershopOwner])
+    def inbox(self, request, pk=None):
+        serializer = InboxQuerySerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        rows = self.paginate_queryset(inbox_threads(Barbershop.objects.get(pk=pk).pk, serializer.validated_data["origin"]))
+        return self.get_paginated_response(InboxSerializer(rows, many=True).data)
+
+    @extend_schema(
+        description='Mark the messages of a thread not sent from origin as read',
+        request=MessagesReadSerializer,
+        responses=MessagesReadResultSerializer
+    )
+    @action(detail=True, methods=['POST'], permission_classes=[IsBarbershopOwner])
+    def mark_read(self, request, pk=None):
+        serializer = MessagesReadSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        read = mark_thread_read(Barbershop.objects.get(pk=pk).pk, serializer.validated_data["user"], serializer.validated_data["origin"])
+        return Response(MessagesReadResultSerializer({"read": read}).data, status=status.HTTP_200_OK)
 
     @extend_schema(
+        description='Deprecated, use inbox and messages_thread',
         request=None,
-        responses=None
+        responses=None,
+        deprecated=True
     )
     @action(detail=True, methods=['GET'])
     def messages_barber(self, request, pk=None):
         data = {}
-        messages = Barbershop.objects.get(pk=pk).messages.all()
+        messages = self.prefetch(Barbershop.objects.get(pk=pk).messages.all(), MessagesListSerializer)
         for message in messages:
             name = "{} {}".format(message.user.first_name, message.user.last_name)
             if not name in data:
                 data[name] = []
-            data[name].append(MessagesListSerializer(message).data)
+            data[name].append(MessagesListSerializer(message, context=self.get_serializer_context()).data)
         return Response(data, status=status.HTTP_200_OK)
 
 
@@ -268,7 +510,7 @@ class ProfileFilter(filters.FilterSet):
         fields = ["user", "contact_number", "account_type"]
 
 
-class ProfileViewSet(viewsets.ModelViewSet):
+class ProfileViewSet(ReplicaReadMixin, PrefetchMixin, viewsets.ModelViewSet):
     """
     A viewset that provides the standard actions for Amenities object
     """
@@ -277,7 +519,13 @@ class ProfileViewSet(viewsets.ModelViewSet):
     permission_classes = [permissions.AllowAny]
     filter_backends = (filters.DjangoFilterBackend,)
     filterset_class = ProfileFilter
+    pagination_class = ProfilePagination
     http_method_names = ['get', 'post', 'patch', 'delete', 'head', 'options', 'trace']
+    prefetch_serializer_classes = {
+        "list": ProfileListSerializer,
+        "retrieve": ProfileSerializer,
+    }
+    replica_actions = ("list", "retrieve")
 
     @extend_schema(
         request=ProfileCreateSerializer,
@@ -302,10 +550,10 @@ class ProfileViewSet(viewsets.ModelViewSet):
 
         page = self.paginate_queryset(queryset)
         if page is not None:
-            serializer = ProfileListSerializer(page, many=True)
+            serializer = ProfileListSerializer(page, many=True, context=self.get_serializer_context())
             return self.get_paginated_response(serializer.data)
 
-        serializer = ProfileListSerializer(queryset, many=True)
+        serializer = ProfileListSerializer(queryset, many=True, context=self.get_serializer_context())
         return Response(serializer.data)
 
     @extend_schema(
@@ -2,6 +2,9 @@
 ASGI config for ptown project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+HTTP requests go to Django and websocket connections to the realtime push
+in ``api.realtime``. Logins and signups get threads of their own for
+password hashing, see ``api.hashers``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/3.2/howto/deployment/asgi/
@@ -13,4 +16,17 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ptown.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imported once Django is set up, it loads models
+from api.hashers import offload_credentials  # noqa: E402
+from api.realtime import websocket_application  # noqa: E402
+
+django_application = offload_credentials(django_application)
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'websocket':
+        await websocket_application(scope, receive, send)
+    else:
+        await django_application(scope, receive, send)
@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/3.2/ref/settings/
 
 from pathlib import Path
 from datetime import timedelta
+import dj_database_url
 import django_heroku
 import os
 
@@ -52,11 +53,13 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'api.routers.ReadYourWritesMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -93,6 +96,22 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+# Holds rendered shop details, availability and leaderboards; entries are
+# culled once MAX_ENTRIES is reached.
+
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get("CACHE_BACKEND", 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get("CACHE_LOCATION", 'ptown'),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.environ.get("CACHE_MAX_ENTRIES", 5000)),
+        },
+    }
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 
@@ -111,6 +130,18 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# Password hashing
+# PBKDF2 rounds of new hashes, stored ones are rehashed at the next login.
+# Under ASGI at most PASSWORD_HASH_WORKERS logins and signups hash at once.
+PASSWORD_HASHERS = [
+    'api.hashers.PBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+]
+PASSWORD_HASH_ITERATIONS = int(os.environ.get("PASSWORD_HASH_ITERATIONS", 260000))
+PASSWORD_HASH_WORKERS = int(os.environ.get("PASSWORD_HASH_WORKERS", 4))
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/3.2/topics/i18n/
@@ -140,9 +171,39 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 GOOGLE_DRIVE_STORAGE_JSON_KEY_FILE = None
 GOOGLE_DRIVE_STORAGE_MEDIA_ROOT = 'media'
 
+# Media storage
+# Backend uploads end up in, set up on first use: Google Drive by default, or
+# api.storage.ContentAddressedStorage to keep them on local disk under
+# MEDIA_ROOT, deduplicated by content.
+MEDIA_STORAGE = os.environ.get("MEDIA_STORAGE", "gdstorage.storage.GoogleDriveStorage")
+MEDIA_ROOT = os.environ.get("MEDIA_ROOT", BASE_DIR / 'media')
+
+# Media uploads
+# Files are staged on local disk and copied to MEDIA_STORAGE by a pool of
+# MEDIA_UPLOAD_WORKERS threads after the request; with 0 workers only the
+# process_uploads command copies them.
+MEDIA_STAGING_ROOT = os.environ.get("MEDIA_STAGING_ROOT", BASE_DIR / 'staging')
+MEDIA_UPLOAD_WORKERS = int(os.environ.get("MEDIA_UPLOAD_WORKERS", 2))
+# Local least recently used cache of the resized photo variants
+MEDIA_CACHE_ROOT = os.environ.get("MEDIA_CACHE_ROOT", BASE_DIR / 'media-cache')
+MEDIA_CACHE_MAX_BYTES = int(os.environ.get("MEDIA_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+
 # Django Heroku Package
 django_heroku.settings(locals())
 
+# Read replicas
+# Comma separated database URLs of read-only copies of the default database,
+# e.g. sqlite:///replica.sqlite3 for a copy of the local one. Safe reads of
+# the shop and profile endpoints are spread over them; a user who wrote
+# reads from the primary for READ_YOUR_WRITES_SECONDS, see api.routers.
+for index, url in enumerate(filter(None, os.environ.get("DATABASE_REPLICA_URLS", "").split(","))):
+    DATABASES["replica{}".format(index + 1)] = dict(
+        dj_database_url.parse(url.strip(), conn_max_age=DATABASES["default"].get("CONN_MAX_AGE", 0)),
+        TEST={"MIRROR": "default"},
+    )
+DATABASE_ROUTERS = ['api.routers.ReplicaRouter']
+READ_YOUR_WRITES_SECONDS = int(os.environ.get("READ_YOUR_WRITES_SECONDS", 5))
+
 # REST Framework
 REST_FRAMEWORK = {
     'DEFAULT_SCHEMA_CLASS': (
@@ -152,11 +213,12 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.IsAuthenticated',
     ],
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'api.authentication.CachedJWTAuthentication',
     ),
     'DEFAULT_FILTER_BACKENDS': (
         'django_filters.rest_framework.DjangoFilterBackend',
     ),
+    'DEFAULT_PAGINATION_CLASS': 'api.pagination.KeysetPagination',
 }
 
 # SPECTACULAR 
@@ -170,4 +232,19 @@ SPECTACULAR_SETTINGS = {
 # Simple JWT
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=60),
-}
\ No newline at end of file
+}
+# Seconds a token's user claims, or a user loaded for a token, are trusted
+# before the user is read from the database again
+AUTH_USER_CACHE_TTL = int(os.environ.get("AUTH_USER_CACHE_TTL", 60))
+
+# Realtime
+# Redis used to fan websocket events out across worker processes; without it
+# events only reach clients connected to the process that published them.
+REALTIME_REDIS_URL = os.environ.get("REDIS_URL")
+
+# Metrics
+# Per-request query count and timings, reported in Server-Timing headers
+# and at /metrics for Prometheus. METRICS_TOKEN protects the endpoint, which
+# is not served without one.
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "").lower() in ("1", "true", "yes")
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
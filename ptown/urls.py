@@ -23,6 +23,10 @@ from rest_framework_simplejwt.views import (
     TokenRefreshView,
 )
 from api import views
+from api.metrics import metrics_view
+from api.images import variant_media
+from api.storage import stored_media
+from api.uploads import pending_media
 
 router = DefaultRouter()
 router.register(r'barbershop', views.BarbershopViewSet, basename='barbershop')
@@ -36,5 +40,9 @@ urlpatterns = [
     path('api/', include(router.urls)),
     path('api/token/', views.MyTokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('api/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
+    path('metrics', metrics_view, name='metrics'),
+    path('media/pending/<path:path>', pending_media, name='pending-media'),
+    path('media/variants/<str:name>', variant_media, name='image-variant'),
+    path('media/files/<path:name>', stored_media, name='stored-media'),
     path('', SpectacularSwaggerView.as_view(url_name='schema'), name='swagger-ui'),
 ]